@@ -1,10 +1,37 @@
+"""Generate the synthetic fine-tuning datasets.
+
+Rows are produced in fixed-size shards. Each shard has its own random stream,
+seeded from (DATASET_SEED, dataset, shard index), so a shard is the same no
+matter which worker process generates it. Shards are written to temporary
+files and then shuffled out of core:
+- every row is dealt into a randomly chosen bucket file;
+- each bucket is shuffled in memory and streamed to the split files.
+The split of a row is decided by a hash of its normalized text, so duplicate
+texts never straddle train and test; duplicate rates per split are printed
+and saved to split_report.json. Memory stays bounded by SHARD_SIZE,
+SHUFFLE_BUCKET_ROWS and the number of distinct texts, and the output for a
+given seed is the same for any DATASET_WORKERS.
+"""
+
 import csv
+import hashlib
+import itertools
 import json
+import math
+import multiprocessing
 import os
 import random
-from datetime import datetime
-from typing import Dict, List, Tuple
+import shutil
+import sys
+import tempfile
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "services", "local-ai"))
 
+try:
+    import training_data  # noqa: E402
+except ImportError:  # pyarrow not installed
+    training_data = None
 
 BASE_DIR = os.path.dirname(__file__)
 RANDOM_SEED = int(os.getenv("DATASET_SEED", "42"))
@@ -13,6 +40,14 @@ DEFAULT_CLASSIFIER_COUNT = int(os.getenv("CLASSIFIER_COUNT", "1500"))
 DEFAULT_SFT_COUNT = int(os.getenv("SFT_COUNT", "1000"))
 DEFAULT_EMBEDDING_COUNT = int(os.getenv("EMBEDDING_COUNT", "1000"))
 
+SHARD_SIZE = int(os.getenv("SHARD_SIZE", "50000"))
+SHUFFLE_BUCKET_ROWS = int(os.getenv("SHUFFLE_BUCKET_ROWS", "250000"))
+WORKERS = int(os.getenv("DATASET_WORKERS", str(os.cpu_count() or 1)))
+# "group": keep duplicate texts but always in the same split; "drop": keep the first occurrence only.
+DEDUP = os.getenv("DEDUP", "group")
+# The same for the valid/test splits; "drop" by default so repeated rows do not weigh into the metrics.
+EVAL_DEDUP = os.getenv("EVAL_DEDUP", "drop")
+
 
 BUREAUS = ["Experian", "Equifax", "TransUnion"]
 ACCOUNT_TYPES = [
@@ -67,26 +102,202 @@ SYSTEM_EDU = "You are Credit AI. Provide clear, compliant educational explanatio
 SYSTEM_REFUSAL = "You are Credit AI. Compliance first. Do not provide legal advice or guarantees."
 
 
-def random_date(year_start: int = 2015, year_end: int = 2024) -> str:
-    year = random.randint(year_start, year_end)
-    month = random.randint(1, 12)
+CLASSIFIER_LABELS = [
+    "eligible",
+    "conditionally_eligible",
+    "not_eligible",
+    "insufficient_information",
+]
+
+SFT_CATEGORIES = ["eligibility", "education", "refusal"]
+
+# (title, questions that ask for it, unrelated questions that share its wording).
+# Titles and questions of a topic are positives; pairing them with the topic's own
+# distractors gives the negatives. Pairs never join two topics, so every topic is
+# its own connected component and can be placed in a single split as a whole.
+EMBEDDING_TOPICS = [
+    (
+        "Collection dispute eligibility",
+        [
+            "When is a collection account eligible for dispute under credit reporting rules?",
+            "Can I dispute a collection that lists the wrong creditor or balance?",
+            "Which collection accounts qualify for a credit report dispute?",
+            "Is a collection with an incorrect amount disputable?",
+        ],
+        [
+            "How do I set up a payment plan with a collection agency?",
+            "Can a collection agency call me at work?",
+        ],
+    ),
+    (
+        "Credit utilization impact",
+        [
+            "How does credit card utilization affect credit scores?",
+            "Why does a high card balance lower my score?",
+            "What utilization ratio is good for a credit score?",
+            "Does paying down revolving balances raise my score?",
+        ],
+        [
+            "How do I raise the credit limit on my card?",
+            "Which credit cards have no annual fee?",
+        ],
+    ),
+    (
+        "Charge-off meaning",
+        [
+            "What does a charge-off mean on a credit report?",
+            "Do I still owe a debt after it is charged off?",
+            "Why did my creditor charge off the account?",
+            "How is a charge-off different from a collection?",
+        ],
+        [
+            "How do I write off a business expense on my taxes?",
+            "What does it mean when a bank charges an overdraft fee?",
+        ],
+    ),
+    (
+        "Hard inquiry definition",
+        [
+            "What is a hard inquiry and how long does it impact credit?",
+            "How much does a hard credit check lower a score?",
+            "What is the difference between a hard and a soft inquiry?",
+            "How long do hard inquiries stay on a credit report?",
+        ],
+        [
+            "How do I request a copy of my credit report?",
+            "Can an employer check my background before hiring?",
+        ],
+    ),
+    (
+        "Metro 2 format",
+        [
+            "What is Metro 2 and why does it matter?",
+            "Which format do furnishers use to report accounts to the bureaus?",
+            "How do creditors send account data to credit bureaus?",
+            "What fields does a Metro 2 account record contain?",
+        ],
+        [
+            "What file format should I use to upload dispute documents?",
+            "How do I read the payment grid on my credit report?",
+        ],
+    ),
+    (
+        "Late payment reporting",
+        [
+            "How long does a late payment stay on a credit report?",
+            "Can a payment reported 30 days late be disputed if it was on time?",
+            "When does a creditor report a payment as late?",
+            "How much does one late payment hurt a score?",
+        ],
+        [
+            "How do I change the due date of my credit card payment?",
+            "Can I get a refund of a late fee from my bank?",
+        ],
+    ),
+    (
+        "Identity theft accounts",
+        [
+            "What should I do about an account on my report that is not mine?",
+            "How do I dispute accounts opened through identity theft?",
+            "Can fraudulent accounts be blocked from a credit report?",
+            "What documents prove an account was opened fraudulently?",
+        ],
+        [
+            "How do I add an authorized user to my account?",
+            "What should I do if I lose my wallet?",
+        ],
+    ),
+    (
+        "Reporting time limits",
+        [
+            "How long can negative items stay on a credit report?",
+            "When does a collection fall off a credit report?",
+            "Does the seven-year reporting period restart after a payment?",
+            "From which date is the reporting period of a delinquency counted?",
+        ],
+        [
+            "How long should I keep old bank statements?",
+            "When does a credit card offer expire?",
+        ],
+    ),
+]
+
+# Dispute questions per (account type, reason), phrased three ways, plus questions
+# about the same account that are not disputes. One component per combination.
+DISPUTE_DESCRIPTIONS = {
+    "Not mine": "not mine",
+    "Duplicate": "listed twice",
+    "Wrong balance": "showing the wrong balance",
+    "Incorrect creditor": "reported under the wrong creditor",
+    "Incorrect status": "showing the wrong status",
+    "Incorrect dates": "showing the wrong dates",
+}
+
+
+def with_article(noun: str) -> str:
+    return f"{'an' if noun[0] in 'aeiou' else 'a'} {noun}"
+
+
+def dispute_topics() -> List[Tuple[str, List[str], List[str]]]:
+    topics = []
+    for account_type in ACCOUNT_TYPES:
+        account = account_type.lower()
+        for reason in DISPUTE_REASONS:
+            description = DISPUTE_DESCRIPTIONS[reason]
+            questions = [
+                f"Can I dispute {with_article(account)} account that is {description}?",
+                f"My {account} is {description} on my credit report. What can I do?",
+                f"Is {with_article(account)} that is {description} eligible for a dispute?",
+            ]
+            distractors = [
+                f"How do I apply for a new {account} now that the old one is {description}?",
+                f"Does {with_article(account)} that is {description} change my interest rate?",
+            ]
+            topics.append((f"{account_type} dispute: {reason.lower()}", questions, distractors))
+    return topics
+
+
+# Pairs that share words but not meaning.
+EMBEDDING_HARD_NEGATIVES = [
+    ("Charge-off definition", "How to remove an inquiry"),
+    ("Authorized inquiry removal", "I authorized an inquiry, can it be removed?"),
+]
+
+
+def embedding_pairs() -> Tuple[List[Tuple[str, str]], List[Tuple[str, str]]]:
+    """(positive pairs, negative pairs) from the topic templates."""
+    positives: List[Tuple[str, str]] = []
+    negatives: List[Tuple[str, str]] = list(EMBEDDING_HARD_NEGATIVES)
+    for title, questions, distractors in EMBEDDING_TOPICS + dispute_topics():
+        positives += [(title, question) for question in questions]
+        positives += list(itertools.combinations(questions, 2))
+        negatives += [(text, distractor) for text in [title] + questions for distractor in distractors]
+    return positives, negatives
+
+
+EMBEDDING_POSITIVES, EMBEDDING_NEGATIVES = embedding_pairs()
+
+
+def random_date(rng: random.Random, year_start: int = 2015, year_end: int = 2024) -> str:
+    year = rng.randint(year_start, year_end)
+    month = rng.randint(1, 12)
     return f"{year:04d}-{month:02d}"
 
 
-def format_classifier_example(label: str) -> str:
-    account_type = random.choice(ACCOUNT_TYPES)
-    bureau = random.choice(BUREAUS)
-    status = random.choice(STATUSES)
-    balance = random.choice([0, 250, 600, 980, 1200, 2400, 4100, 5200])
+def format_classifier_example(label: str, rng: random.Random) -> str:
+    account_type = rng.choice(ACCOUNT_TYPES)
+    bureau = rng.choice(BUREAUS)
+    status = rng.choice(STATUSES)
+    balance = rng.choice([0, 250, 600, 980, 1200, 2400, 4100, 5200])
 
     parts = [f"Account Type: {account_type}", f"Status: {status}", f"Balance: {balance}", f"Bureau: {bureau}"]
 
     if label == "eligible":
-        parts.append(f"Dispute Reason: {random.choice(DISPUTE_REASONS)}")
-        parts.append(f"Last Updated: {random_date()}")
+        parts.append(f"Dispute Reason: {rng.choice(DISPUTE_REASONS)}")
+        parts.append(f"Last Updated: {random_date(rng)}")
     elif label == "conditionally_eligible":
         parts.append("Payment History: Unknown")
-        parts.append(f"Last Updated: {random_date()}")
+        parts.append(f"Last Updated: {random_date(rng)}")
     elif label == "not_eligible":
         if account_type == "Inquiry":
             parts.append("Type: Hard")
@@ -101,23 +312,19 @@ def format_classifier_example(label: str) -> str:
     return " | ".join(parts)
 
 
-def generate_classifier_dataset(total: int) -> List[Dict[str, str]]:
-    labels = [
-        "eligible",
-        "conditionally_eligible",
-        "not_eligible",
-        "insufficient_information",
-    ]
-    per_label = max(1, total // len(labels))
-    dataset: List[Dict[str, str]] = []
-    for label in labels:
-        for _ in range(per_label):
-            dataset.append({"text": format_classifier_example(label), "label": label})
-    while len(dataset) < total:
-        label = random.choice(labels)
-        dataset.append({"text": format_classifier_example(label), "label": label})
-    random.shuffle(dataset)
-    return dataset
+def classifier_rows(start: int, end: int, total: int, rng: random.Random) -> Iterator[Dict[str, str]]:
+    """Rows [start, end) of the classifier dataset.
+
+    The first total // 4 * 4 rows cycle through the labels so every label gets
+    the same quota; the remainder draws labels at random.
+    """
+    balanced = max(1, total // len(CLASSIFIER_LABELS)) * len(CLASSIFIER_LABELS)
+    for index in range(start, end):
+        if index < balanced:
+            label = CLASSIFIER_LABELS[index % len(CLASSIFIER_LABELS)]
+        else:
+            label = rng.choice(CLASSIFIER_LABELS)
+        yield {"text": format_classifier_example(label, rng), "label": label}
 
 
 def structured_response(summary: str, analysis: str, status: str, action: str, steps: List[str]) -> str:
@@ -131,24 +338,24 @@ def structured_response(summary: str, analysis: str, status: str, action: str, s
     )
 
 
-def generate_sft_example(category: str) -> Dict[str, object]:
+def generate_sft_example(category: str, rng: random.Random) -> Dict[str, object]:
     if category == "education":
-        question, answer = random.choice(EDU_QA)
+        question, answer = rng.choice(EDU_QA)
         return {
             "system": SYSTEM_EDU,
             "input": {"user_question": question},
             "output": answer,
         }
     if category == "refusal":
-        prompt = random.choice(REFUSAL_PROMPTS)
+        prompt = rng.choice(REFUSAL_PROMPTS)
         return {
             "system": SYSTEM_REFUSAL,
             "input": {"user_question": prompt},
             "output": "This request falls outside the permitted and compliant scope of Credit AI.",
         }
 
-    prompt = random.choice(ELIGIBILITY_PROMPTS)
-    status = random.choice(["Eligible", "Conditionally Eligible", "Not Eligible", "Insufficient Information"])
+    prompt = rng.choice(ELIGIBILITY_PROMPTS)
+    status = rng.choice(["Eligible", "Conditionally Eligible", "Not Eligible", "Insufficient Information"])
     if status == "Eligible":
         summary = "This item appears eligible for dispute review."
         analysis = "The details suggest a potential reporting inaccuracy."
@@ -181,94 +388,351 @@ def generate_sft_example(category: str) -> Dict[str, object]:
     }
 
 
-def generate_sft_dataset(total: int) -> List[Dict[str, object]]:
-    categories = (
-        ["eligibility"] * int(total * 0.6)
-        + ["education"] * int(total * 0.2)
-        + ["refusal"] * int(total * 0.2)
-    )
-    while len(categories) < total:
-        categories.append(random.choice(["eligibility", "education", "refusal"]))
-    random.shuffle(categories)
-    return [generate_sft_example(cat) for cat in categories]
-
-
-def generate_embedding_pairs(total: int) -> List[Dict[str, object]]:
-    topics = [
-        ("Collection dispute eligibility", "When is a collection account eligible for dispute under credit reporting rules?"),
-        ("Credit utilization impact", "How does credit card utilization affect credit scores?"),
-        ("Charge-off meaning", "What does a charge-off mean on a credit report?"),
-        ("Hard inquiry definition", "What is a hard inquiry and how long does it impact credit?"),
-        ("Metro 2 format", "What is Metro 2 and why does it matter?"),
-    ]
-    negatives = [
-        ("Charge-off definition", "How to remove an inquiry"),
-        ("Authorized inquiry removal", "I authorized an inquiry, can it be removed?"),
-        ("Credit utilization impact", "How to file a small claims lawsuit"),
-    ]
-
-    pairs: List[Dict[str, object]] = []
-    for _ in range(total):
-        if random.random() < 0.7:
-            a, b = random.choice(topics)
-            pairs.append({"text_1": a, "text_2": b, "label": 1})
+def sft_rows(start: int, end: int, total: int, rng: random.Random) -> Iterator[Dict[str, object]]:
+    """Rows [start, end) of the SFT dataset: 60% eligibility, 20% education, 20% refusal."""
+    eligibility_end = int(total * 0.6)
+    education_end = eligibility_end + int(total * 0.2)
+    refusal_end = education_end + int(total * 0.2)
+    for index in range(start, end):
+        if index < eligibility_end:
+            category = "eligibility"
+        elif index < education_end:
+            category = "education"
+        elif index < refusal_end:
+            category = "refusal"
         else:
-            a, b = random.choice(negatives)
-            pairs.append({"text_1": a, "text_2": b, "label": 0})
-    random.shuffle(pairs)
-    return pairs
+            category = rng.choice(SFT_CATEGORIES)
+        yield generate_sft_example(category, rng)
 
 
-def split_dataset(items: List[dict], train_ratio: float = 0.8, valid_ratio: float = 0.1):
-    total = len(items)
-    train_end = int(total * train_ratio)
-    valid_end = int(total * (train_ratio + valid_ratio))
-    return items[:train_end], items[train_end:valid_end], items[valid_end:]
-
-
-def write_jsonl(path: str, rows: List[dict]):
+def embedding_rows(start: int, end: int, total: int, rng: random.Random) -> Iterator[Dict[str, object]]:
+    for _ in range(start, end):
+        if rng.random() < 0.7:
+            a, b = rng.choice(EMBEDDING_POSITIVES)
+            yield {"text_1": a, "text_2": b, "label": 1}
+        else:
+            a, b = rng.choice(EMBEDDING_NEGATIVES)
+            yield {"text_1": a, "text_2": b, "label": 0}
+
+
+# Fields whose normalized text identifies a duplicate, per dataset.
+GROUP_FIELDS: Dict[str, Tuple[str, ...]] = {
+    "classifier": ("text",),
+    "sft": ("system", "input", "output"),
+    "embedding": ("text_1", "text_2"),
+}
+# Datasets whose rows are split by connected component: rows that share any text in
+# these fields, directly or through other rows, always land in the same split.
+COMPONENT_FIELDS: Dict[str, Tuple[str, ...]] = {
+    "embedding": ("text_1", "text_2"),
+}
+
+# name -> (row generator, split files with their ratios, combined JSONL, combined CSV with its headers)
+DATASETS: Dict[str, Tuple] = {
+    "classifier": (
+        classifier_rows,
+        [("model2_classifier.train.jsonl", 0.8), ("model2_classifier.valid.jsonl", 0.1), ("model2_classifier.test.jsonl", 0.1)],
+        "dispute_classifier.jsonl",
+        ("dispute_classifier.csv", ["text", "label"]),
+    ),
+    "sft": (
+        sft_rows,
+        [("model1_sft.train.jsonl", 0.9), ("model1_sft.valid.jsonl", 0.1)],
+        "credit_ai_llm.jsonl",
+        None,
+    ),
+    "embedding": (
+        embedding_rows,
+        [("model3_pairs.train.jsonl", 0.9), ("model3_pairs.valid.jsonl", 0.1)],
+        "embedding_pairs.jsonl",
+        None,
+    ),
+}
+
+
+def shard_rng(seed: int, name: str, shard: int) -> random.Random:
+    # String seeds are hashed with SHA-512, so this does not depend on PYTHONHASHSEED.
+    return random.Random(f"{seed}:{name}:{shard}")
+
+
+def generate_shard(task: Tuple[str, int, int, int, int, str]) -> str:
+    """Write one shard to ``tmp_dir`` and return its path (runs in a worker process)."""
+    name, shard, total, shard_size, seed, tmp_dir = task
+    start = shard * shard_size
+    end = min(start + shard_size, total)
+    rows = DATASETS[name][0](start, end, total, shard_rng(seed, name, shard))
+    path = os.path.join(tmp_dir, f"{name}-shard-{shard:06d}.jsonl")
     with open(path, "w", encoding="utf-8") as f:
         for row in rows:
-            json.dump(row, f, ensure_ascii=False)
-            f.write("\n")
-
-
-def write_csv(path: str, rows: List[dict], headers: List[str]):
-    with open(path, "w", encoding="utf-8", newline="") as f:
-        writer = csv.DictWriter(f, fieldnames=headers)
-        writer.writeheader()
-        writer.writerows(rows)
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+    return path
+
+
+def external_shuffle(shard_paths: List[str], total: int, rng: random.Random, tmp_dir: str) -> Iterator[str]:
+    """Yield the lines of ``shard_paths`` in random order without holding them all in memory."""
+    buckets = max(1, math.ceil(total / SHUFFLE_BUCKET_ROWS))
+    bucket_paths = [os.path.join(tmp_dir, f"bucket-{idx:05d}.jsonl") for idx in range(buckets)]
+    handles = [open(path, "w", encoding="utf-8") for path in bucket_paths]
+    try:
+        for path in shard_paths:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    handles[rng.randrange(buckets)].write(line)
+            os.remove(path)
+    finally:
+        for handle in handles:
+            handle.close()
+
+    for path in bucket_paths:
+        with open(path, "r", encoding="utf-8") as f:
+            lines = f.readlines()
+        os.remove(path)
+        rng.shuffle(lines)
+        yield from lines
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def field_text(row: Dict[str, object], field: str) -> str:
+    value = row.get(field, "")
+    return normalize_text(value if isinstance(value, str) else json.dumps(value, sort_keys=True, ensure_ascii=False))
+
+
+def text_key(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def group_key(row: Dict[str, object], fields: Tuple[str, ...]) -> int:
+    """64-bit hash of the row's normalized text fields; equal texts share a key."""
+    return text_key("\x1f".join(field_text(row, field) for field in fields))
+
+
+def text_components(paths: List[str], fields: Tuple[str, ...]) -> Dict[str, int]:
+    """Normalized text -> key of its connected component, texts being linked by sharing a row.
+
+    Union-find over the distinct texts. A component is represented by its
+    smallest text, so the keys do not depend on the order rows are read in.
+    """
+    parent: Dict[str, str] = {}
+
+    def find(text: str) -> str:
+        root = text
+        while parent.setdefault(root, root) != root:
+            root = parent[root]
+        while parent[text] != root:
+            parent[text], text = root, parent[text]
+        return root
+
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                row = json.loads(line)
+                roots = sorted({find(field_text(row, field)) for field in fields})
+                for root in roots[1:]:
+                    parent[root] = roots[0]
+    return {text: text_key(find(text)) for text in parent}
+
+
+class SplitWriter:
+    """Streams shuffled rows into the split files and the combined reference files.
+
+    The split of a row is picked by its group key, not its position: the key
+    is mapped to [0, 1) and compared with the cumulative split ratios. Rows
+    with the same normalized text therefore always land in the same split, so
+    no test text is also a training text. With ``components`` (see
+    text_components) the key of the row's component is used instead, so texts
+    that recur in different pairs do not straddle splits either. With
+    dedup="drop" only the first occurrence of each key is written; eval_dedup
+    does the same for every split but train. Files are written next to their
+    targets and renamed into place on close.
+    """
+
+    def __init__(
+        self,
+        splits: List[Tuple[str, float]],
+        full: str,
+        csv_spec: Optional[Tuple[str, List[str]]],
+        key_fields: Tuple[str, ...],
+        dedup: str = "group",
+        eval_dedup: str = "drop",
+        components: Optional[Dict[str, int]] = None,
+        component_field: Optional[str] = None,
+    ):
+        self.names = [filename.rsplit(".", 2)[-2] for filename, _ in splits]
+        self.bounds: List[float] = []
+        cumulative = 0.0
+        for _, ratio in splits:
+            cumulative += ratio
+            self.bounds.append(cumulative)
+        self.key_fields = key_fields
+        self.dedup = dedup
+        # DEDUP=drop applies to the eval splits too.
+        self.split_dedup = [dedup if name == "train" or dedup == "drop" else eval_dedup for name in self.names]
+        self.components = components
+        self.component_field = component_field
+        self.seen: Set[int] = set()
+        self.seen_by_split: List[Set[int]] = [set() for _ in splits]
+        self.rows = [0] * len(splits)
+        self.total = 0
+        self.targets = [os.path.join(BASE_DIR, filename) for filename, _ in splits] + [os.path.join(BASE_DIR, full)]
+        self.handles = [open(path + ".tmp", "w", encoding="utf-8") for path in self.targets]
+        self.csv_writer = None
+        if csv_spec is not None:
+            csv_name, headers = csv_spec
+            self.targets.append(os.path.join(BASE_DIR, csv_name))
+            self.handles.append(open(self.targets[-1] + ".tmp", "w", encoding="utf-8", newline=""))
+            self.csv_writer = csv.DictWriter(self.handles[-1], fieldnames=headers)
+            self.csv_writer.writeheader()
+
+    def write(self, line: str):
+        row = json.loads(line)
+        key = group_key(row, self.key_fields)
+        self.total += 1
+        duplicate = key in self.seen
+        self.seen.add(key)
+        split_key = key if self.components is None else self.components[field_text(row, self.component_field)]
+        position = split_key / 2**64
+        split = next((idx for idx, bound in enumerate(self.bounds) if position < bound), None)
+        if duplicate and (self.dedup if split is None else self.split_dedup[split]) == "drop":
+            return
+
+        if split is not None:
+            self.handles[split].write(line)
+            self.rows[split] += 1
+            self.seen_by_split[split].add(key)
+        self.handles[len(self.bounds)].write(line)
+        if self.csv_writer is not None:
+            self.csv_writer.writerow(row)
+
+    def close(self):
+        for handle, path in zip(self.handles, self.targets):
+            handle.close()
+            os.replace(path + ".tmp", path)
+
+    def report(self) -> Dict[str, object]:
+        """Duplicate rates overall and within each split."""
+        unique = len(self.seen)
+        splits = {}
+        for name, rows, keys, dedup in zip(self.names, self.rows, self.seen_by_split, self.split_dedup):
+            splits[name] = {
+                "rows": rows,
+                "unique": len(keys),
+                "duplicate_rate": round(1 - len(keys) / rows, 4) if rows else 0.0,
+                "dedup": dedup,
+            }
+        report = {
+            "generated": self.total,
+            "unique": unique,
+            "duplicate_rate": round(1 - unique / self.total, 4) if self.total else 0.0,
+            "dedup": self.dedup,
+            "splits": splits,
+        }
+        if self.components is not None:
+            report["components"] = len(set(self.components.values()))
+        return report
+
+
+def generate_dataset(
+    name: str, total: int, seed: int, pool, tmp_dir: str, dedup: str = "group", eval_dedup: str = "drop"
+) -> Dict[str, object]:
+    """Generate, shuffle and split one dataset; returns its duplicate report."""
+    _, splits, full, csv_spec = DATASETS[name]
+    shards = math.ceil(total / SHARD_SIZE)
+    tasks = [(name, shard, total, SHARD_SIZE, seed, tmp_dir) for shard in range(shards)]
+    shard_paths = list(pool.imap(generate_shard, tasks)) if pool else [generate_shard(task) for task in tasks]
+
+    components = None
+    component_fields = COMPONENT_FIELDS.get(name)
+    if component_fields:
+        components = text_components(shard_paths, component_fields)
+    writer = SplitWriter(
+        splits,
+        full,
+        csv_spec,
+        GROUP_FIELDS[name],
+        dedup,
+        eval_dedup,
+        components,
+        component_fields[0] if component_fields else None,
+    )
+    try:
+        for line in external_shuffle(shard_paths, total, shard_rng(seed, name, -1), tmp_dir):
+            writer.write(line)
+    finally:
+        writer.close()
+    return writer.report()
+
+
+def print_report(label: str, report: Dict[str, object]):
+    splits = report["splits"]
+    components = f", {report['components']} text components" if "components" in report else ""
+    print(
+        f"- {label}: {report['generated']} generated, {report['unique']} unique "
+        f"({report['duplicate_rate']:.1%} duplicates{components})"
+    )
+    for name, stats in splits.items():
+        print(
+            f"    {name}: {stats['rows']} rows, {stats['unique']} unique "
+            f"({stats['duplicate_rate']:.1%} duplicates, {stats['dedup']})"
+        )
+        if not stats["rows"]:
+            print(f"    ERROR: {name} is empty; {report['unique']} distinct texts are too few for a grouped split")
+
+
+def empty_splits(reports: Dict[str, Dict[str, object]]) -> List[str]:
+    return [
+        f"{name}.{split}" for name, report in reports.items() for split, stats in report["splits"].items() if not stats["rows"]
+    ]
 
 
 def main():
-    random.seed(RANDOM_SEED)
-
-    classifier = generate_classifier_dataset(DEFAULT_CLASSIFIER_COUNT)
-    train_c, valid_c, test_c = split_dataset(classifier, 0.8, 0.1)
-
-    write_jsonl(os.path.join(BASE_DIR, "model2_classifier.train.jsonl"), train_c)
-    write_jsonl(os.path.join(BASE_DIR, "model2_classifier.valid.jsonl"), valid_c)
-    write_jsonl(os.path.join(BASE_DIR, "model2_classifier.test.jsonl"), test_c)
-    write_jsonl(os.path.join(BASE_DIR, "dispute_classifier.jsonl"), classifier)
-    write_csv(os.path.join(BASE_DIR, "dispute_classifier.csv"), classifier, ["text", "label"])
-
-    sft = generate_sft_dataset(DEFAULT_SFT_COUNT)
-    train_s, valid_s, _ = split_dataset(sft, 0.9, 0.1)
-    write_jsonl(os.path.join(BASE_DIR, "model1_sft.train.jsonl"), train_s)
-    write_jsonl(os.path.join(BASE_DIR, "model1_sft.valid.jsonl"), valid_s)
-    write_jsonl(os.path.join(BASE_DIR, "credit_ai_llm.jsonl"), sft)
-
-    embed = generate_embedding_pairs(DEFAULT_EMBEDDING_COUNT)
-    train_e, valid_e, _ = split_dataset(embed, 0.9, 0.1)
-    write_jsonl(os.path.join(BASE_DIR, "model3_pairs.train.jsonl"), train_e)
-    write_jsonl(os.path.join(BASE_DIR, "model3_pairs.valid.jsonl"), valid_e)
-    write_jsonl(os.path.join(BASE_DIR, "embedding_pairs.jsonl"), embed)
-
-    print("Datasets generated:")
-    print(f"- Classifier: {len(classifier)}")
-    print(f"- SFT: {len(sft)}")
-    print(f"- Embeddings: {len(embed)}")
-
+    for name, value in (("DEDUP", DEDUP), ("EVAL_DEDUP", EVAL_DEDUP)):
+        if value not in ("group", "drop"):
+            raise ValueError(f"{name} must be 'group' or 'drop', got {value!r}")
+    counts = {
+        "classifier": DEFAULT_CLASSIFIER_COUNT,
+        "sft": DEFAULT_SFT_COUNT,
+        "embedding": DEFAULT_EMBEDDING_COUNT,
+    }
+    shards = sum(math.ceil(total / SHARD_SIZE) for total in counts.values())
+    workers = max(1, min(WORKERS, shards))
+
+    pool = multiprocessing.get_context("spawn").Pool(workers) if workers > 1 else None
+    tmp_dir = tempfile.mkdtemp(prefix="synthetic-", dir=BASE_DIR)
+    try:
+        reports = {
+            name: generate_dataset(name, total, RANDOM_SEED, pool, tmp_dir, DEDUP, EVAL_DEDUP)
+            for name, total in counts.items()
+        }
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    with open(os.path.join(BASE_DIR, "split_report.json"), "w", encoding="utf-8") as f:
+        json.dump({"seed": RANDOM_SEED, **reports}, f, indent=2)
+
+    print(f"Datasets generated (seed {RANDOM_SEED}, {workers} worker(s)):")
+    print_report("Classifier", reports["classifier"])
+    print_report("SFT", reports["sft"])
+    print_report("Embeddings", reports["embedding"])
+    empty = empty_splits(reports)
+    if empty:
+        # Training would build its evaluator over zero rows; fail here instead.
+        print(f"Empty splits: {', '.join(empty)}. Raise the counts or add templates.")
+        sys.exit(1)
+
+    if training_data is None:
+        print("pyarrow is not installed; skipped the columnar (Arrow) copies")
+        return
+    outputs = []
+    for _, splits, full, _ in DATASETS.values():
+        outputs += [os.path.join(BASE_DIR, filename) for filename, _ in splits] + [os.path.join(BASE_DIR, full)]
+    written = training_data.export_columnar(outputs)
+    print(f"Validated and wrote {len(written)} Arrow files to {os.path.join(BASE_DIR, training_data.COLUMNAR_DIR)}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Compliance Scanner Benchmark
+Compares the compliance scanner against the original per-phrase
+implementation: verifies identical verdicts, then reports time per text as the
+phrase list grows, along with the engine the scanner picks for that size
+(per-phrase substring checks or the Aho-Corasick automaton). "scanner" times
+the violations alone, like the original; "scan" adds the disclaimer lookups.
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Callable, List, Tuple
+
+BASE_DIR = Path(__file__).parent.parent
+sys.path.insert(0, str(BASE_DIR / "services" / "local-ai"))
+
+import compliance  # noqa: E402
+
+DEFAULT_INPUTS = [
+    BASE_DIR / "data" / "finetune" / "model1_sft.train.jsonl",
+    BASE_DIR / "data" / "finetune" / "credit_ai_llm.jsonl",
+]
+
+
+def legacy_check_hallucination(text: str, forbidden_phrases: List[str]) -> Tuple[bool, List[str]]:
+    """The original evaluate_models.check_hallucination, kept for comparison."""
+    violations = []
+    text_lower = text.lower()
+
+    for phrase in forbidden_phrases:
+        if phrase.lower() in text_lower:
+            violations.append(f"Forbidden phrase: '{phrase}'")
+
+    if "100%" in text and any(word in text_lower for word in ["guarantee", "remove", "delete", "approved"]):
+        violations.append("Unrealistic guarantee detected")
+
+    if any(word in text_lower for word in ["sue", "lawsuit", "legal action"]) and \
+       not any(disc in text_lower for disc in ["lawyer", "attorney", "legal professional"]):
+        violations.append("Legal advice without proper disclaimer")
+
+    return len(violations) == 0, violations
+
+
+def load_texts(paths: List[Path]) -> List[str]:
+    texts = []
+    for path in paths:
+        if not path.exists():
+            continue
+        with path.open("r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                text = row.get("output") or row.get("assistant") or row.get("response") or row.get("text")
+                if isinstance(text, str) and text:
+                    texts.append(text)
+    return texts
+
+
+def time_per_text(check: Callable[[str], object], texts: List[str], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for text in texts:
+            check(text)
+        best = min(best, time.perf_counter() - started)
+    return best / len(texts) * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the compliance phrase scanner")
+    parser.add_argument("--input", nargs="*", type=Path, help="JSONL files with model outputs")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--extra-phrases", type=int, nargs="*", default=[0, 100, 1000])
+    parser.add_argument("--output", type=Path, help="Write results as JSON")
+    args = parser.parse_args()
+
+    texts = load_texts(args.input or DEFAULT_INPUTS)
+    if not texts:
+        print("No texts found")
+        return
+    print(f"Texts: {len(texts)}, mean length {sum(map(len, texts)) / len(texts):.0f} chars")
+    print(f"pyahocorasick: {'installed' if compliance.ahocorasick is not None else 'not installed'}")
+
+    results = []
+    for extra in args.extra_phrases:
+        phrases = compliance.FORBIDDEN_PHRASES + [f"synthetic banned phrase {idx}" for idx in range(extra)]
+        scanner = compliance.ComplianceScanner(forbidden_phrases=phrases)
+
+        mismatches = 0
+        for text in texts:
+            result = scanner.scan(text)
+            if legacy_check_hallucination(text, phrases) != (result.compliant, result.violations):
+                mismatches += 1
+        engine = "automaton" if scanner.matcher is not None and scanner.matcher.automaton is not None else "substring"
+        legacy_us = time_per_text(lambda text: legacy_check_hallucination(text, phrases), texts, args.repeat)
+        scanner_us = time_per_text(scanner.violations, texts, args.repeat)
+        scan_us = time_per_text(scanner.scan, texts, args.repeat)
+        results.append(
+            {
+                "phrases": len(phrases),
+                "engine": engine,
+                "legacy_us_per_text": round(legacy_us, 2),
+                "scanner_us_per_text": round(scanner_us, 2),
+                "speedup": round(legacy_us / scanner_us, 2),
+                "scan_us_per_text": round(scan_us, 2),
+                "mismatches": mismatches,
+            }
+        )
+        print(
+            f"  {len(phrases):>5} phrases ({engine:>9}): legacy {legacy_us:8.2f} us/text, "
+            f"scanner {scanner_us:8.2f} us/text ({legacy_us / scanner_us:.2f}x), scan {scan_us:8.2f} us/text, "
+            f"mismatches: {mismatches}"
+        )
+
+    if args.output:
+        args.output.write_text(json.dumps({"texts": len(texts), "results": results}, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+"""
+Local AI Service Benchmark
+Drives /classify, /embed, /retrieve and /chat with a weighted payload mix drawn
+from data/finetune at one or more concurrency levels, and reports p50/p95/p99
+latency, throughput and peak RSS per endpoint. Results are written as JSON
+tagged with the git commit so runs can be compared across commits (--compare).
+
+The service runs in-process (default), as a uvicorn subprocess (--start), or
+is an already running server (--base-url). The service's result caches are
+disabled in the in-process and subprocess runs unless --with-caches is given,
+so repeated payloads measure the models rather than cache lookups; the cache
+settings and hit counts are recorded with the results either way.
+"""
+
+import argparse
+import importlib
+import json
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+BASE_DIR = Path(__file__).parent.parent
+SERVICE_DIR = BASE_DIR / "services" / "local-ai"
+DATA_DIR = BASE_DIR / "data" / "finetune"
+RESULTS_DIR = BASE_DIR / ".cache" / "benchmarks"
+
+CLASSIFY_DATA = DATA_DIR / "model2_classifier.test.jsonl"
+EMBED_DATA = DATA_DIR / "model3_pairs.valid.jsonl"
+QUESTION_DATA = [DATA_DIR / "model1_sft.valid.jsonl", DATA_DIR / "credit_education.jsonl"]
+
+ENDPOINTS = ["classify", "embed", "retrieve", "chat"]
+DEFAULT_MIX = "classify=4,embed=2,retrieve=4,chat=0"
+# Service settings that turn its /classify and /retrieve result caches off.
+NO_CACHE_ENV = {"CLASSIFY_CACHE_BACKEND": "none", "CLASSIFY_CACHE_SIZE": "0", "RETRIEVE_CACHE_SIZE": "0"}
+
+# (endpoint, latency seconds, ok)
+Sample = Tuple[str, float, bool]
+PostFn = Callable[[str, dict], int]
+
+
+def load_jsonl(path: Path) -> List[Dict]:
+    if not path.exists():
+        return []
+    with path.open("r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint '{name}' in --mix (expected one of {', '.join(ENDPOINTS)})")
+        mix[name] = float(weight or 1)
+    mix = {name: weight for name, weight in mix.items() if weight > 0}
+    if not mix:
+        raise ValueError("--mix selects no endpoints")
+    return mix
+
+
+def build_payloads(embed_batch: int, top_k: int, chat_max_new_tokens: int) -> Dict[str, List[dict]]:
+    """Request bodies per endpoint, taken from the fine-tuning datasets."""
+    classify_texts = [row["text"] for row in load_jsonl(CLASSIFY_DATA) if row.get("text")]
+
+    pair_texts: List[str] = []
+    for row in load_jsonl(EMBED_DATA):
+        pair_texts.extend(text for text in (row.get("text_1"), row.get("text_2")) if text)
+    embed_batches = [pair_texts[idx : idx + embed_batch] for idx in range(0, len(pair_texts), embed_batch)]
+
+    questions: List[Tuple[Optional[str], str]] = []
+    for path in QUESTION_DATA:
+        for row in load_jsonl(path):
+            payload = row.get("input")
+            if isinstance(payload, dict) and payload.get("user_question"):
+                questions.append((row.get("system"), payload["user_question"]))
+            elif row.get("question"):
+                questions.append((None, row["question"]))
+
+    return {
+        "classify": [{"text": text} for text in classify_texts],
+        "embed": [{"texts": batch} for batch in embed_batches if batch],
+        "retrieve": [{"query": question, "top_k": top_k} for _, question in questions],
+        "chat": [
+            {"system": system, "user": question, "max_new_tokens": chat_max_new_tokens, "temperature": 0.0}
+            for system, question in questions
+        ],
+    }
+
+
+def build_schedule(mix: Dict[str, float], payloads: Dict[str, List[dict]], count: int, seed: int) -> List[Tuple[str, dict]]:
+    """A reproducible request sequence following the endpoint weights."""
+    missing = [name for name in mix if not payloads.get(name)]
+    if missing:
+        raise ValueError(f"No payloads available for: {', '.join(missing)}")
+    rng = random.Random(seed)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    schedule = []
+    for name in rng.choices(names, weights=weights, k=count):
+        schedule.append((name, rng.choice(payloads[name])))
+    return schedule
+
+
+def git_revision() -> Dict[str, object]:
+    def run(*cmd: str) -> str:
+        try:
+            return subprocess.run(cmd, cwd=BASE_DIR, capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return ""
+
+    return {
+        "commit": run("git", "rev-parse", "HEAD") or None,
+        "dirty": bool(run("git", "status", "--porcelain", "--untracked-files=no")),
+    }
+
+
+def proc_peak_rss_mb(pid: int) -> Optional[float]:
+    """Peak resident set size (VmHWM) of another process, Linux only."""
+    try:
+        with open(f"/proc/{pid}/status", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def self_peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is kilobytes on Linux and bytes on macOS.
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
+
+class InProcessTarget:
+    """Imports services/local-ai/main.py and calls it through FastAPI's TestClient."""
+
+    name = "in-process"
+
+    def __init__(self, timeout: float = 600.0):
+        sys.path.insert(0, str(SERVICE_DIR))
+        started = time.perf_counter()
+        service = importlib.import_module("main")
+        from fastapi.testclient import TestClient
+
+        self.client = TestClient(service.app)
+        self.client.__enter__()  # runs the startup event, which may load the models in the background
+        while time.perf_counter() - started < timeout:
+            response = self.client.get("/ready")
+            if response.status_code == 200:
+                break
+            if response.json().get("status") == "failed":
+                raise RuntimeError(f"Service startup failed: {response.json()['phases']}")
+            time.sleep(0.2)
+        else:
+            raise TimeoutError(f"Service did not become ready within {timeout:.0f}s")
+        self.startup_seconds = round(time.perf_counter() - started, 3)
+        self.llm_enabled = bool(service.ENABLE_LLM)
+
+    def post(self, path: str, payload: dict) -> int:
+        return self.client.post(path, json=payload).status_code
+
+    def metrics(self) -> dict:
+        return self.client.get("/metrics").json()
+
+    def peak_rss_mb(self) -> Optional[float]:
+        return self_peak_rss_mb()
+
+    def close(self) -> None:
+        self.client.__exit__(None, None, None)
+
+
+class HttpTarget:
+    """An already running server, optionally one this script started."""
+
+    name = "http"
+
+    def __init__(self, base_url: str, pid: Optional[int] = None):
+        import requests
+
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+        self.session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=256))
+        self.pid = pid
+        self.process: Optional[subprocess.Popen] = None
+        self.startup_seconds: Optional[float] = None
+        self.llm_enabled: Optional[bool] = None
+
+    @classmethod
+    def start(cls, timeout: float) -> "HttpTarget":
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        started = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+            cwd=SERVICE_DIR,
+        )
+        target = cls(f"http://127.0.0.1:{port}", pid=process.pid)
+        target.process = process
+        target.name = "subprocess"
+        while time.perf_counter() - started < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"Service exited during startup with code {process.returncode}")
+            try:
+                # /health answers as soon as the server binds; /ready once the models are loaded.
+                if target.session.get(f"{target.base_url}/ready", timeout=2).status_code == 200:
+                    target.startup_seconds = round(time.perf_counter() - started, 3)
+                    return target
+            except Exception:
+                pass
+            time.sleep(0.5)
+        target.close()
+        raise TimeoutError(f"Service did not become ready within {timeout:.0f}s")
+
+    def post(self, path: str, payload: dict) -> int:
+        return self.session.post(f"{self.base_url}{path}", json=payload, timeout=600).status_code
+
+    def metrics(self) -> dict:
+        return self.session.get(f"{self.base_url}/metrics", timeout=10).json()
+
+    def peak_rss_mb(self) -> Optional[float]:
+        return proc_peak_rss_mb(self.pid) if self.pid else None
+
+    def close(self) -> None:
+        self.session.close()
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+def cache_counts(target) -> Optional[Dict[str, object]]:
+    """Hit/miss counters of the service's result caches over the whole run, warm-up included."""
+    try:
+        metrics = target.metrics()
+    except Exception as exc:
+        print(f"Could not read /metrics: {exc}")
+        return None
+    counts = {}
+    for name in ("classify_cache", "retrieve_cache"):
+        stats = metrics.get(name) or {}
+        counts[name] = {key: stats.get(key) for key in ("capacity", "backend", "hits", "misses", "store_hits")}
+    return counts
+
+
+def timed_request(post: PostFn, name: str, payload: dict) -> Sample:
+    started = time.perf_counter()
+    try:
+        ok = post(f"/{name}", payload) == 200
+    except Exception:
+        ok = False
+    return name, time.perf_counter() - started, ok
+
+
+def latency_stats(latencies: List[float], wall_seconds: float, errors: int) -> Dict[str, object]:
+    stats: Dict[str, object] = {"requests": len(latencies) + errors, "errors": errors}
+    if not latencies:
+        return stats
+    values = np.asarray(latencies) * 1000
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    stats.update(
+        {
+            "mean_ms": round(float(values.mean()), 2),
+            "p50_ms": round(float(p50), 2),
+            "p95_ms": round(float(p95), 2),
+            "p99_ms": round(float(p99), 2),
+            "max_ms": round(float(values.max()), 2),
+            "throughput_rps": round(len(latencies) / wall_seconds, 2) if wall_seconds > 0 else None,
+        }
+    )
+    return stats
+
+
+def run_level(post: PostFn, schedule: List[Tuple[str, dict]], concurrency: int) -> Dict[str, object]:
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples: List[Sample] = list(pool.map(lambda item: timed_request(post, *item), schedule))
+    wall_seconds = time.perf_counter() - started
+
+    endpoints = {}
+    for name in sorted({sample[0] for sample in samples}):
+        hits = [sample for sample in samples if sample[0] == name]
+        endpoints[name] = latency_stats(
+            [latency for _, latency, ok in hits if ok], wall_seconds, sum(1 for _, _, ok in hits if not ok)
+        )
+    overall = latency_stats(
+        [latency for _, latency, ok in samples if ok], wall_seconds, sum(1 for _, _, ok in samples if not ok)
+    )
+    return {"concurrency": concurrency, "wall_seconds": round(wall_seconds, 3), "overall": overall, "endpoints": endpoints}
+
+
+def print_level(level: Dict[str, object]) -> None:
+    print(f"\nConcurrency {level['concurrency']} ({level['wall_seconds']}s, peak RSS {level.get('peak_rss_mb')} MB)")
+    print(f"  {'endpoint':<10} {'reqs':>6} {'err':>4} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>8}")
+    rows = list(level["endpoints"].items()) + [("overall", level["overall"])]
+    for name, stats in rows:
+        print(
+            f"  {name:<10} {stats['requests']:>6} {stats['errors']:>4} "
+            f"{stats.get('p50_ms', '-'):>9} {stats.get('p95_ms', '-'):>9} {stats.get('p99_ms', '-'):>9} "
+            f"{stats.get('throughput_rps', '-'):>8}"
+        )
+
+
+def print_comparison(current: Dict[str, object], baseline_path: Path) -> None:
+    """Print p95 and throughput changes against an earlier results file."""
+    baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+    previous = {level["concurrency"]: level for level in baseline.get("levels", [])}
+    commit = (baseline.get("git") or {}).get("commit") or "unknown"
+    print(f"\nComparison with {baseline_path} (commit {commit[:12]})")
+    for level in current["levels"]:
+        before = previous.get(level["concurrency"])
+        if before is None:
+            continue
+        for name, stats in list(level["endpoints"].items()) + [("overall", level["overall"])]:
+            old = before["overall"] if name == "overall" else before["endpoints"].get(name)
+            if not old or "p95_ms" not in old or "p95_ms" not in stats:
+                continue
+            p95_delta = (stats["p95_ms"] - old["p95_ms"]) / old["p95_ms"] * 100 if old["p95_ms"] else 0.0
+            rps_delta = (
+                (stats["throughput_rps"] - old["throughput_rps"]) / old["throughput_rps"] * 100
+                if old.get("throughput_rps")
+                else 0.0
+            )
+            print(
+                f"  c={level['concurrency']:<3} {name:<10} p95 {old['p95_ms']:>9} -> {stats['p95_ms']:>9} ms "
+                f"({p95_delta:+.1f}%), throughput {rps_delta:+.1f}%"
+            )
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark latency and throughput of the local AI service")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--base-url", help="Benchmark an already running server instead of the in-process app")
+    target.add_argument("--start", action="store_true", help="Start the service with uvicorn on a free local port")
+    parser.add_argument("--server-pid", type=int, help="PID of the --base-url server, for peak RSS")
+    parser.add_argument("--startup-timeout", type=float, default=600.0)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Endpoint weights, e.g. classify=4,embed=2,retrieve=4,chat=1")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=200, help="Measured requests per concurrency level")
+    parser.add_argument("--warmup", type=int, default=3, help="Unmeasured requests per endpoint before measuring")
+    parser.add_argument("--embed-batch", type=int, default=8, help="Texts per /embed request")
+    parser.add_argument("--top-k", type=int, default=5, help="top_k for /retrieve")
+    parser.add_argument("--chat-max-new-tokens", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=13)
+    parser.add_argument(
+        "--with-caches",
+        action="store_true",
+        help="Keep the service's result caches (by default they are disabled for in-process and --start runs)",
+    )
+    parser.add_argument("--output", type=Path, help="Results JSON (default: .cache/benchmarks/<commit>-<time>.json)")
+    parser.add_argument("--compare", type=Path, help="Earlier results JSON to compare against")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    mix = parse_mix(args.mix)
+    payloads = build_payloads(args.embed_batch, args.top_k, args.chat_max_new_tokens)
+
+    print("=" * 80)
+    print("Local AI Service Benchmark")
+    print("=" * 80)
+
+    if not args.with_caches and not args.base_url:
+        # The payload pools are small, so with caches most measured requests would be hits.
+        os.environ.update(NO_CACHE_ENV)
+    if args.base_url:
+        target = HttpTarget(args.base_url, pid=args.server_pid)
+    elif args.start:
+        target = HttpTarget.start(args.startup_timeout)
+    else:
+        target = InProcessTarget(args.startup_timeout)
+    print(f"Target: {target.name}" + (f" (startup {target.startup_seconds}s)" if target.startup_seconds else ""))
+    if "chat" in mix and target.llm_enabled is False:
+        print("Warning: ENABLE_LLM is off, /chat requests will fail")
+    print(f"Mix: {', '.join(f'{name}={weight:g}' for name, weight in mix.items())}")
+
+    try:
+        for name in mix:
+            for _, payload in zip(range(args.warmup), payloads[name]):
+                timed_request(target.post, name, payload)
+
+        levels = []
+        for idx, concurrency in enumerate(args.concurrency):
+            schedule = build_schedule(mix, payloads, args.requests, args.seed + idx)
+            level = run_level(target.post, schedule, concurrency)
+            level["peak_rss_mb"] = target.peak_rss_mb()
+            print_level(level)
+            levels.append(level)
+        caches = cache_counts(target)
+    finally:
+        target.close()
+    if caches:
+        hits = {name: stats["hits"] for name, stats in caches.items()}
+        print(f"\nResult cache hits: {', '.join(f'{name}={count}' for name, count in hits.items())}")
+        if any(hits.values()):
+            print("Warning: some requests were answered from the result caches; latency is not model latency")
+
+    git = git_revision()
+    results = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "git": git,
+        "target": target.name,
+        "startup_seconds": target.startup_seconds,
+        "config": {
+            "mix": mix,
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "embed_batch": args.embed_batch,
+            "top_k": args.top_k,
+            "chat_max_new_tokens": args.chat_max_new_tokens,
+            "seed": args.seed,
+            "device_env": {key: os.getenv(key) for key in ("ENABLE_LLM", "OUTPUT_GUARD", "OMP_NUM_THREADS")},
+            # Only describes --base-url servers if they were started with the same environment.
+            "cache_env": {key: os.getenv(key) for key in NO_CACHE_ENV},
+            "with_caches": args.with_caches,
+        },
+        "caches": caches,
+        "levels": levels,
+    }
+
+    output = args.output
+    if output is None:
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        output = RESULTS_DIR / f"{(git['commit'] or 'nogit')[:12]}-{stamp}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2), encoding="utf-8")
+    print(f"\nResults saved to {output}")
+
+    if args.compare:
+        print_comparison(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Bulk Dispute-Eligibility Classification
+Classifies every record of a JSONL or CSV file with the same classifier and
+label mapping as the local AI service's /classify endpoint.
+
+The input is streamed in fixed-size blocks. Each block is sorted by length,
+split into padded batches, run across a process pool, and written back in
+input order. Memory is bounded by the block size, not the file size. After
+every block, the output is flushed and a progress file records how many input
+records and output bytes are complete, and the options that shape the output.
+--resume continues from there after an interruption, with the same options.
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import torch
+from transformers import AutoConfig
+
+BASE_DIR = Path(__file__).parent.parent
+sys.path.insert(0, str(BASE_DIR / "services" / "local-ai"))
+
+import classifier  # noqa: E402
+from model_ids import DISTILBERT_MODEL_ID  # noqa: E402
+
+PROGRESS_SUFFIX = ".progress.json"
+
+_worker_model = None
+_worker_tokenizer = None
+_worker_device = "cpu"
+_worker_max_length = 512
+
+
+def detect_format(path: Path, explicit: Optional[str]) -> str:
+    if explicit:
+        return explicit
+    return "csv" if path.suffix.lower() in (".csv", ".tsv") else "jsonl"
+
+
+def iter_records(path: Path, fmt: str) -> Iterator[Dict]:
+    with path.open("r", encoding="utf-8", newline="") as f:
+        if fmt == "csv":
+            dialect = "excel-tab" if path.suffix.lower() == ".tsv" else "excel"
+            yield from csv.DictReader(f, dialect=dialect)
+            return
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_blocks(records: Iterator[Dict], block_size: int) -> Iterator[List[Dict]]:
+    while True:
+        block = list(itertools.islice(records, block_size))
+        if not block:
+            return
+        yield block
+
+
+def load_worker(model_id: str, device: str, max_length: int, threads: Optional[int] = None) -> None:
+    """Load the classifier once per process (also used as the pool initializer)."""
+    global _worker_model, _worker_tokenizer, _worker_device, _worker_max_length
+    if threads:
+        torch.set_num_threads(threads)
+    _worker_tokenizer, _worker_model = classifier.load_classifier(model_id, device)
+    _worker_device = device
+    _worker_max_length = max_length
+
+
+def classify_batch(texts: List[str]) -> np.ndarray:
+    return classifier.predict_proba(_worker_tokenizer, _worker_model, texts, _worker_device, _worker_max_length)
+
+
+def sorted_batches(texts: List[str], batch_size: int) -> List[np.ndarray]:
+    """Positions grouped into batches of similar length, so padding stays small."""
+    order = np.argsort([len(text) for text in texts], kind="stable")
+    return [order[start : start + batch_size] for start in range(0, len(order), batch_size)]
+
+
+class PredictionWriter:
+    """Appends predictions as JSONL or CSV and reports the byte offset after each block."""
+
+    def __init__(self, path: Path, names: List[str], include_probabilities: bool, offset: int):
+        self.path = path
+        self.names = names
+        self.include_probabilities = include_probabilities
+        self.csv = path.suffix.lower() == ".csv"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.handle = path.open("a+", encoding="utf-8", newline="")
+        # Drop anything written after the last completed block.
+        self.handle.truncate(offset)
+        self.handle.seek(offset)
+        self.fields = ["id", "label", "confidence", "error"]
+        if include_probabilities:
+            self.fields += [f"p_{name}" for name in names]
+        self.csv_writer = csv.DictWriter(self.handle, fieldnames=self.fields) if self.csv else None
+        if self.csv_writer is not None and offset == 0:
+            self.csv_writer.writeheader()
+
+    def write(self, record_id, probs: Optional[np.ndarray], error: Optional[str] = None) -> None:
+        row: Dict[str, object] = {"id": record_id, "label": None, "confidence": None, "error": error}
+        if probs is not None:
+            best = int(probs.argmax())
+            row["label"] = self.names[best]
+            row["confidence"] = round(float(probs[best]), 6)
+        if self.csv_writer is not None:
+            if self.include_probabilities and probs is not None:
+                row.update({f"p_{name}": round(float(value), 6) for name, value in zip(self.names, probs)})
+            self.csv_writer.writerow(row)
+            return
+        if error is None:
+            del row["error"]
+        if self.include_probabilities and probs is not None:
+            row["probabilities"] = classifier.probabilities(self.names, probs)
+        self.handle.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+    def commit(self) -> int:
+        self.handle.flush()
+        os.fsync(self.handle.fileno())
+        return self.handle.tell()
+
+    def close(self) -> None:
+        self.handle.close()
+
+
+def progress_path(output: Path) -> Path:
+    return output.with_name(output.name + PROGRESS_SUFFIX)
+
+
+def input_signature(path: Path) -> Dict[str, object]:
+    stat = path.stat()
+    return {"path": str(path.resolve()), "size": stat.st_size, "mtime": int(stat.st_mtime)}
+
+
+def run_options(args: argparse.Namespace, fmt: str) -> Dict[str, object]:
+    """Options that shape the output rows; a resumed run must use the same ones."""
+    return {
+        "format": fmt,
+        "text_field": args.text_field,
+        "id_field": args.id_field,
+        "probabilities": args.probabilities,
+        "output_format": "csv" if args.output.suffix.lower() == ".csv" else "jsonl",
+    }
+
+
+def load_progress(
+    output: Path, signature: Dict[str, object], model_id: str, options: Dict[str, object]
+) -> Tuple[int, int]:
+    """Records already classified and the output offset they end at."""
+    path = progress_path(output)
+    if not path.exists():
+        return 0, 0
+    progress = json.loads(path.read_text(encoding="utf-8"))
+    if progress.get("input") != signature or progress.get("model") != model_id:
+        raise SystemExit(f"{path} belongs to a different input file or model; remove it or drop --resume")
+    if progress.get("options") != options:
+        changed = sorted(key for key in options if (progress.get("options") or {}).get(key) != options[key])
+        raise SystemExit(f"{path} was written with different options ({', '.join(changed)}); rerun with the same ones")
+    return int(progress["records"]), int(progress["bytes"])
+
+
+def save_progress(
+    output: Path, signature: Dict[str, object], model_id: str, options: Dict[str, object], records: int, offset: int
+) -> None:
+    path = progress_path(output)
+    tmp = path.with_name(path.name + ".tmp")
+    progress = {"input": signature, "model": model_id, "options": options, "records": records, "bytes": offset}
+    tmp.write_text(json.dumps(progress), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Classify a JSONL/CSV file of tradeline descriptions")
+    parser.add_argument("input", type=Path, help="Input .jsonl or .csv/.tsv file")
+    parser.add_argument("output", type=Path, help="Predictions file (.jsonl or .csv)")
+    parser.add_argument("--format", choices=["jsonl", "csv"], help="Input format (default: from extension)")
+    parser.add_argument("--text-field", default="text")
+    parser.add_argument("--id-field", help="Field copied to the output id (default: 0-based record number)")
+    parser.add_argument("--model", default=DISTILBERT_MODEL_ID, help="Classifier checkpoint (default: as the service)")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--block-size", type=int, default=8192, help="Records read, sorted and written per block")
+    parser.add_argument("--max-length", type=int, default=512)
+    parser.add_argument("--workers", type=int, default=1, help="CPU worker processes")
+    parser.add_argument("--probabilities", action="store_true", help="Also write per-label probabilities")
+    parser.add_argument("--resume", action="store_true", help="Continue after the last completed block")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    fmt = detect_format(args.input, args.format)
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    workers = args.workers if device == "cpu" else 1
+    names = classifier.label_names(AutoConfig.from_pretrained(args.model))
+
+    signature = input_signature(args.input)
+    options = run_options(args, fmt)
+    done, offset = (0, 0)
+    if args.resume and progress_path(args.output).exists():
+        done, offset = load_progress(args.output, signature, args.model, options)
+    elif args.output.exists() or progress_path(args.output).exists():
+        # Without a progress file there is no record of where a usable prefix ends, so --resume starts fresh.
+        hint = "it has no progress file to resume from" if args.resume else "pass --resume to continue it"
+        raise SystemExit(f"{args.output} already exists; {hint}, or choose another path")
+    if done:
+        print(f"Resuming after {done} records")
+
+    print(f"Classifying {args.input} with {args.model} on {device} ({workers} worker(s))")
+    writer = PredictionWriter(args.output, names, args.probabilities, offset)
+    records = iter_records(args.input, fmt)
+    next(itertools.islice(records, done, done), None)  # skip records finished in an earlier run
+
+    pool = None
+    if workers > 1:
+        threads = max((os.cpu_count() or workers) // workers, 1)
+        context = multiprocessing.get_context("spawn")
+        pool = context.Pool(
+            workers, initializer=load_worker, initargs=(args.model, device, args.max_length, threads)
+        )
+    else:
+        load_worker(args.model, device, args.max_length)
+
+    started = time.perf_counter()
+    classified = 0
+    try:
+        for block in iter_blocks(records, args.block_size):
+            texts: List[str] = []
+            positions: List[int] = []
+            for pos, record in enumerate(block):
+                text = record.get(args.text_field)
+                if isinstance(text, str) and text.strip():
+                    positions.append(pos)
+                    texts.append(text)
+
+            batches = sorted_batches(texts, args.batch_size)
+            batch_texts = [[texts[idx] for idx in batch] for batch in batches]
+            results = pool.imap(classify_batch, batch_texts) if pool else map(classify_batch, batch_texts)
+            probs: List[Optional[np.ndarray]] = [None] * len(block)
+            for batch, batch_probs in zip(batches, results):
+                for idx, row in zip(batch, batch_probs):
+                    probs[positions[idx]] = row
+
+            for pos, record in enumerate(block):
+                record_id = record.get(args.id_field) if args.id_field else done + pos
+                error = None if probs[pos] is not None else f"missing '{args.text_field}'"
+                writer.write(record_id, probs[pos], error)
+            offset = writer.commit()
+            done += len(block)
+            classified += len(texts)
+            save_progress(args.output, signature, args.model, options, done, offset)
+
+            elapsed = time.perf_counter() - started
+            print(f"  {done} records done ({classified / elapsed:.1f} texts/s)")
+    except KeyboardInterrupt:
+        print(f"\nInterrupted after {done} records; rerun with --resume to continue")
+        raise SystemExit(130)
+    finally:
+        writer.close()
+        if pool is not None:
+            pool.terminate()
+
+    print(f"Wrote predictions for {done} records to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
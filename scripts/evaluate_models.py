@@ -4,239 +4,526 @@ AI Model Evaluation Harness
 Evaluates fine-tuned models for hallucination detection, accuracy, and compliance.
 """
 
+import argparse
+import hashlib
 import json
+import multiprocessing
 import os
 import sys
+import time
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 
 import numpy as np
+import pyarrow as pa
 import torch
 from datasets import load_dataset
 from sentence_transformers import SentenceTransformer
 from transformers import (
-    AutoModelForCausalLM,
     AutoModelForSequenceClassification,
     AutoTokenizer,
 )
 
 
-# Model paths
 BASE_DIR = Path(__file__).parent.parent
+sys.path.insert(0, str(BASE_DIR / "services" / "local-ai"))
+
+import chunking  # noqa: E402
+import classifier  # noqa: E402
+import kb_index  # noqa: E402
+import llm  # noqa: E402
+import training_data  # noqa: E402
+from compliance import DEFAULT_SCANNER  # noqa: E402
+from model_ids import model_content_hash  # noqa: E402
+
+# Model paths
 CLASSIFIER_PATH = BASE_DIR / "models" / "finetuned" / "distilbert-eligibility"
 EMBEDDINGS_PATH = BASE_DIR / "models" / "finetuned" / "minilm-embeddings"
-SFT_PATH = BASE_DIR / "models" / "finetuned" / "qwen-credit-sft"
+SFT_PATH = BASE_DIR / "models" / "finetuned" / "qwen-credit-sft-merged"
+if not SFT_PATH.exists():
+    SFT_PATH = BASE_DIR / "models" / "finetuned" / "qwen-credit-sft"
 
 # Test data paths
 DATA_DIR = BASE_DIR / "data" / "finetune"
+CLASSIFIER_TRAIN = DATA_DIR / "model2_classifier.train.jsonl"
 CLASSIFIER_TEST = DATA_DIR / "model2_classifier.test.jsonl"
 SFT_VALID = DATA_DIR / "model1_sft.valid.jsonl"
 EMBEDDINGS_VALID = DATA_DIR / "model3_pairs.valid.jsonl"
+SFT_GENERATION_CACHE = BASE_DIR / ".cache" / "eval" / "sft_generations.jsonl"
+KNOWLEDGE_BASE_DIRS = [BASE_DIR / "data" / "knowledge-base", BASE_DIR / "src" / "data" / "knowledge-base"]
 
-# Forbidden phrases for hallucination detection
-FORBIDDEN_PHRASES = [
-    "I am not a lawyer",
-    "consult a lawyer",
-    "100% guarantee",
-    "delete all negative items",
-    "remove all debts",
-    "erase your credit history",
-    "quick fix",
-    "overnight results",
-    "guaranteed approval",
-    "credit repair loophole",
-    "secret method",
-]
-
-# Compliance requirements
-REQUIRED_DISCLAIMERS = [
-    "results may vary",
-    "educational purposes",
-    "not financial advice",
-    "consult with a professional",
-]
-
-
-def load_jsonl(path: Path) -> List[Dict]:
-    """Load JSONL file."""
-    if not path.exists():
-        return []
-    data = []
-    with open(path, "r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if line:
-                data.append(json.loads(line))
-    return data
 
+def load_examples(path: Path, kind: str) -> pa.Table:
+    """Canonical columns of a JSONL dataset, memory-mapped from its Arrow copy when that is current."""
+    return training_data.load_table(str(path), kind)
 
-def check_hallucination(text: str) -> Tuple[bool, List[str]]:
-    """
-    Check if text contains forbidden phrases indicating hallucination or non-compliance.
-    
-    Returns:
-        (is_compliant, violations)
+
+def classification_metrics(y_true: np.ndarray, y_pred: np.ndarray, labels: List[str]) -> Dict:
+    """Accuracy, per-class precision/recall/F1 and confusion matrix, vectorized."""
+    num_labels = len(labels)
+    confusion = np.bincount(y_true * num_labels + y_pred, minlength=num_labels * num_labels).reshape(
+        num_labels, num_labels
+    )
+    tp = np.diag(confusion).astype(np.float64)
+    support = confusion.sum(axis=1)
+    predicted = confusion.sum(axis=0)
+    precision = np.divide(tp, predicted, out=np.zeros_like(tp), where=predicted > 0)
+    recall = np.divide(tp, support, out=np.zeros_like(tp), where=support > 0)
+    denom = precision + recall
+    f1 = np.divide(2 * precision * recall, denom, out=np.zeros_like(tp), where=denom > 0)
+    total = int(confusion.sum())
+
+    return {
+        "total_examples": total,
+        "correct_predictions": int(tp.sum()),
+        "accuracy": float(tp.sum() / total) if total else 0.0,
+        "macro_precision": float(precision.mean()),
+        "macro_recall": float(recall.mean()),
+        "macro_f1": float(f1.mean()),
+        # Per-class accuracy is the per-class recall; kept for report compatibility.
+        "per_class_accuracy": {label: float(recall[idx]) for idx, label in enumerate(labels)},
+        "per_class": {
+            label: {
+                "precision": float(precision[idx]),
+                "recall": float(recall[idx]),
+                "f1": float(f1[idx]),
+                "support": int(support[idx]),
+            }
+            for idx, label in enumerate(labels)
+        },
+        "confusion_matrix": {"labels": labels, "matrix": confusion.tolist()},
+    }
+
+
+def length_bucketed_batches(lengths: List[int], batch_size: int) -> List[np.ndarray]:
+    """Group indices of similar length so each padded batch wastes little compute."""
+    order = np.argsort(np.asarray(lengths), kind="stable")
+    return [order[start : start + batch_size] for start in range(0, len(order), batch_size)]
+
+
+def padding_ratio(lengths: List[int], batches: List[np.ndarray]) -> float:
+    lengths_arr = np.asarray(lengths)
+    padded = sum(int(lengths_arr[batch].max()) * len(batch) for batch in batches if len(batch))
+    return round(1.0 - float(lengths_arr.sum()) / padded, 4) if padded else 0.0
+
+
+def normalize_text(text: str) -> str:
+    """Same normalization the synthetic generator uses to group duplicate texts."""
+    return " ".join(text.lower().split())
+
+
+def train_overlap(test_texts: List[str], train_path: Path) -> Dict:
+    """How many test texts also occur, after normalization, in the training file.
+
+    Any overlap means the model was scored on examples it was trained on.
     """
-    violations = []
-    text_lower = text.lower()
-    
-    for phrase in FORBIDDEN_PHRASES:
-        if phrase.lower() in text_lower:
-            violations.append(f"Forbidden phrase: '{phrase}'")
-    
-    # Check for specific problematic patterns
-    if "100%" in text and any(word in text_lower for word in ["guarantee", "remove", "delete", "approved"]):
-        violations.append("Unrealistic guarantee detected")
-    
-    # Check for medical/legal advice without disclaimer
-    if any(word in text_lower for word in ["sue", "lawsuit", "legal action"]) and \
-       not any(disc in text_lower for disc in ["lawyer", "attorney", "legal professional"]):
-        violations.append("Legal advice without proper disclaimer")
-    
-    return len(violations) == 0, violations
+    if not train_path.exists():
+        return {"train_file": None}
+    train_column = load_examples(train_path, "classifier").column("text").to_pylist()
+    train_texts = {normalize_text(text) for text in train_column}
+    test_texts = [normalize_text(text) for text in test_texts]
+    overlapping = sum(text in train_texts for text in test_texts)
+    return {
+        "train_file": str(train_path),
+        "overlapping": overlapping,
+        "rate": round(overlapping / len(test_texts), 4) if test_texts else 0.0,
+    }
 
 
-def evaluate_classifier(model, tokenizer, test_data: List[Dict], device: str) -> Dict:
-    """Evaluate classifier on test data."""
-    if not test_data:
+def evaluate_classifier(
+    model,
+    tokenizer,
+    test_data: pa.Table,
+    device: str,
+    batch_size: int = 64,
+    max_length: int = 512,
+) -> Dict:
+    """Evaluate classifier on test data with batched, dynamically padded inference."""
+    if not test_data.num_rows:
         return {"error": "No test data available"}
-    
-    correct = 0
-    total = 0
-    label_map = {0: "eligible", 1: "conditionally_eligible", 2: "not_eligible", 3: "insufficient_information"}
-    label_to_id = {v: k for k, v in label_map.items()}
-    
-    per_class_correct = {label: 0 for label in label_map.values()}
-    per_class_total = {label: 0 for label in label_map.values()}
-    
-    for example in test_data:
-        text = example.get("text", "")
-        true_label_str = example.get("label", "")
-        
-        if not text or not true_label_str:
-            continue
-        
-        true_label_id = label_to_id.get(true_label_str)
+
+    # The checkpoint's own id2label, normalised as the service does, so predicted ids map to the right names.
+    labels = classifier.label_names(model.config)
+    label_to_id = {label: idx for idx, label in enumerate(labels)}
+
+    texts = []
+    true_ids = []
+    for text, label in zip(test_data.column("text").to_pylist(), test_data.column("label").to_pylist()):
+        true_label_id = label_to_id.get(label)
         if true_label_id is None:
             continue
-        
-        inputs = tokenizer(text, return_tensors="pt", truncation=True, max_length=512).to(device)
-        
-        with torch.no_grad():
-            outputs = model(**inputs)
-            pred_label_id = torch.argmax(outputs.logits, dim=1).item()
-        
-        pred_label_str = label_map[pred_label_id]
-        total += 1
-        per_class_total[true_label_str] += 1
-        
-        if pred_label_id == true_label_id:
-            correct += 1
-            per_class_correct[true_label_str] += 1
-    
-    accuracy = correct / total if total > 0 else 0
-    
-    # Calculate per-class accuracy
-    per_class_acc = {}
-    for label in label_map.values():
-        if per_class_total[label] > 0:
-            per_class_acc[label] = per_class_correct[label] / per_class_total[label]
-        else:
-            per_class_acc[label] = 0.0
-    
+        texts.append(text)
+        true_ids.append(true_label_id)
+
+    if not texts:
+        return {"error": "No labeled test examples"}
+
+    started = time.perf_counter()
+    encoded = tokenizer(texts, truncation=True, max_length=max_length)
+    lengths = [len(ids) for ids in encoded["input_ids"]]
+    batches = length_bucketed_batches(lengths, batch_size)
+    pred_ids = np.zeros(len(texts), dtype=np.int64)
+
+    with torch.inference_mode():
+        for batch in batches:
+            features = [{key: encoded[key][idx] for key in encoded.keys()} for idx in batch]
+            inputs = tokenizer.pad(features, return_tensors="pt").to(device)
+            logits = model(**inputs).logits
+            pred_ids[batch] = torch.argmax(logits, dim=-1).cpu().numpy()
+    elapsed = time.perf_counter() - started
+
+    metrics = classification_metrics(np.asarray(true_ids, dtype=np.int64), pred_ids, labels)
+    metrics["batch_size"] = batch_size
+    metrics["seconds"] = round(elapsed, 3)
+    metrics["examples_per_second"] = round(len(texts) / elapsed, 2) if elapsed > 0 else None
+    metrics["padding_ratio"] = padding_ratio(lengths, batches)
+    return metrics
+
+
+def encode_unique(model, texts: List[str], batch_size: int) -> Tuple[np.ndarray, Dict[str, int]]:
+    """Encode each distinct text once; return the matrix and a text -> row index."""
+    index: Dict[str, int] = {}
+    for text in texts:
+        index.setdefault(text, len(index))
+    embeddings = model.encode(
+        list(index.keys()),
+        batch_size=batch_size,
+        normalize_embeddings=True,
+        convert_to_numpy=True,
+    )
+    return np.asarray(embeddings, dtype=np.float32), index
+
+
+def roc_auc(scores: np.ndarray, labels: np.ndarray) -> Optional[float]:
+    """Rank-based ROC-AUC (Mann-Whitney U), ties averaged."""
+    positives = int(labels.sum())
+    negatives = int(labels.size - positives)
+    if positives == 0 or negatives == 0:
+        return None
+    order = np.argsort(scores, kind="mergesort")
+    ranks = np.empty(scores.size, dtype=np.float64)
+    sorted_scores = scores[order]
+    boundaries = np.flatnonzero(np.diff(sorted_scores)) + 1
+    starts = np.concatenate(([0], boundaries))
+    ends = np.concatenate((boundaries, [scores.size]))
+    for start, end in zip(starts, ends):
+        ranks[order[start:end]] = (start + end + 1) / 2.0
+    return float((ranks[labels].sum() - positives * (positives + 1) / 2.0) / (positives * negatives))
+
+
+def retrieval_metrics(
+    query_embeddings: np.ndarray,
+    corpus_embeddings: np.ndarray,
+    relevant: List[List[int]],
+    ks: List[int],
+    chunk_size: int = 1024,
+) -> Dict:
+    """Recall@k, MRR and nDCG@k with binary relevance over a dense corpus."""
+    max_k = min(max(ks), corpus_embeddings.shape[0])
+    recall = {k: 0.0 for k in ks}
+    ndcg = {k: 0.0 for k in ks}
+    reciprocal_rank = 0.0
+    discounts = 1.0 / np.log2(np.arange(2, max_k + 2))
+
+    for start in range(0, len(relevant), chunk_size):
+        scores = query_embeddings[start : start + chunk_size] @ corpus_embeddings.T
+        top = np.argpartition(-scores, max_k - 1, axis=1)[:, :max_k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        top = np.take_along_axis(top, np.argsort(-top_scores, axis=1), axis=1)
+        for row, ranking in enumerate(top):
+            targets = relevant[start + row]
+            hits = np.isin(ranking, targets)
+            if hits.any():
+                reciprocal_rank += 1.0 / (int(np.argmax(hits)) + 1)
+            else:
+                # Rank beyond the retrieved window: compute it exactly for MRR.
+                best = max(scores[row, targets])
+                reciprocal_rank += 1.0 / (int((scores[row] > best).sum()) + 1)
+            for k in ks:
+                window = hits[:k]
+                recall[k] += window.sum() / len(targets)
+                ideal = discounts[: min(len(targets), k)].sum()
+                ndcg[k] += float((window * discounts[: window.size]).sum() / ideal)
+
+    total = len(relevant)
     return {
-        "total_examples": total,
-        "correct_predictions": correct,
-        "accuracy": accuracy,
-        "per_class_accuracy": per_class_acc,
+        "queries": total,
+        "corpus_size": int(corpus_embeddings.shape[0]),
+        "mrr": reciprocal_rank / total,
+        **{f"recall@{k}": recall[k] / total for k in ks},
+        **{f"ndcg@{k}": ndcg[k] / total for k in ks},
     }
 
 
-def evaluate_embeddings(model, valid_data: List[Dict]) -> Dict:
-    """Evaluate embeddings model on semantic similarity tasks."""
-    if not valid_data:
+def load_kb_corpus(model, knowledge_dirs: List[Path], batch_size: int) -> Tuple[List[str], Optional[np.ndarray]]:
+    """Chunk the knowledge base the way the service does and embed it as distractors."""
+    count_tokens = chunking.make_token_counter(model.tokenizer)
+    max_tokens = chunking.max_chunk_tokens(model.tokenizer, model.max_seq_length)
+    chunks = kb_index.collect_chunks([str(path) for path in knowledge_dirs], count_tokens, max_tokens, 0)
+    texts = [str(chunk["text"]) for chunk in chunks]
+    if not texts:
+        return [], None
+    embeddings, index = encode_unique(model, texts, batch_size)
+    return list(index.keys()), embeddings
+
+
+def evaluate_embeddings(
+    model,
+    valid_data: pa.Table,
+    batch_size: int = 128,
+    threshold: float = 0.5,
+    ks: Optional[List[int]] = None,
+    knowledge_dirs: Optional[List[Path]] = None,
+) -> Dict:
+    """Evaluate embeddings on labeled pairs and on retrieval against the knowledge base."""
+    if not valid_data.num_rows:
         return {"error": "No validation data available"}
-    
-    correct_similar = 0
-    total_pairs = 0
-    
-    for example in valid_data:
-        # Handle different field name patterns
-        text_a = example.get("query") or example.get("text_a") or example.get("anchor", "")
-        text_b = example.get("document") or example.get("text_b") or example.get("positive", "")
-        
-        if not text_a or not text_b:
-            continue
-        
-        embedding_a = model.encode(text_a, normalize_embeddings=True)
-        embedding_b = model.encode(text_b, normalize_embeddings=True)
-        
-        similarity = np.dot(embedding_a, embedding_b)
-        
-        # Pairs in training data should have high similarity (> 0.5)
-        if similarity > 0.5:
-            correct_similar += 1
-        
-        total_pairs += 1
-    
-    accuracy = correct_similar / total_pairs if total_pairs > 0 else 0
-    
-    return {
-        "total_pairs": total_pairs,
-        "correctly_similar": correct_similar,
-        "similarity_accuracy": accuracy,
+
+    ks = ks or [1, 5, 10]
+    columns = (valid_data.column(name).to_pylist() for name in ("text_1", "text_2", "label"))
+    pairs = [pair for pair in zip(*columns) if pair[0] and pair[1]]
+    if not pairs:
+        return {"error": "No usable pairs"}
+
+    embeddings, index = encode_unique(model, [text for a, b, _ in pairs for text in (a, b)], batch_size)
+    rows_a = np.fromiter((index[a] for a, _, _ in pairs), dtype=np.int64, count=len(pairs))
+    rows_b = np.fromiter((index[b] for _, b, _ in pairs), dtype=np.int64, count=len(pairs))
+    labels = np.fromiter((label >= 0.5 for _, _, label in pairs), dtype=bool, count=len(pairs))
+    similarity = np.einsum("ij,ij->i", embeddings[rows_a], embeddings[rows_b])
+    predicted = similarity > threshold
+
+    results: Dict = {
+        "total_pairs": len(pairs),
+        "positive_pairs": int(labels.sum()),
+        "negative_pairs": int((~labels).sum()),
+        "threshold": threshold,
+        # Pairs classified on the correct side of the threshold (negatives must fall below it).
+        "similarity_accuracy": float((predicted == labels).mean()),
+        "positive_accuracy": float(predicted[labels].mean()) if labels.any() else None,
+        "negative_accuracy": float((~predicted[~labels]).mean()) if (~labels).any() else None,
+        "mean_positive_similarity": float(similarity[labels].mean()) if labels.any() else None,
+        "mean_negative_similarity": float(similarity[~labels].mean()) if (~labels).any() else None,
+        "roc_auc": roc_auc(similarity, labels),
     }
 
+    # Retrieval: each positive pair's text_2 must rank highly for its text_1
+    # among all positive documents plus the knowledge-base chunks.
+    relevant_by_query: Dict[int, set] = {}
+    for a_row, b_row, is_positive in zip(rows_a, rows_b, labels):
+        if is_positive:
+            relevant_by_query.setdefault(int(a_row), set()).add(int(b_row))
+    if relevant_by_query:
+        doc_rows = sorted({row for docs in relevant_by_query.values() for row in docs})
+        doc_position = {row: pos for pos, row in enumerate(doc_rows)}
+        corpus = embeddings[doc_rows]
+        kb_texts: List[str] = []
+        if knowledge_dirs:
+            kb_texts, kb_embeddings = load_kb_corpus(model, knowledge_dirs, batch_size)
+            if kb_embeddings is not None:
+                corpus = np.vstack([corpus, kb_embeddings])
+        query_rows = sorted(relevant_by_query)
+        relevant = [sorted(doc_position[row] for row in relevant_by_query[query]) for query in query_rows]
+        retrieval = retrieval_metrics(embeddings[query_rows], corpus, relevant, ks)
+        retrieval["knowledge_base_chunks"] = len(kb_texts)
+        results["retrieval"] = retrieval
+
+    return results
+
+
+def build_eval_messages(messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """Prompt messages of a canonical SFT row, without the reference answer."""
+    return [message for message in messages if message["role"] != "assistant"]
+
+
+def generation_cache_key(model_hash: str, prompt: str, max_new_tokens: int) -> str:
+    return hashlib.sha256(f"{model_hash}\0greedy\0{max_new_tokens}\0{prompt}".encode("utf-8")).hexdigest()
+
+
+def load_generation_cache(path: Path) -> Dict[str, str]:
+    cache: Dict[str, str] = {}
+    if not path.exists():
+        return cache
+    with path.open("rb+") as f:
+        data = f.read()
+        complete = data.rfind(b"\n") + 1
+        if complete < len(data):
+            # A run killed mid-write left a torn last line; cut it so the next append starts a fresh line.
+            print(f"Dropping a torn entry at the end of {path}")
+            f.truncate(complete)
+    for line in data[:complete].decode("utf-8").splitlines():
+        try:
+            entry = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        cache[entry["key"]] = entry["response"]
+    return cache
+
+
+_worker_model = None
+_worker_tokenizer = None
+_worker_device = "cpu"
+
+
+def load_generator(model_path: str, device: str, threads: Optional[int] = None) -> None:
+    """Load the SFT model once per process (also used as the pool initializer)."""
+    global _worker_model, _worker_tokenizer, _worker_device
+    if threads:
+        torch.set_num_threads(threads)
+    torch.manual_seed(0)
+    _worker_tokenizer, _worker_model = llm.load_causal_lm(model_path, device)
+    _worker_tokenizer.padding_side = "left"
+    if _worker_tokenizer.pad_token is None:
+        _worker_tokenizer.pad_token = _worker_tokenizer.eos_token
+    _worker_device = device
+
 
-def evaluate_sft_hallucination(model, tokenizer, valid_data: List[Dict], device: str) -> Dict:
-    """Evaluate SFT model for hallucination and compliance."""
-    if not valid_data:
+def generate_batch(task: Tuple[List[str], List[str], int]) -> List[Tuple[str, str]]:
+    """Greedy, left-padded generation for one batch of prompts; returns (key, response)."""
+    keys, prompts, max_new_tokens = task
+    inputs = _worker_tokenizer(prompts, return_tensors="pt", padding=True).to(_worker_device)
+    with torch.inference_mode():
+        outputs = _worker_model.generate(
+            **inputs,
+            max_new_tokens=max_new_tokens,
+            do_sample=False,
+            pad_token_id=_worker_tokenizer.pad_token_id,
+        )
+    new_tokens = outputs[:, inputs["input_ids"].shape[1] :]
+    responses = _worker_tokenizer.batch_decode(new_tokens, skip_special_tokens=True)
+    return [(key, response.strip()) for key, response in zip(keys, responses)]
+
+
+def evaluate_sft_hallucination(
+    model_path: Path,
+    valid_data: pa.Table,
+    device: str,
+    batch_size: int = 8,
+    workers: int = 1,
+    max_new_tokens: int = 256,
+    limit: Optional[int] = None,
+    cache_path: Optional[Path] = None,
+) -> Dict:
+    """Evaluate SFT model for hallucination and compliance.
+
+    Generation is greedy (deterministic), batched with left padding and cached
+    per (model hash, prompt), so reruns only generate prompts that changed.
+    With ``workers > 1`` uncached batches are sharded across CPU processes.
+    """
+    if not valid_data.num_rows:
         return {"error": "No validation data available"}
-    
+
+    tokenizer = AutoTokenizer.from_pretrained(str(model_path))
+    prompts: List[str] = []
+    rows = valid_data.slice(0, limit) if limit else valid_data
+    for messages in rows.column("messages").to_pylist():
+        messages = build_eval_messages(messages)
+        if not any(message["role"] == "user" for message in messages):
+            continue
+        prompts.append(tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True))
+
+    model_hash = model_content_hash(str(model_path))
+    keys = [generation_cache_key(model_hash, prompt, max_new_tokens) for prompt in prompts]
+    cache = load_generation_cache(cache_path) if cache_path else {}
+    pending = {}
+    for key, prompt in zip(keys, prompts):
+        if key not in cache:
+            pending[key] = prompt
+    print(f"  {len(prompts)} prompts, {len(prompts) - len(pending)} cached, {len(pending)} to generate")
+
+    # Sort by prompt length so left padding within a batch stays small.
+    ordered = sorted(pending.items(), key=lambda item: len(tokenizer(item[1])["input_ids"]))
+    tasks = [
+        ([key for key, _ in ordered[start : start + batch_size]], [p for _, p in ordered[start : start + batch_size]], max_new_tokens)
+        for start in range(0, len(ordered), batch_size)
+    ]
+
+    started = time.perf_counter()
+    cache_file = None
+    if cache_path:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        cache_file = cache_path.open("a", encoding="utf-8")
+    try:
+        if workers > 1 and device == "cpu" and len(tasks) > 1:
+            threads = max((os.cpu_count() or workers) // workers, 1)
+            context = multiprocessing.get_context("spawn")
+            with context.Pool(workers, initializer=load_generator, initargs=(str(model_path), device, threads)) as pool:
+                batches = pool.imap_unordered(generate_batch, tasks)
+                for results in batches:
+                    record_generations(results, cache, cache_file)
+        elif tasks:
+            load_generator(str(model_path), device)
+            for task in tasks:
+                record_generations(generate_batch(task), cache, cache_file)
+    finally:
+        if cache_file:
+            cache_file.close()
+    elapsed = time.perf_counter() - started
+
     total_responses = 0
     compliant_responses = 0
+    with_disclaimer = 0
     all_violations = []
-    
-    for example in valid_data[:20]:  # Limit to 20 examples for speed
-        user_msg = example.get("user")
-        if not user_msg:
-            continue
-        
-        messages = [{"role": "user", "content": user_msg}]
-        prompt = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-        inputs = tokenizer(prompt, return_tensors="pt").to(device)
-        
-        with torch.no_grad():
-            outputs = model.generate(
-                **inputs,
-                max_new_tokens=256,
-                temperature=0.3,
-                do_sample=True,
-            )
-        
-        response = tokenizer.decode(outputs[0], skip_special_tokens=True)
-        response = response.replace(prompt, "").strip()
-        
-        is_compliant, violations = check_hallucination(response)
+    for key in keys:
+        result = DEFAULT_SCANNER.scan(cache[key])
         total_responses += 1
-        
-        if is_compliant:
+        if result.disclaimers:
+            with_disclaimer += 1
+        if result.compliant:
             compliant_responses += 1
         else:
-            all_violations.extend(violations)
-    
+            all_violations.extend(result.violations)
+
     compliance_rate = compliant_responses / total_responses if total_responses > 0 else 0
-    
+
     return {
         "total_responses": total_responses,
         "compliant_responses": compliant_responses,
         "compliance_rate": compliance_rate,
         "violation_count": len(all_violations),
         "sample_violations": all_violations[:10],
+        "disclaimer_rate": with_disclaimer / total_responses if total_responses > 0 else 0,
+        "generated": len(pending),
+        "cached": total_responses - len(pending),
+        "generation_seconds": round(elapsed, 2),
+        "model_hash": model_hash,
     }
 
 
-def main():
+def record_generations(results: List[Tuple[str, str]], cache: Dict[str, str], cache_file) -> None:
+    for key, response in results:
+        cache[key] = response
+        if cache_file:
+            cache_file.write(json.dumps({"key": key, "response": response}, ensure_ascii=False) + "\n")
+    if cache_file:
+        cache_file.flush()
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Evaluate fine-tuned Credit AI models")
+    parser.add_argument("--batch-size", type=int, default=64, help="Classifier evaluation batch size")
+    parser.add_argument("--max-length", type=int, default=512, help="Classifier truncation length")
+    parser.add_argument(
+        "--classifier-data",
+        default=str(CLASSIFIER_TEST),
+        help="Labeled JSONL to evaluate the classifier on (e.g. data/finetune/dispute_classifier.jsonl)",
+    )
+    parser.add_argument("--embed-batch-size", type=int, default=128, help="Embedding encode batch size")
+    parser.add_argument("--recall-k", type=int, nargs="+", default=[1, 5, 10], help="Cut-offs for recall/nDCG")
+    parser.add_argument("--sft-batch-size", type=int, default=8, help="SFT generation batch size")
+    parser.add_argument("--sft-workers", type=int, default=1, help="CPU processes to shard SFT generation across")
+    parser.add_argument("--sft-limit", type=int, help="Only score the first N SFT validation examples")
+    parser.add_argument("--max-new-tokens", type=int, default=256, help="SFT generation length")
+    parser.add_argument("--no-generation-cache", action="store_true", help="Regenerate every SFT response")
+    parser.add_argument(
+        "--no-kb-distractors",
+        action="store_true",
+        help="Rank only against pair documents, without knowledge-base chunks",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
     print("=" * 80)
     print("AI Model Evaluation Harness")
     print("=" * 80)
@@ -257,19 +544,33 @@ def main():
         model = AutoModelForSequenceClassification.from_pretrained(str(CLASSIFIER_PATH)).to(device)
         model.eval()
         
-        test_data = load_jsonl(CLASSIFIER_TEST)
-        print(f"Loaded {len(test_data)} test examples")
+        test_data = load_examples(Path(args.classifier_data), "classifier")
+        print(f"Loaded {test_data.num_rows} test examples")
         
-        classifier_results = evaluate_classifier(model, tokenizer, test_data, device)
+        classifier_results = evaluate_classifier(
+            model, tokenizer, test_data, device, batch_size=args.batch_size, max_length=args.max_length
+        )
+        classifier_results["train_overlap"] = train_overlap(test_data.column("text").to_pylist(), CLASSIFIER_TRAIN)
         results["classifier"] = classifier_results
         
         print("\nClassifier Results:")
         print(f"  Total examples: {classifier_results.get('total_examples', 0)}")
+        overlap = classifier_results["train_overlap"]
+        if overlap.get("train_file"):
+            print(f"  Test texts also in training data: {overlap['overlapping']} ({overlap['rate']:.1%})")
+            if overlap["overlapping"]:
+                print("  WARNING: test set overlaps the training set; accuracy is inflated (regenerate the splits)")
         print(f"  Accuracy: {classifier_results.get('accuracy', 0):.2%}")
-        if "per_class_accuracy" in classifier_results:
-            print("  Per-class accuracy:")
-            for label, acc in classifier_results["per_class_accuracy"].items():
-                print(f"    {label}: {acc:.2%}")
+        print(f"  Macro F1: {classifier_results.get('macro_f1', 0):.4f}")
+        print(f"  Throughput: {classifier_results.get('examples_per_second')} examples/s")
+        if "per_class" in classifier_results:
+            print("  Per-class precision / recall / F1:")
+            for label, stats in classifier_results["per_class"].items():
+                print(f"    {label}: {stats['precision']:.2%} / {stats['recall']:.2%} / {stats['f1']:.4f}")
+        if "confusion_matrix" in classifier_results:
+            print("  Confusion matrix (rows = true, cols = predicted):")
+            for label, row in zip(classifier_results["confusion_matrix"]["labels"], classifier_results["confusion_matrix"]["matrix"]):
+                print(f"    {label:>26}: {row}")
     else:
         print(f"Classifier not found at {CLASSIFIER_PATH}")
         results["classifier"] = {"error": "Model not found"}
@@ -283,15 +584,28 @@ def main():
         print(f"Loading embeddings from {EMBEDDINGS_PATH}")
         embeddings_model = SentenceTransformer(str(EMBEDDINGS_PATH), device=device)
         
-        valid_data = load_jsonl(EMBEDDINGS_VALID)
-        print(f"Loaded {len(valid_data)} validation pairs")
+        valid_data = load_examples(EMBEDDINGS_VALID, "pairs")
+        print(f"Loaded {valid_data.num_rows} validation pairs")
         
-        embeddings_results = evaluate_embeddings(embeddings_model, valid_data)
+        embeddings_results = evaluate_embeddings(
+            embeddings_model,
+            valid_data,
+            batch_size=args.embed_batch_size,
+            ks=args.recall_k,
+            knowledge_dirs=None if args.no_kb_distractors else [p for p in KNOWLEDGE_BASE_DIRS if p.exists()],
+        )
         results["embeddings"] = embeddings_results
         
         print("\nEmbeddings Results:")
         print(f"  Total pairs: {embeddings_results.get('total_pairs', 0)}")
         print(f"  Similarity accuracy: {embeddings_results.get('similarity_accuracy', 0):.2%}")
+        print(f"  ROC-AUC: {embeddings_results.get('roc_auc')}")
+        retrieval = embeddings_results.get("retrieval")
+        if retrieval:
+            print(f"  Retrieval over {retrieval['corpus_size']} documents ({retrieval['queries']} queries):")
+            print(f"    MRR: {retrieval['mrr']:.4f}")
+            for k in args.recall_k:
+                print(f"    recall@{k}: {retrieval[f'recall@{k}']:.4f}  nDCG@{k}: {retrieval[f'ndcg@{k}']:.4f}")
     else:
         print(f"Embeddings model not found at {EMBEDDINGS_PATH}")
         results["embeddings"] = {"error": "Model not found"}
@@ -302,15 +616,20 @@ def main():
     print("=" * 80)
     
     if SFT_PATH.exists():
-        print(f"Loading SFT model from {SFT_PATH}")
-        tokenizer = AutoTokenizer.from_pretrained(str(SFT_PATH))
-        model = AutoModelForCausalLM.from_pretrained(str(SFT_PATH)).to(device)
-        model.eval()
-        
-        valid_data = load_jsonl(SFT_VALID)
-        print(f"Loaded {len(valid_data)} validation examples")
+        print(f"Using SFT model from {SFT_PATH}")
+        valid_data = load_examples(SFT_VALID, "sft")
+        print(f"Loaded {valid_data.num_rows} validation examples")
         
-        sft_results = evaluate_sft_hallucination(model, tokenizer, valid_data, device)
+        sft_results = evaluate_sft_hallucination(
+            SFT_PATH,
+            valid_data,
+            device,
+            batch_size=args.sft_batch_size,
+            workers=args.sft_workers,
+            max_new_tokens=args.max_new_tokens,
+            limit=args.sft_limit,
+            cache_path=None if args.no_generation_cache else SFT_GENERATION_CACHE,
+        )
         results["sft"] = sft_results
         
         print("\nSFT Model Results (Hallucination & Compliance):")
@@ -318,6 +637,8 @@ def main():
         print(f"  Compliant responses: {sft_results.get('compliant_responses', 0)}")
         print(f"  Compliance rate: {sft_results.get('compliance_rate', 0):.2%}")
         print(f"  Violation count: {sft_results.get('violation_count', 0)}")
+        print(f"  Disclaimer rate: {sft_results.get('disclaimer_rate', 0):.2%}")
+        print(f"  Generated: {sft_results.get('generated', 0)} (cached: {sft_results.get('cached', 0)})")
         if sft_results.get("sample_violations"):
             print("  Sample violations:")
             for v in sft_results["sample_violations"]:
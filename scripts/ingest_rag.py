@@ -1,19 +1,34 @@
 import argparse
+import gzip
 import hashlib
+import heapq
+import itertools
+import json
 import os
 import re
+import sys
 import time
+from collections import deque
+from dataclasses import dataclass, field
 from datetime import datetime, timezone
-from typing import Dict, Iterable, List, Optional, Set
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
 from urllib.parse import urljoin, urlparse
+from urllib.robotparser import RobotFileParser
 from io import BytesIO
 
+import numpy as np
 import requests
 import trafilatura
 import yaml
-from lxml import html
+from lxml import etree, html
 from pypdf import PdfReader
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "services", "local-ai"))
+
+import chunking  # noqa: E402
+import kb_index  # noqa: E402
+from model_ids import MINILM_MODEL_ID, model_content_hash  # noqa: E402
+
 
 def load_config(path: str) -> dict:
     with open(path, "r", encoding="utf-8") as f:
@@ -84,20 +99,18 @@ def extract_text(url: str, response: requests.Response) -> str:
         return ""
 
 
-def chunk_text(text: str, chunk_size: int, overlap: int) -> List[str]:
-    words = text.split()
-    if not words:
-        return []
-    chunks = []
-    step = max(chunk_size - overlap, 1)
-    for start in range(0, len(words), step):
-        end = min(start + chunk_size, len(words))
-        chunk = " ".join(words[start:end]).strip()
-        if chunk:
-            chunks.append(chunk)
-        if end == len(words):
-            break
-    return chunks
+def build_chunker(config: dict) -> Callable[[str], List[str]]:
+    """Chunk by embedder tokens so stored chunks fit the MiniLM sequence length."""
+    tokenizer = chunking.load_tokenizer(config.get("tokenizer_model", chunking.DEFAULT_TOKENIZER_ID))
+    count_tokens = chunking.make_token_counter(tokenizer)
+    limit = chunking.max_chunk_tokens(tokenizer, config.get("embedder_max_seq_length"))
+    chunk_size = min(int(config["chunk_size_tokens"]), limit)
+    overlap = int(config["chunk_overlap_tokens"])
+
+    def chunk(text: str) -> List[str]:
+        return chunking.chunk_text(text, count_tokens, max_tokens=chunk_size, overlap_tokens=overlap)
+
+    return chunk
 
 
 def write_chunks(
@@ -135,6 +148,13 @@ def write_chunks(
             f.write(chunk)
             f.write("\n")
 
+    # A refreshed page can yield fewer chunks than last time; its old trailing chunks must not stay indexed.
+    chunk_file = re.compile(rf"{re.escape(base_slug)}-chunk-(\d+)\.md")
+    for name in os.listdir(output_dir):
+        match = chunk_file.fullmatch(name)
+        if match and int(match.group(1)) > len(chunks):
+            os.remove(os.path.join(output_dir, name))
+
 
 def fetch_url(url: str, headers: Dict[str, str], timeout: int) -> Optional[requests.Response]:
     try:
@@ -146,55 +166,351 @@ def fetch_url(url: str, headers: Dict[str, str], timeout: int) -> Optional[reque
     return response
 
 
+def parse_lastmod(value: Optional[str]) -> Optional[float]:
+    """Parse a sitemap <lastmod> (W3C datetime or plain date) into a UTC timestamp."""
+    if not value:
+        return None
+    value = value.strip().replace("Z", "+00:00")
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+class RobotsCache:
+    """Fetches and caches robots.txt per domain (RFC 9309 error handling)."""
+
+    def __init__(self, headers: Dict[str, str], user_agent: str, timeout: int = 20):
+        self.headers = headers
+        self.user_agent = user_agent
+        self.timeout = timeout
+        self.parsers: Dict[str, RobotFileParser] = {}
+
+    def parser(self, url: str) -> RobotFileParser:
+        parsed = urlparse(url)
+        domain = parsed.netloc
+        if domain in self.parsers:
+            return self.parsers[domain]
+
+        robots_url = f"{parsed.scheme or 'https'}://{domain}/robots.txt"
+        parser = RobotFileParser(robots_url)
+        try:
+            response = requests.get(robots_url, headers=self.headers, timeout=self.timeout)
+        except Exception:
+            response = None
+        if response is None or response.status_code >= 500:
+            # Unreachable robots.txt means "assume complete disallow".
+            parser.disallow_all = True
+        elif response.status_code in (401, 403):
+            parser.disallow_all = True
+        elif response.status_code >= 400:
+            parser.allow_all = True
+        else:
+            parser.parse(response.text.splitlines())
+        parser.modified()
+        self.parsers[domain] = parser
+        return parser
+
+    def allowed(self, url: str) -> bool:
+        return self.parser(url).can_fetch(self.user_agent, url)
+
+    def crawl_delay(self, url: str) -> Optional[float]:
+        delay = self.parser(url).crawl_delay(self.user_agent)
+        return float(delay) if delay is not None else None
+
+    def sitemaps(self, url: str) -> List[str]:
+        return list(self.parser(url).site_maps() or [])
+
+
+def fetch_sitemap_entries(
+    sitemap_urls: List[str],
+    headers: Dict[str, str],
+    max_urls: int,
+    max_files: int,
+) -> List[Tuple[str, Optional[str]]]:
+    """Expand sitemaps (following sitemap indexes) into (loc, lastmod) entries."""
+    entries: List[Tuple[str, Optional[str]]] = []
+    pending = deque(sitemap_urls)
+    seen: Set[str] = set()
+    while pending and len(seen) < max_files and len(entries) < max_urls:
+        sitemap_url = pending.popleft()
+        if sitemap_url in seen:
+            continue
+        seen.add(sitemap_url)
+        response = fetch_url(sitemap_url, headers=headers, timeout=20)
+        if not response:
+            continue
+        content = response.content
+        if content[:2] == b"\x1f\x8b":
+            try:
+                content = gzip.decompress(content)
+            except OSError:
+                continue
+        try:
+            root = etree.fromstring(content)
+        except Exception:
+            continue
+
+        for node in root.xpath("/*[local-name()='sitemapindex']/*[local-name()='sitemap']"):
+            loc = node.xpath("string(*[local-name()='loc'])").strip()
+            if loc:
+                pending.append(loc)
+        for node in root.xpath("/*[local-name()='urlset']/*[local-name()='url']"):
+            loc = node.xpath("string(*[local-name()='loc'])").strip()
+            lastmod = node.xpath("string(*[local-name()='lastmod'])").strip() or None
+            if loc:
+                entries.append((loc, lastmod))
+                if len(entries) >= max_urls:
+                    break
+    return entries
+
+
+def scope_prefixes(seed_urls: List[str]) -> List[str]:
+    """Seed URLs with a real path define the content the source is really after."""
+    prefixes = []
+    for url in seed_urls:
+        if urlparse(url).path.strip("/"):
+            prefixes.append(url.rstrip("/"))
+    return prefixes
+
+
+# A frontier entry is (url, depth, rank, lastmod). Lower rank is fetched first
+# within a depth: in-scope pages before out-of-scope ones, newest lastmod first.
+FrontierEntry = Tuple[str, int, float, Optional[str]]
+OUT_OF_SCOPE_PENALTY = 1e12
+
+
+def frontier_rank(url: str, prefixes: List[str], lastmod: Optional[str]) -> float:
+    in_scope = not prefixes or any(url.startswith(prefix) for prefix in prefixes)
+    timestamp = parse_lastmod(lastmod) or 0.0
+    return (0.0 if in_scope else OUT_OF_SCOPE_PENALTY) - timestamp
+
+
+@dataclass
+class CrawlState:
+    visited: Set[str] = field(default_factory=set)
+    domain_counts: Dict[str, int] = field(default_factory=dict)
+    domain_bytes: Dict[str, int] = field(default_factory=dict)
+    frontier: Dict[str, List[FrontierEntry]] = field(default_factory=dict)
+    completed_sources: List[str] = field(default_factory=list)
+
+
+def write_json_atomic(path: str, data: dict) -> None:
+    """Write JSON via a temp file and rename so a crash never leaves a torn file."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_state(path: str) -> CrawlState:
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    frontier: Dict[str, List[FrontierEntry]] = {}
+    for name, queue in data.get("frontier", {}).items():
+        # Checkpoints written before sitemap discovery only stored (url, depth).
+        frontier[name] = [
+            (item[0], int(item[1]), float(item[2]) if len(item) > 2 else 0.0, item[3] if len(item) > 3 else None)
+            for item in queue
+        ]
+    return CrawlState(
+        visited=set(data.get("visited", [])),
+        domain_counts=dict(data.get("domain_counts", {})),
+        domain_bytes=dict(data.get("domain_bytes", {})),
+        frontier=frontier,
+        completed_sources=list(data.get("completed_sources", [])),
+    )
+
+
+def save_state(path: str, state: CrawlState) -> None:
+    write_json_atomic(
+        path,
+        {
+            "saved_at": datetime.now(timezone.utc).isoformat(),
+            "visited": sorted(state.visited),
+            "domain_counts": state.domain_counts,
+            "domain_bytes": state.domain_bytes,
+            "frontier": {name: [list(item) for item in queue] for name, queue in state.frontier.items()},
+            "completed_sources": state.completed_sources,
+        },
+    )
+
+
+def load_lastmod_registry(path: str) -> Dict[str, str]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class CrawlProgress:
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.started = time.monotonic()
+        self.last_report = self.started
+        self.pages = 0
+        self.bytes = 0
+
+    def record(self, size: int) -> None:
+        self.pages += 1
+        self.bytes += size
+
+    def maybe_report(self, urls: Iterable[str], force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self.last_report < self.interval:
+            return
+        self.last_report = now
+        elapsed = max(now - self.started, 1e-9)
+        depth: Dict[str, int] = {}
+        for url in urls:
+            domain = urlparse(url).netloc
+            depth[domain] = depth.get(domain, 0) + 1
+        queued = ", ".join(f"{domain}={count}" for domain, count in sorted(depth.items())) or "empty"
+        print(
+            f"[crawl] pages={self.pages} ({self.pages / elapsed:.2f}/s) "
+            f"bytes={self.bytes} ({self.bytes / elapsed / 1024:.1f} KiB/s) queue: {queued}",
+            flush=True,
+        )
+
+
+def discover_from_sitemaps(
+    source: dict,
+    config: dict,
+    robots: Optional[RobotsCache],
+    headers: Dict[str, str],
+    lastmod_registry: Dict[str, str],
+    refresh: bool,
+) -> List[FrontierEntry]:
+    """Seed the frontier from each seed domain's sitemaps, ranked by scope and lastmod."""
+    seeds = [normalize_url(url) for url in source.get("urls", [])]
+    prefixes = scope_prefixes(seeds)
+    exclude = config.get("exclude_url_patterns", [])
+    leaf_depth = int(config["crawl_depth"])
+    max_urls = int(config.get("sitemap_max_urls_per_domain", 5000))
+    max_files = int(config.get("sitemap_max_files_per_domain", 20))
+
+    entries: List[FrontierEntry] = []
+    seen_domains: Set[str] = set()
+    for seed in seeds:
+        parsed = urlparse(seed)
+        if parsed.netloc in seen_domains:
+            continue
+        seen_domains.add(parsed.netloc)
+        sitemap_urls = robots.sitemaps(seed) if robots else []
+        if not sitemap_urls:
+            sitemap_urls = [f"{parsed.scheme}://{parsed.netloc}/sitemap.xml"]
+
+        for loc, lastmod in fetch_sitemap_entries(sitemap_urls, headers, max_urls, max_files):
+            if not same_domain(seed, loc) or not is_allowed(loc, exclude):
+                continue
+            if robots and not robots.allowed(loc):
+                continue
+            if refresh and lastmod and lastmod_registry.get(loc) == lastmod:
+                continue
+            # Sitemap entries are content pages: fetch them, but don't expand
+            # their navigation links (they enter the frontier at the leaf depth).
+            entries.append((loc, leaf_depth, frontier_rank(loc, prefixes, lastmod), lastmod))
+    return entries
+
+
 def crawl_source(
     source: dict,
     config: dict,
-    visited: Set[str],
-    domain_counts: Dict[str, int],
+    state: CrawlState,
+    chunk: Callable[[str], List[str]],
+    progress: CrawlProgress,
+    checkpoint: Callable[[], None],
+    robots: Optional[RobotsCache],
+    lastmod_registry: Dict[str, str],
+    refresh: bool = False,
 ) -> None:
     output_dir = config["output_dir"]
-    chunk_size = int(config["chunk_size_tokens"])
-    overlap = int(config["chunk_overlap_tokens"])
     crawl_depth = int(config["crawl_depth"])
     max_pages = int(config["max_pages_per_domain"])
+    max_bytes = int(config.get("max_bytes_per_domain", 0))
     delay = float(config["request_delay_seconds"])
     exclude = config.get("exclude_url_patterns", [])
+    checkpoint_every = int(config.get("checkpoint_every_pages", 25))
+    discovery = config.get("discovery", "links")
 
     authority_level = source.get("authority_level", "secondary")
     jurisdiction = source.get("jurisdiction", config.get("jurisdiction_default", "US"))
     user_agent = config.get("user_agent", "CreditAI-RAG-Ingest/1.0")
 
     headers = {"User-Agent": user_agent}
-    queue = [(normalize_url(url), 0) for url in source.get("urls", [])]
+    visited = state.visited
+    domain_counts = state.domain_counts
+    domain_bytes = state.domain_bytes
+    name = source["name"]
+    seeds = [normalize_url(url) for url in source.get("urls", [])]
+    prefixes = scope_prefixes(seeds)
+    if name not in state.frontier:
+        initial: List[FrontierEntry] = []
+        if not refresh:
+            initial = [(url, 0, frontier_rank(url, prefixes, None), None) for url in seeds]
+        if discovery == "sitemap" or refresh:
+            initial.extend(discover_from_sitemaps(source, config, robots, headers, lastmod_registry, refresh))
+        state.frontier[name] = initial
+
+    queue: List[Tuple[int, float, int, str, Optional[str]]] = []
+    counter = itertools.count()
+    for url, depth, rank, lastmod in state.frontier[name]:
+        heapq.heappush(queue, (depth, rank, next(counter), url, lastmod))
+    fetched_since_checkpoint = 0
+
+    def sync_frontier() -> None:
+        state.frontier[name] = [(url, depth, rank, lastmod) for depth, rank, _, url, lastmod in sorted(queue)]
+
+    def over_budget(domain: str) -> bool:
+        if domain_counts.get(domain, 0) >= max_pages:
+            return True
+        return bool(max_bytes) and domain_bytes.get(domain, 0) >= max_bytes
 
     while queue:
-        url, depth = queue.pop(0)
+        depth, _, _, url, sitemap_lastmod = heapq.heappop(queue)
         if url in visited:
             continue
         if not is_allowed(url, exclude):
             continue
+        if robots and not robots.allowed(url):
+            continue
 
         domain = urlparse(url).netloc
-        if domain_counts.get(domain, 0) >= max_pages:
+        if over_budget(domain):
             continue
 
         response = fetch_url(url, headers=headers, timeout=20)
+        page_delay = delay
+        if robots:
+            page_delay = max(delay, robots.crawl_delay(url) or 0.0)
         if not response:
+            time.sleep(page_delay)
             continue
 
         visited.add(url)
         domain_counts[domain] = domain_counts.get(domain, 0) + 1
+        domain_bytes[domain] = domain_bytes.get(domain, 0) + len(response.content)
+        progress.record(len(response.content))
+        if sitemap_lastmod:
+            lastmod_registry[url] = sitemap_lastmod
 
         retrieved_at = datetime.now(timezone.utc).isoformat()
-        last_updated = response.headers.get("Last-Modified", "unknown")
+        last_updated = response.headers.get("Last-Modified") or sitemap_lastmod or "unknown"
 
         text = extract_text(url, response)
         if text:
-            chunks = chunk_text(text, chunk_size=chunk_size, overlap=overlap)
+            chunks = chunk(text)
             if chunks:
                 write_chunks(
                     output_dir=output_dir,
-                    source_name=source["name"],
+                    source_name=name,
                     url=url,
                     authority_level=authority_level,
                     jurisdiction=jurisdiction,
@@ -203,41 +519,157 @@ def crawl_source(
                     chunks=chunks,
                 )
 
-        if depth >= crawl_depth or url.lower().endswith(".pdf"):
-            time.sleep(delay)
-            continue
-
-        try:
-            links = list(iter_links(url, response.text))
-        except Exception:
-            links = []
-
-        for link in links:
-            if link in visited:
-                continue
-            if not same_domain(url, link):
-                continue
-            if not is_allowed(link, exclude):
-                continue
-            queue.append((link, depth + 1))
+        if not refresh and depth < crawl_depth and not url.lower().endswith(".pdf"):
+            try:
+                links = list(iter_links(url, response.text))
+            except Exception:
+                links = []
+
+            for link in links:
+                if link in visited:
+                    continue
+                if not same_domain(url, link):
+                    continue
+                if not is_allowed(link, exclude):
+                    continue
+                heapq.heappush(queue, (depth + 1, frontier_rank(link, prefixes, None), next(counter), link, None))
+
+        # The frontier is only synced at checkpoints; pages fetched after the
+        # last checkpoint are simply fetched again on resume.
+        fetched_since_checkpoint += 1
+        if fetched_since_checkpoint >= checkpoint_every:
+            sync_frontier()
+            checkpoint()
+            fetched_since_checkpoint = 0
+        progress.maybe_report(item[3] for item in queue)
+
+        time.sleep(page_delay)
+
+    sync_frontier()
+
+
+def build_index(config: dict, model_id: str) -> None:
+    """Embed the knowledge base and publish an index artifact for the service.
+
+    Chunks whose text is unchanged reuse vectors from the live index, so only
+    new or edited chunks go through the embedder.
+    """
+    from sentence_transformers import SentenceTransformer
+
+    index_dir = config.get("index_dir", "data/knowledge-base/index")
+    knowledge_dirs = config.get("index_knowledge_dirs", ["data/knowledge-base"])
+    overlap = int(config["chunk_overlap_tokens"])
+    batch_size = int(config.get("embed_batch_size", 64))
+
+    model = SentenceTransformer(model_id)
+    count_tokens = chunking.make_token_counter(model.tokenizer)
+    max_tokens = min(int(config["chunk_size_tokens"]), chunking.max_chunk_tokens(model.tokenizer, model.max_seq_length))
+
+    started = time.monotonic()
+    chunks = kb_index.collect_chunks([os.path.abspath(path) for path in knowledge_dirs], count_tokens, max_tokens, overlap)
+    model_hash = model_content_hash(model_id)
+    cached = kb_index.cached_embeddings(index_dir, model_hash)
+    missing = [idx for idx, chunk in enumerate(chunks) if chunk["hash"] not in cached]
+    print(f"[index] {len(chunks)} chunks, {len(chunks) - len(missing)} reused, {len(missing)} to embed")
+
+    dim = model.get_sentence_embedding_dimension()
+    embeddings = np.zeros((len(chunks), dim), dtype=np.float32)
+    for idx, chunk in enumerate(chunks):
+        vector = cached.get(str(chunk["hash"]))
+        if vector is not None:
+            embeddings[idx] = vector
+    if missing:
+        encoded = model.encode(
+            [str(chunks[idx]["text"]) for idx in missing],
+            batch_size=batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=True,
+        )
+        embeddings[missing] = encoded
 
-        time.sleep(delay)
+    version_dir = kb_index.publish_index(
+        index_dir,
+        chunks,
+        embeddings,
+        model_id=model_id,
+        chunking_params={"max_tokens": max_tokens, "overlap_tokens": overlap},
+        keep_versions=int(config.get("index_keep_versions", 3)),
+        model_hash=model_hash,
+    )
+    print(f"[index] published {version_dir} in {time.monotonic() - started:.1f}s")
 
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="Ingest approved RAG sources into markdown chunks")
     parser.add_argument("--config", default="ai/config/rag_sources.yaml")
+    parser.add_argument("--resume", action="store_true", help="Continue from the last crawl checkpoint")
+    parser.add_argument("--state-file", help="Checkpoint path (defaults to state_file in the config)")
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Only fetch sitemap pages that are new or whose lastmod changed since the last run",
+    )
+    parser.add_argument("--embed", action="store_true", help="Embed chunks and publish a knowledge index")
+    parser.add_argument("--embed-only", action="store_true", help="Skip crawling; only rebuild the index")
+    parser.add_argument(
+        "--embedding-model",
+        help="Embedder id (defaults to embedding_model in the config, else the service's MINILM_MODEL_ID)",
+    )
     args = parser.parse_args()
 
     config = load_config(args.config)
     output_dir = config.get("output_dir", "data/knowledge-base/ingested")
     os.makedirs(output_dir, exist_ok=True)
-
-    visited: Set[str] = set()
-    domain_counts: Dict[str, int] = {}
-
-    for source in config.get("sources", []):
-        crawl_source(source, config, visited, domain_counts)
+    # The service only uses an index built with the checkpoint it embeds queries with.
+    embedding_model = args.embedding_model or config.get("embedding_model") or MINILM_MODEL_ID
+    if args.embed_only:
+        build_index(config, embedding_model)
+        return
+    state_file = args.state_file or config.get("state_file", os.path.join(output_dir, ".crawl_state.json"))
+    lastmod_file = config.get("lastmod_file", os.path.join(output_dir, ".sitemap_lastmod.json"))
+
+    state = CrawlState()
+    if args.resume and os.path.exists(state_file):
+        state = load_state(state_file)
+        print(
+            f"Resuming crawl: {len(state.visited)} visited, "
+            f"{sum(len(queue) for queue in state.frontier.values())} queued, "
+            f"{len(state.completed_sources)} sources complete"
+        )
+    elif args.resume:
+        print(f"No checkpoint at {state_file}; starting a fresh crawl")
+
+    chunk = build_chunker(config)
+    progress = CrawlProgress(float(config.get("progress_interval_seconds", 10)))
+    lastmod_registry = load_lastmod_registry(lastmod_file)
+    robots = None
+    if config.get("respect_robots_txt", True):
+        user_agent = config.get("user_agent", "CreditAI-RAG-Ingest/1.0")
+        robots = RobotsCache({"User-Agent": user_agent}, user_agent)
+
+    def checkpoint() -> None:
+        save_state(state_file, state)
+        write_json_atomic(lastmod_file, lastmod_registry)
+
+    # Only consistent snapshots (visited set and frontier synced together) are
+    # written, so an interrupted run loses at most checkpoint_every_pages pages.
+    try:
+        for source in config.get("sources", []):
+            if source["name"] in state.completed_sources:
+                continue
+            crawl_source(source, config, state, chunk, progress, checkpoint, robots, lastmod_registry, args.refresh)
+            state.completed_sources.append(source["name"])
+            state.frontier.pop(source["name"], None)
+            checkpoint()
+    except KeyboardInterrupt:
+        print(f"Interrupted; rerun with --resume to continue from {state_file}")
+        raise
+    finally:
+        progress.maybe_report([item[0] for queue in state.frontier.values() for item in queue], force=True)
+
+    if args.embed:
+        build_index(config, embedding_model)
 
 
 if __name__ == "__main__":
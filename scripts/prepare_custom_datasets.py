@@ -1,20 +1,54 @@
+"""Build custom_classifier.jsonl, custom_sft.jsonl and custom_pairs.jsonl from datasets/.
+
+Each source file is parsed on its own, so independent sources are parsed in
+parallel. The rows of each source are cached under .cache/custom_datasets/,
+keyed by the file's SHA-256 and PARSER_VERSION. manifest.json records the
+hashes from the last run. On the next run:
+- only new or changed sources are parsed again;
+- an output is rewritten only when the set of its source hashes changed.
+"""
+
+import argparse
 import csv
+import hashlib
 import json
 import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
 import yaml
 
 BASE_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(BASE_DIR / "services" / "local-ai"))
+
+try:
+    import training_data  # noqa: E402
+except ImportError:  # pyarrow not installed
+    training_data = None
+
 DATASETS_DIR = BASE_DIR / "datasets"
 OUTPUT_DIR = BASE_DIR / "data" / "finetune"
+CACHE_DIR = BASE_DIR / ".cache" / "custom_datasets"
+MANIFEST_PATH = CACHE_DIR / "manifest.json"
+
+# Bump when a parser's output changes, so cached rows are rebuilt.
+PARSER_VERSION = 1
 
 COMPLIANCE_SYSTEM = (
     "You are a credit compliance assistant. Do not guarantee outcomes, avoid legal advice, "
     "and provide factual, educational guidance only."
 )
 
+EMBEDDING_SOURCES = [
+    "compliance/fcra_sections.json",
+    "compliance/cfpb_guidelines.yaml",
+    "strategies/utilization_strategies.json",
+    "strategies/timeline_expectations.csv",
+    "tradelines/tradeline_types.json",
+]
+
 
 def safe_float(value: Optional[str]) -> Optional[float]:
     if value is None:
@@ -32,11 +66,24 @@ def ensure_output_dir() -> None:
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
 
-def write_jsonl(path: Path, rows: List[Dict[str, Any]]) -> None:
+def write_jsonl(path: Path, rows: Iterable[Dict[str, Any]]) -> int:
+    """Stream ``rows`` to ``path`` through a temporary file; returns the row count."""
     path.parent.mkdir(parents=True, exist_ok=True)
-    with path.open("w", encoding="utf-8") as f:
+    tmp = path.with_name(path.name + ".tmp")
+    count = 0
+    with tmp.open("w", encoding="utf-8") as f:
         for row in rows:
             f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            count += 1
+    os.replace(tmp, path)
+    return count
+
+
+def read_jsonl(path: Path) -> Iterator[Dict[str, Any]]:
+    with path.open("r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
 
 
 def load_json(path: Path) -> Any:
@@ -49,13 +96,16 @@ def load_yaml(path: Path) -> Any:
         return yaml.safe_load(f)
 
 
-def build_classifier_examples() -> List[Dict[str, Any]]:
-    rows: List[Dict[str, Any]] = []
-    csv_path = DATASETS_DIR / "credit_disputes" / "dispute_reasons.csv"
-    if not csv_path.exists():
-        return rows
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
 
-    with csv_path.open("r", encoding="utf-8") as f:
+
+def iter_classifier_examples(path: Path) -> Iterator[Dict[str, Any]]:
+    with path.open("r", encoding="utf-8") as f:
         reader = csv.DictReader(f)
         for item in reader:
             account_type = item.get("account_type", "unknown")
@@ -78,124 +128,216 @@ def build_classifier_examples() -> List[Dict[str, Any]]:
                 f"Legal basis: {legal_basis}."
             )
 
-            rows.append({"text": text, "label": label})
+            yield {"text": text, "label": label}
 
-    return rows
 
-
-def build_template_examples() -> List[Dict[str, Any]]:
-    rows: List[Dict[str, Any]] = []
-    templates_dir = DATASETS_DIR / "templates"
-    if not templates_dir.exists():
-        return rows
-
-    for path in templates_dir.glob("*.json"):
-        try:
-            data = load_json(path)
-        except Exception:
+def iter_template_examples(path: Path) -> Iterator[Dict[str, Any]]:
+    try:
+        data = load_json(path)
+    except Exception:
+        return
+
+    entries = data if isinstance(data, list) else data.get("templates", [])
+    for entry in entries:
+        letter_type = entry.get("letter_type", "general")
+        scenario = entry.get("scenario", "general")
+        tone = entry.get("tone", "formal")
+        compliance_level = entry.get("compliance_level", "high")
+        content = (
+            entry.get("template")
+            or entry.get("content")
+            or entry.get("letter")
+            or entry.get("body")
+        )
+        if not content:
             continue
 
-        entries = data if isinstance(data, list) else data.get("templates", [])
-        for entry in entries:
-            letter_type = entry.get("letter_type", "general")
-            scenario = entry.get("scenario", "general")
-            tone = entry.get("tone", "formal")
-            compliance_level = entry.get("compliance_level", "high")
-            content = (
-                entry.get("template")
-                or entry.get("content")
-                or entry.get("letter")
-                or entry.get("body")
-            )
-            if not content:
-                continue
-
-            user = (
-                f"Write a {tone} {letter_type} dispute letter for scenario: {scenario}. "
-                f"Compliance level: {compliance_level}."
-            )
-            rows.append({
-                "system": COMPLIANCE_SYSTEM,
-                "user": user,
-                "assistant": content,
-            })
-
-    return rows
+        user = (
+            f"Write a {tone} {letter_type} dispute letter for scenario: {scenario}. "
+            f"Compliance level: {compliance_level}."
+        )
+        yield {
+            "system": COMPLIANCE_SYSTEM,
+            "user": user,
+            "assistant": content,
+        }
 
 
-def iter_text_records(obj: Any) -> List[Dict[str, str]]:
-    records: List[Dict[str, str]] = []
+def iter_text_records(obj: Any) -> Iterator[Dict[str, str]]:
     if isinstance(obj, list):
         for item in obj:
-            records.extend(iter_text_records(item))
-        return records
-    if isinstance(obj, dict):
+            yield from iter_text_records(item)
+    elif isinstance(obj, dict):
         title = obj.get("title") or obj.get("section") or obj.get("name")
         body = obj.get("text") or obj.get("content") or obj.get("body")
         if title and body:
-            records.append({"title": str(title), "text": str(body)})
+            yield {"title": str(title), "text": str(body)}
         else:
             for value in obj.values():
-                records.extend(iter_text_records(value))
-    return records
-
-
-def build_embedding_pairs() -> List[Dict[str, Any]]:
-    rows: List[Dict[str, Any]] = []
-    sources = [
-        DATASETS_DIR / "compliance" / "fcra_sections.json",
-        DATASETS_DIR / "compliance" / "cfpb_guidelines.yaml",
-        DATASETS_DIR / "strategies" / "utilization_strategies.json",
-        DATASETS_DIR / "strategies" / "timeline_expectations.csv",
-        DATASETS_DIR / "tradelines" / "tradeline_types.json",
-    ]
-
-    for path in sources:
-        if not path.exists():
-            continue
+                yield from iter_text_records(value)
+
 
-        records: List[Dict[str, str]] = []
-        if path.suffix == ".json":
-            try:
-                records = iter_text_records(load_json(path))
-            except Exception:
-                records = []
-        elif path.suffix in {".yaml", ".yml"}:
-            try:
-                records = iter_text_records(load_yaml(path))
-            except Exception:
-                records = []
-        elif path.suffix == ".csv":
-            with path.open("r", encoding="utf-8") as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    title = row.get("action") or row.get("profile") or row.get("topic")
-                    body = row.get("expected_impact") or row.get("timeframe_days")
-                    if title and body:
-                        records.append({"title": str(title), "text": str(body)})
-
-        for record in records:
-            query = f"What does {record['title']} mean?"
-            rows.append({"query": query, "document": record["text"], "score": 1.0})
-
-    return rows
-
-
-def main() -> None:
+def iter_source_records(path: Path) -> Iterator[Dict[str, str]]:
+    if path.suffix == ".json":
+        try:
+            data = load_json(path)
+        except Exception:
+            return
+        yield from iter_text_records(data)
+    elif path.suffix in {".yaml", ".yml"}:
+        try:
+            data = load_yaml(path)
+        except Exception:
+            return
+        yield from iter_text_records(data)
+    elif path.suffix == ".csv":
+        with path.open("r", encoding="utf-8") as f:
+            reader = csv.DictReader(f)
+            for row in reader:
+                title = row.get("action") or row.get("profile") or row.get("topic")
+                body = row.get("expected_impact") or row.get("timeframe_days")
+                if title and body:
+                    yield {"title": str(title), "text": str(body)}
+
+
+def iter_embedding_pairs(path: Path) -> Iterator[Dict[str, Any]]:
+    for record in iter_source_records(path):
+        query = f"What does {record['title']} mean?"
+        yield {"query": query, "document": record["text"], "score": 1.0}
+
+
+# Parser name -> row generator. Workers look parsers up by name, so they stay picklable.
+PARSERS: Dict[str, Callable[[Path], Iterator[Dict[str, Any]]]] = {
+    "classifier": iter_classifier_examples,
+    "template": iter_template_examples,
+    "embedding": iter_embedding_pairs,
+}
+
+
+def discover_sources() -> Dict[str, Tuple[str, List[str]]]:
+    """Output file -> (parser, existing source files relative to DATASETS_DIR, in output order)."""
+    templates_dir = DATASETS_DIR / "templates"
+    templates = sorted(
+        path.relative_to(DATASETS_DIR).as_posix() for path in templates_dir.glob("*.json")
+    ) if templates_dir.exists() else []
+    outputs = {
+        "custom_classifier.jsonl": ("classifier", ["credit_disputes/dispute_reasons.csv"]),
+        "custom_sft.jsonl": ("template", templates),
+        "custom_pairs.jsonl": ("embedding", EMBEDDING_SOURCES),
+    }
+    return {
+        name: (parser, [rel for rel in sources if (DATASETS_DIR / rel).exists()])
+        for name, (parser, sources) in outputs.items()
+    }
+
+
+def cache_path(parser: str, digest: str) -> Path:
+    return CACHE_DIR / f"{parser}-v{PARSER_VERSION}-{digest[:24]}.jsonl"
+
+
+def parse_source(task: Tuple[str, str, str]) -> Tuple[str, int]:
+    """Parse one source file into its row cache (runs in a worker process)."""
+    parser, rel_path, digest = task
+    count = write_jsonl(cache_path(parser, digest), PARSERS[parser](DATASETS_DIR / rel_path))
+    return rel_path, count
+
+
+def load_manifest() -> Dict[str, Any]:
+    if not MANIFEST_PATH.exists():
+        return {}
+    try:
+        manifest = json.loads(MANIFEST_PATH.read_text(encoding="utf-8"))
+    except ValueError:
+        return {}
+    return manifest if manifest.get("parser_version") == PARSER_VERSION else {}
+
+
+def save_manifest(manifest: Dict[str, Any]) -> None:
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = MANIFEST_PATH.with_name(MANIFEST_PATH.name + ".tmp")
+    tmp.write_text(json.dumps(manifest, indent=2, sort_keys=True), encoding="utf-8")
+    os.replace(tmp, MANIFEST_PATH)
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Build custom fine-tuning datasets from datasets/")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processes parsing sources")
+    parser.add_argument("--force", action="store_true", help="Ignore the manifest and reparse every source")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> None:
+    args = parse_args(argv)
     ensure_output_dir()
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+
+    outputs = discover_sources()
+    previous = {} if args.force else load_manifest()
+    previous_sources: Dict[str, Dict[str, Any]] = previous.get("sources", {})
+
+    sources: Dict[str, Dict[str, Any]] = {}
+    pending: List[Tuple[str, str, str]] = []
+    for parser, rel_paths in outputs.values():
+        for rel_path in rel_paths:
+            digest = file_sha256(DATASETS_DIR / rel_path)
+            entry = previous_sources.get(rel_path)
+            if entry and entry["sha256"] == digest and entry["parser"] == parser and cache_path(parser, digest).exists():
+                sources[rel_path] = entry
+            else:
+                sources[rel_path] = {"sha256": digest, "parser": parser, "rows": None}
+                pending.append((parser, rel_path, digest))
+
+    if pending:
+        workers = max(1, min(args.workers, len(pending)))
+        print(f"Parsing {len(pending)} changed source(s) with {workers} worker(s)")
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                parsed = list(executor.map(parse_source, pending))
+        else:
+            parsed = [parse_source(task) for task in pending]
+        for rel_path, count in parsed:
+            sources[rel_path]["rows"] = count
+    print(f"{len(sources) - len(pending)} source(s) unchanged")
+
+    previous_outputs: Dict[str, Any] = previous.get("outputs", {})
+    manifest_outputs: Dict[str, Any] = {}
+    counts: Dict[str, int] = {}
+    for name, (parser, rel_paths) in outputs.items():
+        fingerprint = [[rel_path, sources[rel_path]["sha256"]] for rel_path in rel_paths]
+        path = OUTPUT_DIR / name
+        entry = previous_outputs.get(name)
+        if entry and entry["sources"] == fingerprint and path.exists():
+            manifest_outputs[name] = entry
+            counts[name] = entry["rows"]
+            continue
+
+        def rows() -> Iterator[Dict[str, Any]]:
+            for rel_path in rel_paths:
+                yield from read_jsonl(cache_path(parser, sources[rel_path]["sha256"]))
 
-    classifier_rows = build_classifier_examples()
-    sft_rows = build_template_examples()
-    embedding_rows = build_embedding_pairs()
+        # Always written, even with no sources, so the *_plus configs find the file.
+        counts[name] = write_jsonl(path, rows())
+        manifest_outputs[name] = {"sources": fingerprint, "rows": counts[name]}
+        print(f"Wrote {path}")
 
-    write_jsonl(OUTPUT_DIR / "custom_classifier.jsonl", classifier_rows)
-    write_jsonl(OUTPUT_DIR / "custom_sft.jsonl", sft_rows)
-    write_jsonl(OUTPUT_DIR / "custom_pairs.jsonl", embedding_rows)
+    save_manifest({"parser_version": PARSER_VERSION, "sources": sources, "outputs": manifest_outputs})
+    referenced = {cache_path(entry["parser"], entry["sha256"]) for entry in sources.values()}
+    for stale in CACHE_DIR.glob("*.jsonl"):
+        if stale not in referenced:
+            stale.unlink()
 
     print("Custom datasets prepared:")
-    print(f"- classifier rows: {len(classifier_rows)}")
-    print(f"- sft rows: {len(sft_rows)}")
-    print(f"- embedding pairs: {len(embedding_rows)}")
+    print(f"- classifier rows: {counts['custom_classifier.jsonl']}")
+    print(f"- sft rows: {counts['custom_sft.jsonl']}")
+    print(f"- embedding pairs: {counts['custom_pairs.jsonl']}")
+
+    if training_data is None:
+        print("pyarrow is not installed; skipped the columnar (Arrow) copies")
+        return
+    stale = [str(OUTPUT_DIR / name) for name in outputs if not training_data.is_current(str(OUTPUT_DIR / name))]
+    if stale:
+        training_data.export_columnar(stale)
+        print(f"Validated and wrote {len(stale)} Arrow file(s) to {OUTPUT_DIR / training_data.COLUMNAR_DIR}")
 
 
 if __name__ == "__main__":
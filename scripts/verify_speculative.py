@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Speculative Decoding Check
+Generates greedy answers for SFT validation prompts with plain decoding and
+with each speculative mode, and checks that the generated token ids are
+identical. Reports per-mode speedup, tokens per target forward pass and, for
+the draft model, the acceptance rate. Exits non-zero on any mismatch.
+
+The SFT prompts embed their retrieved context, so prompt_lookup sees the
+same kind of copyable spans as RAG answers in the service.
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import torch
+
+BASE_DIR = Path(__file__).parent.parent
+sys.path.insert(0, str(BASE_DIR / "services" / "local-ai"))
+
+import llm  # noqa: E402
+import training_data  # noqa: E402
+from model_ids import QWEN_DRAFT_MODEL_ID, QWEN_MODEL_ID  # noqa: E402
+
+SFT_VALID = BASE_DIR / "data" / "finetune" / "model1_sft.valid.jsonl"
+
+
+def load_prompts(tokenizer, path: Path, limit: int) -> List[str]:
+    prompts = []
+    for messages in training_data.load_table(str(path), "sft").column("messages").to_pylist():
+        messages = [message for message in messages if message["role"] != "assistant"]
+        prompts.append(tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True))
+        if len(prompts) >= limit:
+            break
+    return prompts
+
+
+def first_difference(expected: List[int], actual: List[int]) -> int:
+    for position, (a, b) in enumerate(zip(expected, actual)):
+        if a != b:
+            return position
+    return min(len(expected), len(actual))
+
+
+def generate_all(generate, tokenizer, prompts: List[str], device: str, max_new_tokens: int):
+    """New token ids per prompt and total seconds, after one warm-up call."""
+    outputs = []
+    with torch.inference_mode():
+        generate(tokenizer(prompts[0], return_tensors="pt").to(device), max_new_tokens)
+        started = time.perf_counter()
+        for prompt in prompts:
+            inputs = tokenizer(prompt, return_tensors="pt").to(device)
+            ids = generate(inputs, max_new_tokens)
+            outputs.append(ids[0, inputs["input_ids"].shape[1] :].tolist())
+    return outputs, time.perf_counter() - started
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Check speculative decoding against plain greedy decoding")
+    parser.add_argument("--model", default=QWEN_MODEL_ID, help="Target chat model")
+    parser.add_argument("--draft-model", default=QWEN_DRAFT_MODEL_ID, help="Draft model for mode 'draft'")
+    parser.add_argument("--modes", nargs="+", default=list(llm.SPECULATIVE_MODES), choices=llm.SPECULATIVE_MODES)
+    parser.add_argument("--num-tokens", type=int, help="Tokens proposed per step (default depends on the mode)")
+    parser.add_argument("--data", default=str(SFT_VALID), help="SFT JSONL to take prompts from")
+    parser.add_argument("--limit", type=int, default=20, help="Number of prompts")
+    parser.add_argument("--max-new-tokens", type=int, default=128)
+    parser.add_argument("--output", help="Write the report as JSON to this path")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    print(f"Loading {args.model} on {device}...")
+    tokenizer, model = llm.load_causal_lm(args.model, device)
+    prompts = load_prompts(tokenizer, Path(args.data), args.limit)
+    if not prompts:
+        print(f"No prompts in {args.data}")
+        return 1
+
+    def plain(inputs, max_new_tokens):
+        return model.generate(**inputs, max_new_tokens=max_new_tokens, do_sample=False)
+
+    print(f"Plain greedy decoding of {len(prompts)} prompts...")
+    expected, baseline_seconds = generate_all(plain, tokenizer, prompts, device, args.max_new_tokens)
+    report: Dict = {
+        "model": args.model,
+        "prompts": len(prompts),
+        "max_new_tokens": args.max_new_tokens,
+        "baseline_seconds": round(baseline_seconds, 2),
+        "modes": {},
+    }
+
+    failed = False
+    for mode in args.modes:
+        decoder = llm.load_speculative_decoder(tokenizer, model, mode, args.draft_model, device, args.num_tokens)
+        print(f"Speculative decoding ({mode}, {decoder.num_tokens} tokens per step)...")
+        actual, seconds = generate_all(decoder.generate, tokenizer, prompts, device, args.max_new_tokens)
+        mismatches = [
+            {"prompt": index, "first_difference": first_difference(e, a)}
+            for index, (e, a) in enumerate(zip(expected, actual))
+            if e != a
+        ]
+        failed = failed or bool(mismatches)
+        report["modes"][mode] = {
+            "identical": len(prompts) - len(mismatches),
+            "mismatches": mismatches,
+            "seconds": round(seconds, 2),
+            "speedup": round(baseline_seconds / seconds, 3) if seconds else None,
+            # Includes the warm-up call.
+            **decoder.stats(),
+        }
+        result = report["modes"][mode]
+        print(f"  identical outputs: {result['identical']}/{len(prompts)}")
+        print(f"  speedup: {result['speedup']}x ({seconds:.1f}s vs {baseline_seconds:.1f}s)")
+        print(f"  tokens per target step: {result['tokens_per_target_step']}")
+        if "acceptance_rate" in result:
+            print(f"  draft acceptance rate: {result['acceptance_rate']}")
+
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.output).write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"Report written to {args.output}")
+    if failed:
+        print("FAILED: speculative outputs differ from plain greedy decoding")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,197 @@
+"""Result caches for the service endpoints.
+
+``LRUCache`` is an in-process map (used alone for /retrieve). ``TieredCache``
+puts it in front of a persistent store, SQLite on local disk or a MongoDB
+collection, so /classify results survive restarts and can be shared between
+processes. Persistent keys include the model's content hash, and entries of
+other checkpoints are purged when a store opens. Swapping the checkpoint
+(``DISTILBERT_MODEL_ID``) therefore invalidates the cache on its own.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Hashable, Optional
+
+
+def normalize_text(text: str) -> str:
+    """Cache-key form of a request text: case and whitespace do not change the models' output."""
+    return " ".join(text.lower().split())
+
+
+class LRUCache:
+    """Thread-safe least-recently-used map with hit/miss counters; capacity 0 disables it."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._items: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.capacity:
+                self._items.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._items),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+def result_key(model_hash: str, text: str, lowercase: bool) -> str:
+    """Key of a model's result for a text: same model content and same normalized input, same key."""
+    normalized = normalize_text(text) if lowercase else " ".join(text.split())
+    return hashlib.sha256(f"{model_hash}\x1f{normalized}".encode("utf-8")).hexdigest()
+
+
+class SQLiteResultStore:
+    """Persistent results in a local SQLite file, shared by the worker processes on one host."""
+
+    def __init__(self, path: str, model_hash: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, model TEXT NOT NULL, value TEXT NOT NULL)"
+            )
+            # Entries of other checkpoints can never be hit again.
+            self._conn.execute("DELETE FROM results WHERE model != ?", (model_hash,))
+        self.model_hash = model_hash
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key: str, value: Any) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, model, value) VALUES (?, ?, ?)",
+                (key, self.model_hash, json.dumps(value)),
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class MongoResultStore:
+    """Persistent results in a MongoDB collection, shared by every replica of the service."""
+
+    def __init__(self, collection, model_hash: str):
+        from pymongo.errors import PyMongoError
+
+        self.collection = collection
+        self.model_hash = model_hash
+        try:
+            self.collection.delete_many({"model": {"$ne": model_hash}})
+        except PyMongoError as exc:
+            print(f"Could not purge stale cached results: {exc}")
+
+    def get(self, key: str) -> Optional[Any]:
+        document = self.collection.find_one({"_id": key}, {"value": 1})
+        return document["value"] if document else None
+
+    def put(self, key: str, value: Any) -> None:
+        self.collection.replace_one({"_id": key}, {"model": self.model_hash, "value": value}, upsert=True)
+
+    def close(self) -> None:
+        pass
+
+
+class TieredCache:
+    """In-process LRU in front of an optional persistent store.
+
+    Reads fall through LRU -> store; store hits are promoted into the LRU.
+    Writes to the store happen on a background thread so a miss never waits
+    on it, and store errors only count as misses.
+    """
+
+    def __init__(self, lru: LRUCache, store=None):
+        self.lru = lru
+        self.store = store
+        self.store_hits = 0
+        self.store_errors = 0
+        self._lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="result-cache") if store else None
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self.lru.get(key)
+        if value is not None or self.store is None:
+            return value
+        try:
+            value = self.store.get(key)
+        except Exception as exc:  # sqlite3.Error or PyMongoError; the model can still answer
+            self._count("store_errors")
+            print(f"Result cache read failed: {exc}")
+            return None
+        if value is not None:
+            self._count("store_hits")
+            self.lru.put(key, value)
+        return value
+
+    def put(self, key: str, value: Any) -> None:
+        self.lru.put(key, value)
+        if self._writer is not None:
+            self._writer.submit(self._store_put, key, value)
+
+    def _store_put(self, key: str, value: Any) -> None:
+        try:
+            self.store.put(key, value)
+        except Exception as exc:
+            self._count("store_errors")
+            print(f"Result cache write failed: {exc}")
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.shutdown(wait=True)
+            self.store.close()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.lru.stats()
+        lookups = stats["hits"] + stats["misses"]
+        stats.update(
+            backend=type(self.store).__name__ if self.store else None,
+            store_hits=self.store_hits,
+            store_errors=self.store_errors,
+            # Share of lookups answered without running the model, from either tier.
+            overall_hit_ratio=round((stats["hits"] + self.store_hits) / lookups, 4) if lookups else None,
+        )
+        return stats
@@ -0,0 +1,231 @@
+"""Confidence-based classification cascade for /classify.
+
+Stage 1 is a linear softmax head over the MiniLM sentence embeddings the
+service already computes; it answers when its top probability reaches the
+threshold calibrated on the validation split (train/train_cascade_head.py).
+Everything else falls through to DistilBERT, and, when enabled, DistilBERT
+answers below ``llm_threshold`` are escalated to the chat LLM.
+
+The head is a .npz with the weights, the label order, the calibrated
+threshold and the content hash of the embedding model it was trained on, so
+a head never runs on embeddings from a different MiniLM checkpoint.
+"""
+
+import os
+import re
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+HEAD_FILE = "linear_head.npz"
+STAGES = ("linear", "distilbert", "llm")
+
+
+def softmax(logits: np.ndarray) -> np.ndarray:
+    shifted = logits - logits.max(axis=-1, keepdims=True)
+    exp = np.exp(shifted)
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+class LinearHead:
+    def __init__(
+        self, weights: np.ndarray, bias: np.ndarray, labels: Sequence[str], threshold: float, embedder_hash: str
+    ):
+        self.weights = weights.astype(np.float32)
+        self.bias = bias.astype(np.float32)
+        self.labels = list(labels)
+        self.threshold = float(threshold)
+        self.embedder_hash = embedder_hash
+
+    def predict_proba(self, embeddings: np.ndarray) -> np.ndarray:
+        return softmax(np.asarray(embeddings, dtype=np.float32) @ self.weights + self.bias)
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = f"{path}.tmp-{os.getpid()}.npz"
+        np.savez(
+            tmp,
+            weights=self.weights,
+            bias=self.bias,
+            labels=np.array(self.labels),
+            threshold=np.float64(self.threshold),
+            embedder_hash=np.array(self.embedder_hash),
+        )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "LinearHead":
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                data["weights"],
+                data["bias"],
+                [str(label) for label in data["labels"]],
+                float(data["threshold"]),
+                str(data["embedder_hash"]),
+            )
+
+
+def fit_linear_head(
+    embeddings: np.ndarray,
+    targets: np.ndarray,
+    num_labels: int,
+    epochs: int = 300,
+    learning_rate: float = 0.05,
+    l2: float = 1e-4,
+    seed: int = 42,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Multinomial logistic regression by full-batch Adam; returns (weights [dim, labels], bias)."""
+    rng = np.random.default_rng(seed)
+    x = np.asarray(embeddings, dtype=np.float64)
+    onehot = np.eye(num_labels)[targets]
+    weights = rng.normal(0.0, 0.01, size=(x.shape[1], num_labels))
+    bias = np.zeros(num_labels)
+    params = [weights, bias]
+    moments = [np.zeros_like(p) for p in params]
+    velocities = [np.zeros_like(p) for p in params]
+    beta1, beta2, eps = 0.9, 0.999, 1e-8
+    for step in range(1, epochs + 1):
+        error = (softmax(x @ weights + bias) - onehot) / len(x)
+        grads = [x.T @ error + l2 * weights, error.sum(axis=0)]
+        for param, grad, m, v in zip(params, grads, moments, velocities):
+            m *= beta1
+            m += (1 - beta1) * grad
+            v *= beta2
+            v += (1 - beta2) * grad ** 2
+            param -= learning_rate * (m / (1 - beta1 ** step)) / (np.sqrt(v / (1 - beta2 ** step)) + eps)
+    return weights, bias
+
+
+def calibrate_threshold(confidences: np.ndarray, correct: np.ndarray, target_accuracy: float) -> float:
+    """Lowest confidence at which the items answered (confidence >= threshold) still reach ``target_accuracy``.
+
+    Returns inf when no prefix of the most confident items is accurate enough,
+    i.e. stage 1 never answers.
+    """
+    order = np.argsort(-confidences, kind="stable")
+    accuracy = np.cumsum(correct[order]) / np.arange(1, len(order) + 1)
+    passing = np.nonzero(accuracy >= target_accuracy)[0]
+    if not len(passing):
+        return float("inf")
+    return float(confidences[order][passing[-1]])
+
+
+def simulate(head_probs: np.ndarray, bert_probs: np.ndarray, gold: np.ndarray, threshold: float) -> Dict[str, float]:
+    """Offline linear -> DistilBERT cascade on precomputed probabilities (same label order)."""
+    answered = head_probs.max(axis=-1) >= threshold
+    predictions = np.where(answered, head_probs.argmax(axis=-1), bert_probs.argmax(axis=-1))
+    total = len(gold)
+    return {
+        "threshold": threshold,
+        "linear_answered": int(answered.sum()),
+        "escalation_rate": round(1 - float(answered.mean()), 4) if total else None,
+        "linear_accuracy_on_answered": round(float((predictions[answered] == gold[answered]).mean()), 4)
+        if answered.any()
+        else None,
+        "accuracy": round(float((predictions == gold).mean()), 4) if total else None,
+        "linear_only_accuracy": round(float((head_probs.argmax(axis=-1) == gold).mean()), 4) if total else None,
+        "distilbert_only_accuracy": round(float((bert_probs.argmax(axis=-1) == gold).mean()), 4) if total else None,
+    }
+
+
+def parse_llm_label(text: str, labels: Sequence[str]) -> Optional[str]:
+    """Label named earliest in an LLM reply ('Not eligible' is not_eligible, not eligible)."""
+    lowered = re.sub(r"[-_]", " ", text.lower())
+    found = []
+    for label in labels:
+        match = re.search(rf"\b{label.replace('_', ' ')}\b", lowered)
+        if match:
+            found.append((match.start(), -len(label), label))
+    return min(found)[2] if found else None
+
+
+def llm_labeler(generate: Callable[[str, str], str], labels: Sequence[str]) -> Callable[[str], Optional[str]]:
+    """LLM stage over ``generate(system, user)``, which must return only the model's reply."""
+    system = (
+        "You classify credit report tradelines for dispute eligibility. "
+        f"Reply with exactly one label: {', '.join(labels)}."
+    )
+
+    def label(text: str) -> Optional[str]:
+        return parse_llm_label(generate(system, text), labels)
+
+    return label
+
+
+class ClassificationCascade:
+    """Runs the stages in order and counts, per stage, how often it was reached and escalated."""
+
+    def __init__(
+        self,
+        head: LinearHead,
+        embed: Callable[[List[str]], np.ndarray],
+        classify: Callable[[str], Tuple[List[str], np.ndarray]],
+        threshold: Optional[float] = None,
+        llm: Optional[Callable[[str], Optional[str]]] = None,
+        llm_threshold: float = 0.0,
+        linear: bool = True,
+    ):
+        self.head = head
+        # False skips stage 1 (and its embedding) entirely, e.g. for a head that never answers.
+        self.linear = linear
+        self.embed = embed
+        self.classify_fn = classify
+        self.threshold = head.threshold if threshold is None else threshold
+        self.llm = llm
+        self.llm_threshold = llm_threshold
+        self._lock = threading.Lock()
+        self._reached = {stage: 0 for stage in STAGES}
+        self._answered = {stage: 0 for stage in STAGES}
+
+    def classify(self, text: str) -> Tuple[str, float, str]:
+        """(label, confidence, stage that answered)."""
+        if self.linear:
+            probs = self.head.predict_proba(self.embed([text]))[0]
+            best = int(probs.argmax())
+            if probs[best] >= self.threshold:
+                self._count("linear", answered=True)
+                return self.head.labels[best], float(probs[best]), "linear"
+            self._count("linear", answered=False)
+
+        names, bert_probs = self.classify_fn(text)
+        best = int(bert_probs.argmax())
+        label, confidence = names[best], float(bert_probs[best])
+        if self.llm is None or confidence >= self.llm_threshold:
+            self._count("distilbert", answered=True)
+            return label, confidence, "distilbert"
+        self._count("distilbert", answered=False)
+
+        llm_label = self.llm(text)
+        self._count("llm", answered=llm_label in names)
+        if llm_label not in names:
+            # Unparseable reply: keep the DistilBERT answer.
+            return label, confidence, "distilbert"
+        # The LLM gives no calibrated score; report DistilBERT's probability for its label.
+        return llm_label, float(bert_probs[names.index(llm_label)]), "llm"
+
+    def _count(self, stage: str, answered: bool) -> None:
+        with self._lock:
+            self._reached[stage] += 1
+            if answered:
+                self._answered[stage] += 1
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            reached = dict(self._reached)
+            answered = dict(self._answered)
+        requests = reached["linear"] if self.linear else reached["distilbert"]
+        stages = {}
+        for stage in STAGES:
+            stages[stage] = {
+                "reached": reached[stage],
+                "answered": answered[stage],
+                "escalation_rate": round(1 - answered[stage] / reached[stage], 4) if reached[stage] else None,
+                "answered_share": round(answered[stage] / requests, 4) if requests else None,
+            }
+        return {
+            "requests": requests,
+            "threshold": self.threshold if self.linear else None,
+            "llm_threshold": self.llm_threshold if self.llm is not None else None,
+            "stages": stages,
+        }
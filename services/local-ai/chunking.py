@@ -0,0 +1,182 @@
+"""Token-aware text chunking shared by RAG ingestion and the local AI service.
+
+Chunks are measured in real tokenizer tokens (MiniLM wordpieces by default) and
+never exceed what the embedder can see, so every stored token influences its
+vector. Splits prefer markdown heading, paragraph and sentence boundaries and
+only fall back to word windows for single sentences that are too long.
+"""
+
+import re
+from typing import Callable, List, Optional, Sequence, Tuple
+
+DEFAULT_TOKENIZER_ID = "sentence-transformers/all-MiniLM-L6-v2"
+DEFAULT_MAX_SEQ_LENGTH = 256
+
+TokenCounter = Callable[[Sequence[str]], List[int]]
+
+HEADING_RE = re.compile(r"^\s{0,3}#{1,6}\s+\S")
+SENTENCE_RE = re.compile(r"(?<=[.!?])[\"')\]]*\s+(?=[\"'(\[]?[A-Z0-9])")
+
+
+def load_tokenizer(model_id: str = DEFAULT_TOKENIZER_ID):
+    from transformers import AutoTokenizer
+
+    return AutoTokenizer.from_pretrained(model_id)
+
+
+def make_token_counter(tokenizer) -> TokenCounter:
+    """Return a batched counter of content tokens (special tokens excluded)."""
+
+    def count(texts: Sequence[str]) -> List[int]:
+        if not texts:
+            return []
+        encoded = tokenizer(list(texts), add_special_tokens=False)["input_ids"]
+        return [len(ids) for ids in encoded]
+
+    return count
+
+
+def max_chunk_tokens(tokenizer, max_seq_length: Optional[int] = None) -> int:
+    """Largest chunk (in content tokens) the embedder encodes without truncation."""
+    limit = max_seq_length or getattr(tokenizer, "model_max_length", None) or DEFAULT_MAX_SEQ_LENGTH
+    # Tokenizers without a configured limit report a huge sentinel value.
+    if limit > 100_000:
+        limit = DEFAULT_MAX_SEQ_LENGTH
+    specials = tokenizer.num_special_tokens_to_add(pair=False)
+    return max(int(limit) - specials, 1)
+
+
+def split_sentences(text: str) -> List[str]:
+    return [part.strip() for part in SENTENCE_RE.split(text) if part.strip()]
+
+
+def split_sections(text: str) -> List[List[str]]:
+    """Split text into heading-delimited sections, each a list of paragraphs."""
+    sections: List[List[str]] = [[]]
+    for block in re.split(r"\n\s*\n", text):
+        block = block.strip()
+        if not block:
+            continue
+        lines = block.splitlines()
+        if HEADING_RE.match(lines[0]):
+            sections.append([])
+            # A heading glued to its first paragraph still opens a new section.
+            sections[-1].append(lines[0].strip())
+            rest = "\n".join(lines[1:]).strip()
+            if rest:
+                sections[-1].append(rest)
+            continue
+        sections[-1].append(block)
+
+    merged: List[List[str]] = []
+    pending: List[str] = []
+    for section in sections:
+        if not section:
+            continue
+        if len(section) == 1 and HEADING_RE.match(section[0]):
+            # Keep a heading with no body of its own ("# Part" directly followed
+            # by "## Chapter") attached to the next section instead of emitting it alone.
+            pending.append(section[0])
+            continue
+        if pending:
+            section = ["\n".join(pending + [section[0]])] + section[1:]
+            pending = []
+        merged.append(section)
+    if pending:
+        merged.append(["\n".join(pending)])
+    return merged
+
+
+def split_words(text: str, count_tokens: TokenCounter, max_tokens: int) -> List[Tuple[str, int]]:
+    """Hard-split an oversized sentence into word windows that fit ``max_tokens``."""
+    words = text.split()
+    pieces: List[Tuple[str, int]] = []
+    current: List[str] = []
+    current_tokens = 0
+    for word, size in zip(words, count_tokens(words)):
+        if current and current_tokens + size > max_tokens:
+            pieces.append((" ".join(current), current_tokens))
+            current, current_tokens = [], 0
+        if size > max_tokens:
+            # A single pathological "word" (e.g. a long URL) is kept whole; the
+            # embedder truncates it, which is still better than dropping it.
+            pieces.append((word, size))
+            continue
+        current.append(word)
+        current_tokens += size
+    if current:
+        pieces.append((" ".join(current), current_tokens))
+    return pieces
+
+
+def section_units(section: List[str], count_tokens: TokenCounter, max_tokens: int) -> List[Tuple[str, int, bool]]:
+    """Break a section into (text, tokens, starts_paragraph) units that each fit."""
+    units: List[Tuple[str, int, bool]] = []
+    for paragraph, size in zip(section, count_tokens(section)):
+        if size <= max_tokens:
+            units.append((paragraph, size, True))
+            continue
+        sentences = split_sentences(paragraph)
+        first = True
+        for sentence, sentence_size in zip(sentences, count_tokens(sentences)):
+            if sentence_size <= max_tokens:
+                units.append((sentence, sentence_size, first))
+            else:
+                for piece, piece_size in split_words(sentence, count_tokens, max_tokens):
+                    units.append((piece, piece_size, first))
+                    first = False
+            first = False
+    return units
+
+
+def join_units(units: List[Tuple[str, int, bool]]) -> str:
+    parts: List[str] = []
+    for idx, (text, _, starts_paragraph) in enumerate(units):
+        if idx and starts_paragraph:
+            parts.append("\n\n")
+        elif idx:
+            parts.append(" ")
+        parts.append(text)
+    return "".join(parts)
+
+
+def chunk_text(
+    text: str,
+    count_tokens: TokenCounter,
+    max_tokens: int,
+    overlap_tokens: int = 0,
+) -> List[str]:
+    """Pack text into chunks of at most ``max_tokens`` tokenizer tokens.
+
+    Headings always start a new chunk. Within a section, paragraphs and
+    sentences are packed greedily; up to ``overlap_tokens`` of trailing
+    sentences are repeated at the start of the next chunk of the same section.
+    """
+    max_tokens = max(int(max_tokens), 1)
+    overlap_tokens = max(min(int(overlap_tokens), max_tokens // 2), 0)
+    chunks: List[str] = []
+
+    for section in split_sections(text):
+        units = section_units(section, count_tokens, max_tokens)
+        current: List[Tuple[str, int, bool]] = []
+        current_tokens = 0
+        fresh = 0
+        for unit in units:
+            size = unit[1]
+            if fresh and current_tokens + size > max_tokens:
+                chunks.append(join_units(current))
+                carried: List[Tuple[str, int, bool]] = []
+                carried_tokens = 0
+                for previous in reversed(current):
+                    if carried_tokens + previous[1] > overlap_tokens or carried_tokens + previous[1] + size > max_tokens:
+                        break
+                    carried.insert(0, previous)
+                    carried_tokens += previous[1]
+                current, current_tokens, fresh = carried, carried_tokens, 0
+            current.append(unit)
+            current_tokens += size
+            fresh += 1
+        if fresh:
+            chunks.append(join_units(current))
+
+    return chunks
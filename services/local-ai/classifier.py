@@ -0,0 +1,61 @@
+"""Dispute-eligibility classifier: label set, id -> label mapping and batched inference.
+
+Shared by the service's /classify endpoint and scripts/classify_bulk.py so both
+produce the same labels and confidences for the same checkpoint.
+"""
+
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+import torch
+from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+LABELS = {
+    "eligible": "Clear factual inaccuracy with evidence or strong basis for dispute",
+    "conditionally_eligible": "Possible inaccuracy but requires verification or additional evidence",
+    "not_eligible": "Information appears accurate or does not meet dispute criteria",
+    "insufficient_information": "Not enough information to determine dispute eligibility",
+}
+
+
+def load_classifier(model_id: str, device: str):
+    tokenizer = AutoTokenizer.from_pretrained(model_id)
+    model = AutoModelForSequenceClassification.from_pretrained(model_id).to(device)
+    model.eval()
+    return tokenizer, model
+
+
+def label_names(config) -> List[str]:
+    """Label for each output index, normalised to the LABELS keys where possible."""
+    id2label = config.id2label or {idx: label for idx, label in enumerate(LABELS.keys())}
+    names = []
+    for idx in range(config.num_labels):
+        label_key = id2label.get(idx, str(idx))
+        names.append(label_key if label_key in LABELS else label_key.lower())
+    return names
+
+
+def predict_logits(tokenizer, model, texts: Sequence[str], device: str, max_length: int = 512) -> torch.Tensor:
+    """Raw logits [len(texts), num_labels]; pads only to the longest text."""
+    encoded = tokenizer(
+        list(texts), padding=True, truncation=True, max_length=max_length, return_tensors="pt"
+    ).to(device)
+    with torch.inference_mode():
+        return model(**encoded).logits.float()
+
+
+def predict_proba(tokenizer, model, texts: Sequence[str], device: str, max_length: int = 512) -> np.ndarray:
+    """Softmax probabilities [len(texts), num_labels]."""
+    logits = predict_logits(tokenizer, model, texts, device, max_length)
+    return torch.nn.functional.softmax(logits, dim=-1).cpu().numpy()
+
+
+def predict(tokenizer, model, texts: Sequence[str], device: str, max_length: int = 512) -> List[Tuple[str, float]]:
+    names = label_names(model.config)
+    probs = predict_proba(tokenizer, model, texts, device, max_length)
+    best = probs.argmax(axis=-1)
+    return [(names[int(idx)], float(row[idx])) for row, idx in zip(probs, best)]
+
+
+def probabilities(names: List[str], row: np.ndarray) -> Dict[str, float]:
+    return {name: round(float(value), 6) for name, value in zip(names, row)}
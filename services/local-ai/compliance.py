@@ -0,0 +1,182 @@
+"""Compliance phrase scanning shared by model evaluation and the /chat output guard.
+
+Small phrase lists are checked with one ``in`` per phrase, stopping early where
+the verdict allows. From ``AUTOMATON_MIN_PHRASES`` forbidden phrases and
+disclaimers on, all lists are compiled into one Aho-Corasick automaton, so a
+response is scanned in a single pass regardless of how many phrases we track;
+below that the per-character automaton walk costs more than it saves (see
+scripts/benchmark_compliance.py). Without pyahocorasick the lists are compiled
+into one alternation regex instead, which also scans the text once. Matching is case-insensitive substring
+matching either way, identical to the original per-phrase ``in`` checks in
+scripts/evaluate_models.py.
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Set, Tuple
+
+try:
+    import ahocorasick
+except ImportError:  # pragma: no cover - optional C extension
+    ahocorasick = None
+
+# Forbidden phrases for hallucination detection
+FORBIDDEN_PHRASES = [
+    "I am not a lawyer",
+    "consult a lawyer",
+    "100% guarantee",
+    "delete all negative items",
+    "remove all debts",
+    "erase your credit history",
+    "quick fix",
+    "overnight results",
+    "guaranteed approval",
+    "credit repair loophole",
+    "secret method",
+]
+
+# Compliance requirements
+REQUIRED_DISCLAIMERS = [
+    "results may vary",
+    "educational purposes",
+    "not financial advice",
+    "consult with a professional",
+]
+
+GUARANTEE_MARKER = "100%"
+GUARANTEE_WORDS = ["guarantee", "remove", "delete", "approved"]
+LEGAL_ACTION_WORDS = ["sue", "lawsuit", "legal action"]
+LEGAL_REFERRAL_WORDS = ["lawyer", "attorney", "legal professional"]
+
+# Forbidden phrases + required disclaimers from which the automaton beats per-phrase checks.
+AUTOMATON_MIN_PHRASES = 32
+
+REFUSAL_MESSAGE = "This request falls outside the permitted and compliant scope of Credit AI."
+
+
+class PhraseMatcher:
+    """Finds which of a fixed set of lowercase phrases occur in a text."""
+
+    def __init__(self, phrases: Iterable[str]):
+        self.phrases = sorted({phrase.lower() for phrase in phrases})
+        self.automaton = None
+        self.pattern = None
+        if ahocorasick is not None and self.phrases:
+            automaton = ahocorasick.Automaton()
+            for phrase in self.phrases:
+                automaton.add_word(phrase, phrase)
+            automaton.make_automaton()
+            self.automaton = automaton
+        elif self.phrases:
+            # A lookahead at each position reports the longest phrase starting there (alternatives
+            # are tried longest first); the shorter phrases inside it come from ``contained``.
+            longest_first = sorted(self.phrases, key=len, reverse=True)
+            self.pattern = re.compile("(?=(" + "|".join(re.escape(phrase) for phrase in longest_first) + "))")
+            self.contained = {phrase: {other for other in self.phrases if other in phrase} for phrase in self.phrases}
+
+    def find(self, text_lower: str) -> Set[str]:
+        if self.automaton is not None:
+            return {phrase for _, phrase in self.automaton.iter(text_lower)}
+        if self.pattern is None:
+            return set()
+        longest = {match.group(1) for match in self.pattern.finditer(text_lower)}
+        return set().union(*(self.contained[phrase] for phrase in longest))
+
+
+@dataclass
+class ComplianceResult:
+    compliant: bool
+    violations: List[str] = field(default_factory=list)
+    disclaimers: List[str] = field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, object]:
+        return {"compliant": self.compliant, "violations": self.violations, "disclaimers": self.disclaimers}
+
+
+class ComplianceScanner:
+    def __init__(
+        self,
+        forbidden_phrases: List[str] = FORBIDDEN_PHRASES,
+        required_disclaimers: List[str] = REQUIRED_DISCLAIMERS,
+        automaton_min_phrases: int = AUTOMATON_MIN_PHRASES,
+    ):
+        self.forbidden_phrases = list(forbidden_phrases)
+        self.required_disclaimers = list(required_disclaimers)
+        self.forbidden_lower = [(phrase, phrase.lower()) for phrase in self.forbidden_phrases]
+        self.disclaimers_lower = [(phrase, phrase.lower()) for phrase in self.required_disclaimers]
+        # Lowercased phrase -> (list position, original phrase), so an automaton scan
+        # only touches the phrases it found while keeping the original report order.
+        self.forbidden_index: Dict[str, List[Tuple[int, str]]] = {}
+        for idx, phrase in enumerate(self.forbidden_phrases):
+            self.forbidden_index.setdefault(phrase.lower(), []).append((idx, phrase))
+        self.disclaimer_index: Dict[str, List[Tuple[int, str]]] = {}
+        for idx, phrase in enumerate(self.required_disclaimers):
+            self.disclaimer_index.setdefault(phrase.lower(), []).append((idx, phrase))
+        self.matcher = None
+        if len(self.forbidden_phrases) + len(self.required_disclaimers) >= automaton_min_phrases:
+            self.matcher = PhraseMatcher(
+                self.forbidden_phrases
+                + self.required_disclaimers
+                + GUARANTEE_WORDS
+                + LEGAL_ACTION_WORDS
+                + LEGAL_REFERRAL_WORDS
+                + [GUARANTEE_MARKER]
+            )
+
+    def scan(self, text: str) -> ComplianceResult:
+        text_lower = text.lower()
+        if self.matcher is None:
+            violations = self._substring_violations(text_lower)
+            disclaimers = [phrase for phrase, lowered in self.disclaimers_lower if lowered in text_lower]
+            return ComplianceResult(compliant=not violations, violations=violations, disclaimers=disclaimers)
+
+        found = self.matcher.find(text_lower)
+        violations = [
+            f"Forbidden phrase: '{phrase}'"
+            for _, phrase in sorted(hit for match in found for hit in self.forbidden_index.get(match, ()))
+        ]
+
+        # Check for specific problematic patterns
+        if GUARANTEE_MARKER in found and any(word in found for word in GUARANTEE_WORDS):
+            violations.append("Unrealistic guarantee detected")
+
+        # Check for medical/legal advice without disclaimer
+        if any(word in found for word in LEGAL_ACTION_WORDS) and not any(
+            word in found for word in LEGAL_REFERRAL_WORDS
+        ):
+            violations.append("Legal advice without proper disclaimer")
+
+        disclaimers = [
+            phrase for _, phrase in sorted(hit for match in found for hit in self.disclaimer_index.get(match, ()))
+        ]
+        return ComplianceResult(compliant=not violations, violations=violations, disclaimers=disclaimers)
+
+    def violations(self, text: str) -> List[str]:
+        """Violations only; skips the disclaimer lookups on the substring path."""
+        if self.matcher is None:
+            return self._substring_violations(text.lower())
+        return self.scan(text).violations
+
+    def _substring_violations(self, text_lower: str) -> List[str]:
+        violations = [f"Forbidden phrase: '{phrase}'" for phrase, lowered in self.forbidden_lower if lowered in text_lower]
+        if GUARANTEE_MARKER in text_lower and any(word in text_lower for word in GUARANTEE_WORDS):
+            violations.append("Unrealistic guarantee detected")
+        if any(word in text_lower for word in LEGAL_ACTION_WORDS) and not any(
+            word in text_lower for word in LEGAL_REFERRAL_WORDS
+        ):
+            violations.append("Legal advice without proper disclaimer")
+        return violations
+
+
+DEFAULT_SCANNER = ComplianceScanner()
+
+
+def check_hallucination(text: str) -> Tuple[bool, List[str]]:
+    """
+    Check if text contains forbidden phrases indicating hallucination or non-compliance.
+
+    Returns:
+        (is_compliant, violations)
+    """
+    violations = DEFAULT_SCANNER.violations(text)
+    return not violations, violations
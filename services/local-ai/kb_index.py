@@ -0,0 +1,245 @@
+"""Knowledge-base corpus loading and the precomputed embedding index artifact.
+
+Ingestion (scripts/ingest_rag.py --embed) chunks the knowledge base, embeds only
+chunks it has not embedded before, and publishes a versioned index directory:
+
+    <index_root>/
+        CURRENT                   name of the live version (swapped atomically)
+        v<timestamp>-<checksum>/
+            manifest.json         model id and content hash, dims, token stats, sizes, checksums
+            chunks.jsonl          one {"text", "source", "tokens", "hash"} per row
+            embeddings.npy        float32 [count, dim], L2-normalised, mmap-able
+
+The service loads the CURRENT version with np.load(mmap_mode="r") instead of
+re-encoding the corpus at startup. An index belongs to the embedder whose
+content hash (model_ids.model_content_hash) it records, not to a model id: the
+same checkpoint may be named by a hub id or a local path, and a retrained
+checkpoint keeps its path but not its vectors.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import chunking
+from model_ids import model_content_hash
+
+# 2: indexes are identified by the embedder's content hash.
+INDEX_FORMAT_VERSION = 2
+CURRENT_POINTER = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+CHUNKS_FILE = "chunks.jsonl"
+EMBEDDINGS_FILE = "embeddings.npy"
+# off: trust the files; size: compare byte sizes with the manifest (cheap, catches
+# truncated copies); full: re-hash both files against the manifest checksums.
+VERIFY_MODES = ("off", "size", "full")
+
+
+def strip_front_matter(content: str) -> str:
+    if not content.startswith("---"):
+        return content
+    end = content.find("\n---", 3)
+    if end == -1:
+        return content
+    return content[end + 4 :].lstrip()
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def collect_chunks(
+    knowledge_dirs: List[str],
+    count_tokens: chunking.TokenCounter,
+    max_tokens: int,
+    overlap_tokens: int,
+) -> List[Dict[str, object]]:
+    """Chunk every markdown file under the knowledge directories."""
+    chunks: List[Dict[str, object]] = []
+    for base_dir in knowledge_dirs:
+        if not os.path.isdir(base_dir):
+            continue
+        for root, dirs, files in os.walk(base_dir):
+            # Walk in a stable order so chunk rows (and the index checksum) are reproducible.
+            dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+            for name in sorted(files):
+                if not name.endswith(".md"):
+                    continue
+                path = os.path.join(root, name)
+                with open(path, "r", encoding="utf-8") as f:
+                    content = strip_front_matter(f.read())
+                source = os.path.relpath(path, base_dir)
+                texts = chunking.chunk_text(content, count_tokens, max_tokens=max_tokens, overlap_tokens=overlap_tokens)
+                for text, tokens in zip(texts, count_tokens(texts)):
+                    chunks.append({"text": text, "source": source, "tokens": tokens, "hash": content_hash(text)})
+    return chunks
+
+
+def current_version_dir(index_root: str) -> Optional[str]:
+    pointer = os.path.join(index_root, CURRENT_POINTER)
+    if not os.path.exists(pointer):
+        return None
+    with open(pointer, "r", encoding="utf-8") as f:
+        version = f.read().strip()
+    path = os.path.join(index_root, version)
+    return path if version and os.path.isdir(path) else None
+
+
+def read_manifest(version_dir: str) -> dict:
+    with open(os.path.join(version_dir, MANIFEST_FILE), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_index(
+    index_root: str,
+    model_hash: str,
+    verify: str = "size",
+) -> Optional[Tuple[List[Dict[str, object]], np.ndarray, dict]]:
+    """Load the live index if it was built with the embedder hashing to ``model_hash``; None otherwise.
+
+    Embeddings are memory-mapped, so several workers on one host share pages.
+    ``verify`` is one of VERIFY_MODES.
+    """
+    if verify not in VERIFY_MODES:
+        raise ValueError(f"verify must be one of {VERIFY_MODES}, got {verify!r}")
+    version_dir = current_version_dir(index_root)
+    if version_dir is None:
+        return None
+    manifest = read_manifest(version_dir)
+    if manifest.get("format_version") != INDEX_FORMAT_VERSION or manifest.get("model_hash") != model_hash:
+        print(f"Knowledge index {version_dir} was built with another embedder ({manifest.get('model_id')}); not using it")
+        return None
+
+    chunks_path = os.path.join(version_dir, CHUNKS_FILE)
+    embeddings_path = os.path.join(version_dir, EMBEDDINGS_FILE)
+    if verify == "size":
+        sizes = manifest.get("sizes", {})
+        for name, path in ((CHUNKS_FILE, chunks_path), (EMBEDDINGS_FILE, embeddings_path)):
+            if name in sizes and os.path.getsize(path) != sizes[name]:
+                raise ValueError(f"Size mismatch for {path}: {os.path.getsize(path)} bytes, manifest says {sizes[name]}")
+    elif verify == "full":
+        checksums = manifest.get("checksums", {})
+        if file_sha256(chunks_path) != checksums.get(CHUNKS_FILE):
+            raise ValueError(f"Checksum mismatch for {chunks_path}")
+        if file_sha256(embeddings_path) != checksums.get(EMBEDDINGS_FILE):
+            raise ValueError(f"Checksum mismatch for {embeddings_path}")
+
+    with open(chunks_path, "r", encoding="utf-8") as f:
+        chunks = [json.loads(line) for line in f if line.strip()]
+    embeddings = np.load(embeddings_path, mmap_mode="r")
+    if embeddings.shape[0] != len(chunks):
+        raise ValueError(f"Index {version_dir} has {embeddings.shape[0]} vectors for {len(chunks)} chunks")
+    return chunks, embeddings, manifest
+
+
+def cached_embeddings(index_root: str, model_hash: str) -> Dict[str, np.ndarray]:
+    """Map chunk content hash -> vector from the live index, for incremental rebuilds."""
+    try:
+        loaded = load_index(index_root, model_hash, verify="off")
+    except (OSError, ValueError):
+        return {}
+    if loaded is None:
+        return {}
+    chunks, embeddings, _ = loaded
+    return {str(chunk["hash"]): embeddings[idx] for idx, chunk in enumerate(chunks)}
+
+
+def token_stats(token_counts: List[int], max_tokens: int) -> dict:
+    if not token_counts:
+        return {"chunks": 0, "total": 0, "mean": 0.0, "p95": 0, "max": 0, "over_limit": 0}
+    counts = np.asarray(token_counts)
+    return {
+        "chunks": int(counts.size),
+        "total": int(counts.sum()),
+        "mean": round(float(counts.mean()), 2),
+        "p95": int(np.percentile(counts, 95)),
+        "max": int(counts.max()),
+        "over_limit": int((counts > max_tokens).sum()),
+    }
+
+
+def publish_index(
+    index_root: str,
+    chunks: List[Dict[str, object]],
+    embeddings: np.ndarray,
+    model_id: str,
+    chunking_params: dict,
+    keep_versions: int = 3,
+    model_hash: Optional[str] = None,
+) -> str:
+    """Write a new index version and atomically point CURRENT at it.
+
+    ``model_hash`` defaults to the content hash of ``model_id``.
+    """
+    os.makedirs(index_root, exist_ok=True)
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    staging = tempfile.mkdtemp(prefix=".staging-", dir=index_root)
+    try:
+        chunks_path = os.path.join(staging, CHUNKS_FILE)
+        with open(chunks_path, "w", encoding="utf-8") as f:
+            for chunk in chunks:
+                f.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+        embeddings_path = os.path.join(staging, EMBEDDINGS_FILE)
+        np.save(embeddings_path, embeddings)
+
+        checksums = {CHUNKS_FILE: file_sha256(chunks_path), EMBEDDINGS_FILE: file_sha256(embeddings_path)}
+        checksum = hashlib.sha256("".join(checksums[name] for name in sorted(checksums)).encode("utf-8")).hexdigest()
+        created_at = datetime.now(timezone.utc)
+        manifest = {
+            "format_version": INDEX_FORMAT_VERSION,
+            "model_id": model_id,
+            "model_hash": model_hash or model_content_hash(model_id),
+            "created_at": created_at.isoformat(),
+            "count": int(embeddings.shape[0]),
+            "dim": int(embeddings.shape[1]) if embeddings.ndim == 2 else 0,
+            "dtype": "float32",
+            "normalized": True,
+            "chunking": chunking_params,
+            "token_stats": token_stats([int(chunk["tokens"]) for chunk in chunks], int(chunking_params["max_tokens"])),
+            "sizes": {CHUNKS_FILE: os.path.getsize(chunks_path), EMBEDDINGS_FILE: os.path.getsize(embeddings_path)},
+            "checksums": checksums,
+            "checksum": checksum,
+        }
+        with open(os.path.join(staging, MANIFEST_FILE), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+
+        version = f"v{created_at.strftime('%Y%m%dT%H%M%SZ')}-{checksum[:12]}"
+        version_dir = os.path.join(index_root, version)
+        if os.path.exists(version_dir):
+            shutil.rmtree(staging)
+        else:
+            os.replace(staging, version_dir)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    pointer_tmp = os.path.join(index_root, f".{CURRENT_POINTER}.tmp")
+    with open(pointer_tmp, "w", encoding="utf-8") as f:
+        f.write(version + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(pointer_tmp, os.path.join(index_root, CURRENT_POINTER))
+
+    prune_versions(index_root, keep_versions, keep=version)
+    return version_dir
+
+
+def prune_versions(index_root: str, keep_versions: int, keep: str) -> None:
+    """Remove old versions; readers that already mmapped them keep their open files."""
+    versions = sorted(name for name in os.listdir(index_root) if name.startswith("v") and name != keep)
+    for name in versions[: max(len(versions) - (keep_versions - 1), 0)]:
+        shutil.rmtree(os.path.join(index_root, name), ignore_errors=True)
@@ -0,0 +1,183 @@
+"""Loading the chat LLM from any of the directory layouts training produces.
+
+- A LoRA adapter directory (train/train_sft.py output, has adapter_config.json)
+  is merged into its base model at load time.
+- An exported directory (train/export_sft.py output, has inference_config.json)
+  holds merged safetensors weights in a compact dtype. It may also ask for
+  weight-only int8 via dynamic quantization, which is applied on CPU at load time.
+- Anything else loads as a plain float32 checkpoint, as before.
+
+``SpeculativeDecoder`` wraps greedy generation with transformers' assisted
+decoding. A small draft model (``draft``) or n-gram matches against the prompt
+(``prompt_lookup``) propose tokens, and the target model verifies them in one
+forward pass. Greedy outputs are identical to plain ``generate``.
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+ADAPTER_CONFIG = "adapter_config.json"
+INFERENCE_CONFIG = "inference_config.json"
+
+
+def is_adapter_dir(path: str) -> bool:
+    return os.path.isfile(os.path.join(path, ADAPTER_CONFIG))
+
+
+def read_inference_config(path: str) -> Optional[dict]:
+    config_path = os.path.join(path, INFERENCE_CONFIG)
+    if not os.path.isfile(config_path):
+        return None
+    with open(config_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def adapter_base_model(path: str) -> str:
+    with open(os.path.join(path, ADAPTER_CONFIG), "r", encoding="utf-8") as f:
+        return json.load(f)["base_model_name_or_path"]
+
+
+def load_causal_lm(model_id: str, device: str):
+    """Return (tokenizer, model) ready for inference on ``device``."""
+    tokenizer = AutoTokenizer.from_pretrained(model_id)
+
+    if os.path.isdir(model_id) and is_adapter_dir(model_id):
+        from peft import PeftModel
+
+        base_id = adapter_base_model(model_id)
+        print(f"{model_id} is a LoRA adapter; merging into {base_id} (export with train/export_sft.py to skip this)")
+        base = AutoModelForCausalLM.from_pretrained(base_id, torch_dtype=torch.float32, low_cpu_mem_usage=True)
+        model = PeftModel.from_pretrained(base, model_id).merge_and_unload()
+        model.to(device)
+        model.eval()
+        return tokenizer, model
+
+    settings = read_inference_config(model_id) if os.path.isdir(model_id) else None
+    if settings is None:
+        model = AutoModelForCausalLM.from_pretrained(model_id).to(device)
+        model.eval()
+        return tokenizer, model
+
+    quantize = settings.get("quantization") == "dynamic_int8" and device == "cpu"
+    # Dynamic quantization replaces float32 Linear layers, so load those in float32.
+    dtype = torch.float32 if quantize else getattr(torch, settings.get("torch_dtype", "float32"))
+    model = AutoModelForCausalLM.from_pretrained(model_id, torch_dtype=dtype, low_cpu_mem_usage=True)
+    if quantize:
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    model.to(device)
+    model.eval()
+    return tokenizer, model
+
+
+SPECULATIVE_MODES = ("draft", "prompt_lookup")
+# Tokens proposed per step: draft forward passes are cheap but not free, while
+# prompt lookup only copies spans that already appear in the prompt.
+DEFAULT_SPECULATIVE_TOKENS = {"draft": 5, "prompt_lookup": 10}
+
+
+class ForwardCounter:
+    """Counts a model's forward passes per thread (hooks run on the calling thread)."""
+
+    def __init__(self, model):
+        self._local = threading.local()
+        model.register_forward_pre_hook(self._hook)
+
+    def _hook(self, module, args):
+        self._local.count = getattr(self._local, "count", 0) + 1
+
+    def reset(self) -> None:
+        self._local.count = 0
+
+    @property
+    def count(self) -> int:
+        return getattr(self._local, "count", 0)
+
+
+class SpeculativeDecoder:
+    """Greedy speculative decoding for one target model, with acceptance counters.
+
+    Every target forward pass verifies the proposed tokens and adds one token
+    of its own, so ``new_tokens - target_steps`` proposals were accepted. With
+    a draft model, each draft forward pass proposes one token.
+    """
+
+    def __init__(self, model, mode: str, draft_model=None, num_tokens: Optional[int] = None):
+        if mode not in SPECULATIVE_MODES:
+            raise ValueError(f"Unknown speculative mode {mode!r}; expected one of {SPECULATIVE_MODES}")
+        if mode == "draft" and draft_model is None:
+            raise ValueError("Speculative mode 'draft' needs a draft model")
+        self.model = model
+        self.mode = mode
+        self.draft_model = draft_model if mode == "draft" else None
+        self.num_tokens = num_tokens or DEFAULT_SPECULATIVE_TOKENS[mode]
+        self._target_steps = ForwardCounter(model)
+        self._draft_steps = ForwardCounter(self.draft_model) if self.draft_model is not None else None
+        if self.draft_model is not None:
+            self.draft_model.generation_config.num_assistant_tokens = self.num_tokens
+        self._lock = threading.Lock()
+        self._totals = {"requests": 0, "new_tokens": 0, "target_steps": 0, "draft_steps": 0, "seconds": 0.0}
+
+    def generate_kwargs(self) -> Dict[str, Any]:
+        if self.mode == "draft":
+            return {"assistant_model": self.draft_model}
+        return {"prompt_lookup_num_tokens": self.num_tokens}
+
+    def generate(self, inputs, max_new_tokens: int, **kwargs):
+        """Greedy ``generate`` for a single prompt (assisted decoding requires batch size 1)."""
+        self._target_steps.reset()
+        if self._draft_steps is not None:
+            self._draft_steps.reset()
+        started = time.perf_counter()
+        outputs = self.model.generate(
+            **inputs, max_new_tokens=max_new_tokens, do_sample=False, **self.generate_kwargs(), **kwargs
+        )
+        elapsed = time.perf_counter() - started
+        new_tokens = outputs.shape[1] - inputs["input_ids"].shape[1]
+        with self._lock:
+            self._totals["requests"] += 1
+            self._totals["new_tokens"] += new_tokens
+            self._totals["target_steps"] += self._target_steps.count
+            self._totals["draft_steps"] += self._draft_steps.count if self._draft_steps is not None else 0
+            self._totals["seconds"] += elapsed
+        return outputs
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            totals = dict(self._totals)
+        steps = totals["target_steps"]
+        accepted = max(totals["new_tokens"] - steps, 0)
+        stats = {
+            "mode": self.mode,
+            "num_tokens": self.num_tokens,
+            "requests": totals["requests"],
+            "new_tokens": totals["new_tokens"],
+            "target_steps": steps,
+            "accepted_tokens": accepted,
+            # 1.0 means no speedup; the upper bound is num_tokens + 1.
+            "tokens_per_target_step": round(totals["new_tokens"] / steps, 3) if steps else None,
+            "tokens_per_second": round(totals["new_tokens"] / totals["seconds"], 2) if totals["seconds"] else None,
+        }
+        if self.mode == "draft":
+            proposed = totals["draft_steps"]
+            stats.update(proposed_tokens=proposed, acceptance_rate=round(accepted / proposed, 4) if proposed else None)
+        return stats
+
+
+def load_speculative_decoder(
+    tokenizer, model, mode: str, draft_model_id: str, device: str, num_tokens: Optional[int] = None
+) -> SpeculativeDecoder:
+    """Decoder for ``model``; loads the draft model for mode 'draft' and checks it shares the vocabulary."""
+    draft_model = None
+    if mode == "draft":
+        print(f"Loading draft model from {draft_model_id}...")
+        draft_tokenizer, draft_model = load_causal_lm(draft_model_id, device)
+        # Proposed token ids are verified as-is, so both models must use the same vocabulary.
+        if draft_tokenizer.get_vocab() != tokenizer.get_vocab():
+            raise ValueError(f"Draft model {draft_model_id} does not share the target model's tokenizer")
+    return SpeculativeDecoder(model, mode, draft_model, num_tokens)
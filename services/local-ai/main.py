@@ -1,84 +1,159 @@
+"""Local AI service: classification, embeddings, retrieval and chat over HTTP.
+
+Importing this module is cheap: torch, transformers, sentence_transformers and
+pymongo are imported by the startup phases, not at module level. At startup
+the models, the knowledge base and MongoDB load concurrently; with
+STARTUP_MODE=background (the default) the server accepts connections while
+they load. /health is liveness and answers immediately. /ready is readiness
+and returns 503 until every phase has finished, as do the model endpoints.
+"""
+
+import hashlib
+import json
+import math
 import os
 import re
-from typing import List, Optional
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
 
 import numpy as np
-import torch
-from fastapi import FastAPI
-from pymongo import MongoClient
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-from sentence_transformers import SentenceTransformer
-from transformers import AutoModelForCausalLM, AutoModelForSequenceClassification, AutoTokenizer
+
+import cache
+import cascade
+import chunking
+import compliance
+import kb_index
+from model_ids import DISTILBERT_MODEL_ID, MINILM_MODEL_ID, QWEN_DRAFT_MODEL_ID, QWEN_MODEL_ID, model_content_hash
 
 app = FastAPI()
 
 BASE_DIR = os.path.dirname(__file__)
 
 
-def resolve_model_id(env_var: str, default_id: str, finetuned_rel_path: str) -> str:
-    explicit = os.getenv(env_var)
-    if explicit:
-        return explicit
-    finetuned_path = os.path.abspath(os.path.join(BASE_DIR, finetuned_rel_path))
-    if os.path.isdir(finetuned_path):
-        return finetuned_path
-    return default_id
-
-
-QWEN_MODEL_ID = resolve_model_id(
-    "QWEN_MODEL_ID",
-    "Qwen/Qwen2.5-1.5B-Instruct",
-    "../../models/finetuned/qwen-credit-sft",
-)
-DISTILBERT_MODEL_ID = resolve_model_id(
-    "DISTILBERT_MODEL_ID",
-    "distilbert-base-uncased",
-    "../../models/finetuned/distilbert-eligibility",
-)
-MINILM_MODEL_ID = resolve_model_id(
-    "MINILM_MODEL_ID",
-    "sentence-transformers/all-MiniLM-L6-v2",
-    "../../models/finetuned/minilm-embeddings",
-)
 KNOWLEDGE_BASE_DIR = os.getenv("KNOWLEDGE_BASE_DIR", "../../data/knowledge-base")
-MONGODB_URI = os.getenv("MONGODB_URI")
 MONGODB_DB = os.getenv("MONGODB_DB", "credit_ai")
+KNOWLEDGE_CHUNK_OVERLAP_TOKENS = int(os.getenv("KNOWLEDGE_CHUNK_OVERLAP_TOKENS", "32"))
+KNOWLEDGE_INDEX_DIR = os.getenv(
+    "KNOWLEDGE_INDEX_DIR",
+    os.path.abspath(os.path.join(BASE_DIR, "../../data/knowledge-base/index")),
+)
+# off, size (compare file sizes with the manifest) or full (re-hash the files); true/false map to full/off.
+KNOWLEDGE_INDEX_VERIFY = os.getenv("KNOWLEDGE_INDEX_VERIFY", "size").lower()
+KNOWLEDGE_INDEX_VERIFY = {"true": "full", "false": "off"}.get(KNOWLEDGE_INDEX_VERIFY, KNOWLEDGE_INDEX_VERIFY)
 
-DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+# background: bind immediately and load in a background thread; blocking: load before accepting connections.
+STARTUP_MODE = os.getenv("STARTUP_MODE", "background").lower()
+STARTUP_WORKERS = int(os.getenv("STARTUP_WORKERS", "4"))
 ENABLE_LLM = os.getenv("ENABLE_LLM", "false").lower() == "true"
+# off, draft (QWEN_DRAFT_MODEL_ID proposes tokens) or prompt_lookup (copies spans of the prompt).
+# Applies to greedy requests (temperature 0) only.
+SPECULATIVE_DECODING = os.getenv("SPECULATIVE_DECODING", "off").lower()
+SPECULATIVE_NUM_TOKENS = int(os.getenv("SPECULATIVE_NUM_TOKENS", "0")) or None
+# off: no scan; flag: report violations alongside the answer; block: replace violating answers
+OUTPUT_GUARD = os.getenv("OUTPUT_GUARD", "flag").lower()
+RETRIEVE_CACHE_SIZE = int(os.getenv("RETRIEVE_CACHE_SIZE", "1024"))
+CLASSIFY_CACHE_SIZE = int(os.getenv("CLASSIFY_CACHE_SIZE", "4096"))
+# Persistent tier behind the in-process LRU: sqlite, mongo (needs MONGODB_URI) or none.
+CLASSIFY_CACHE_BACKEND = os.getenv("CLASSIFY_CACHE_BACKEND", "sqlite").lower()
+CLASSIFY_CACHE_PATH = os.getenv(
+    "CLASSIFY_CACHE_PATH",
+    os.path.abspath(os.path.join(BASE_DIR, "../../.cache/classify_cache.sqlite")),
+)
+# Cascade for /classify: a linear head over MiniLM embeddings answers confident texts,
+# the rest go to DistilBERT (and, with CASCADE_LLM, low-confidence DistilBERT answers to the LLM).
+CLASSIFY_CASCADE = os.getenv("CLASSIFY_CASCADE", "false").lower() == "true"
+CASCADE_HEAD_PATH = os.getenv(
+    "CASCADE_HEAD_PATH",
+    os.path.abspath(os.path.join(BASE_DIR, "../../models/finetuned/cascade-head", cascade.HEAD_FILE)),
+)
+# Overrides the threshold calibrated by train/train_cascade_head.py.
+CASCADE_THRESHOLD = float(os.getenv("CASCADE_THRESHOLD")) if os.getenv("CASCADE_THRESHOLD") else None
+CASCADE_LLM = os.getenv("CASCADE_LLM", "false").lower() == "true"
+CASCADE_LLM_THRESHOLD = float(os.getenv("CASCADE_LLM_THRESHOLD", "0.6"))
+# /answer: Qwen tokens of retrieved context packed into the prompt, and the smallest
+# remainder worth filling with a truncated context.
+ANSWER_CONTEXT_TOKENS = int(os.getenv("ANSWER_CONTEXT_TOKENS", "1024"))
+ANSWER_MIN_CONTEXT_TOKENS = int(os.getenv("ANSWER_MIN_CONTEXT_TOKENS", "64"))
+# Contexts whose token sets overlap an earlier one at least this much (Jaccard) are dropped.
+ANSWER_DEDUP_THRESHOLD = float(os.getenv("ANSWER_DEDUP_THRESHOLD", "0.8"))
+ANSWER_SYSTEM_PROMPT = os.getenv(
+    "ANSWER_SYSTEM_PROMPT",
+    "You are Credit AI. Follow compliance rules and respond using the required structure. "
+    "Answer only from the provided context.",
+)
 
-# Lazy load LLM (1.5B params, requires ~6GB RAM)
+# Set by the startup phases (load_service).
+DEVICE: Optional[str] = None
 qwen_tokenizer = None
 qwen_model = None
-if ENABLE_LLM:
+speculative_decoder = None
+bert_tokenizer = None
+bert_model = None
+# Cached results are keyed by this hash, so a different checkpoint never sees them.
+DISTILBERT_CONTENT_HASH: Optional[str] = None
+minilm_model = None
+MINILM_CONTENT_HASH: Optional[str] = None
+
+
+def import_frameworks():
+    global DEVICE
+    import sentence_transformers  # noqa: F401
+    import torch
+    import transformers  # noqa: F401
+
+    DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def load_llm():
+    """Qwen (1.5B params, requires ~6GB RAM), plus the speculative decoder when enabled."""
+    global qwen_tokenizer, qwen_model, speculative_decoder
+    import llm
+
     print(f"Loading LLM from {QWEN_MODEL_ID}...")
-    qwen_tokenizer = AutoTokenizer.from_pretrained(QWEN_MODEL_ID)
-    qwen_model = AutoModelForCausalLM.from_pretrained(QWEN_MODEL_ID).to(DEVICE)
+    qwen_tokenizer, qwen_model = llm.load_causal_lm(QWEN_MODEL_ID, DEVICE)
     print("LLM loaded")
+    if SPECULATIVE_DECODING != "off":
+        speculative_decoder = llm.load_speculative_decoder(
+            qwen_tokenizer, qwen_model, SPECULATIVE_DECODING, QWEN_DRAFT_MODEL_ID, DEVICE, SPECULATIVE_NUM_TOKENS
+        )
+        print(f"Speculative decoding: {SPECULATIVE_DECODING} ({speculative_decoder.num_tokens} tokens per step)")
 
-# Load fine-tuned classifier (~250MB)
-print(f"Loading classifier from {DISTILBERT_MODEL_ID}...")
-bert_tokenizer = AutoTokenizer.from_pretrained(DISTILBERT_MODEL_ID)
-bert_model = AutoModelForSequenceClassification.from_pretrained(DISTILBERT_MODEL_ID).to(DEVICE)
-print("Classifier loaded")
 
-# Load fine-tuned embeddings (~90MB)
-print(f"Loading embeddings from {MINILM_MODEL_ID}...")
-minilm_model = SentenceTransformer(MINILM_MODEL_ID, device=DEVICE)
-print("Embeddings loaded")
+def load_classifier_model():
+    """Fine-tuned classifier (~250MB)."""
+    global bert_tokenizer, bert_model, DISTILBERT_CONTENT_HASH
+    import classifier
 
-LABELS = {
-    "eligible": "Clear factual inaccuracy with evidence or strong basis for dispute",
-    "conditionally_eligible": "Possible inaccuracy but requires verification or additional evidence",
-    "not_eligible": "Information appears accurate or does not meet dispute criteria",
-    "insufficient_information": "Not enough information to determine dispute eligibility",
-}
+    print(f"Loading classifier from {DISTILBERT_MODEL_ID}...")
+    bert_tokenizer, bert_model = classifier.load_classifier(DISTILBERT_MODEL_ID, DEVICE)
+    DISTILBERT_CONTENT_HASH = model_content_hash(DISTILBERT_MODEL_ID)
+    print(f"Classifier loaded (content hash {DISTILBERT_CONTENT_HASH[:12]})")
 
 
+def load_embeddings():
+    """Fine-tuned embeddings (~90MB)."""
+    global minilm_model, MINILM_CONTENT_HASH
+    from sentence_transformers import SentenceTransformer
 
-def build_prompt(system: Optional[str], user: str) -> str:
-    if not ENABLE_LLM or qwen_tokenizer is None:
+    print(f"Loading embeddings from {MINILM_MODEL_ID}...")
+    minilm_model = SentenceTransformer(MINILM_MODEL_ID, device=DEVICE)
+    MINILM_CONTENT_HASH = model_content_hash(MINILM_MODEL_ID)
+    print(f"Embeddings loaded (content hash {MINILM_CONTENT_HASH[:12]})")
+
+
+def require_llm():
+    if not ENABLE_LLM or qwen_model is None or qwen_tokenizer is None:
         raise ValueError("LLM is disabled. Set ENABLE_LLM=true to enable chat functionality.")
+
+
+def build_prompt(system: Optional[str], user: str) -> str:
+    require_llm()
     messages = []
     if system:
         messages.append({"role": "system", "content": system})
@@ -87,20 +162,52 @@ def build_prompt(system: Optional[str], user: str) -> str:
 
 
 def generate_text(system: Optional[str], user: str, max_new_tokens: int = 512, temperature: float = 0.3) -> str:
-    if not ENABLE_LLM or qwen_model is None:
-        raise ValueError("LLM is disabled. Set ENABLE_LLM=true to enable chat functionality.")
-    prompt = build_prompt(system, user)
+    content, _, _ = generate_from_prompt(build_prompt(system, user), max_new_tokens, temperature)
+    return content
+
+
+def generate_from_prompt(prompt: str, max_new_tokens: int, temperature: float):
+    """Generate from a chat-formatted prompt; returns (text, prompt tokens, generated tokens)."""
+    import torch
+
+    require_llm()
     inputs = qwen_tokenizer(prompt, return_tensors="pt").to(DEVICE)
     with torch.no_grad():
-        outputs = qwen_model.generate(
-            **inputs,
-            max_new_tokens=max_new_tokens,
-            temperature=temperature,
-            do_sample=temperature > 0,
-        )
-    decoded = qwen_tokenizer.decode(outputs[0], skip_special_tokens=True)
-    # Remove prompt echo if present
-    return decoded.replace(prompt, "").strip()
+        if speculative_decoder is not None and temperature <= 0:
+            # Verified against the target model, so the output equals plain greedy decoding.
+            outputs = speculative_decoder.generate(inputs, max_new_tokens)
+        else:
+            outputs = qwen_model.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens,
+                temperature=temperature,
+                do_sample=temperature > 0,
+            )
+    return decode_completion(qwen_tokenizer, inputs, outputs)
+
+
+def decode_completion(tokenizer, inputs, outputs):
+    """(text, prompt tokens, generated tokens) for a batch of one.
+
+    generate() returns the prompt ids followed by the new ones. Only the new
+    ids are decoded: skip_special_tokens drops the chat markers, so the prompt
+    is not a substring of a full decode and would leak into the reply.
+    """
+    prompt_tokens = inputs["input_ids"].shape[1]
+    text = tokenizer.decode(outputs[0, prompt_tokens:], skip_special_tokens=True)
+    return text.strip(), prompt_tokens, outputs.shape[1] - prompt_tokens
+
+
+def guard_output(content: str):
+    """Scan generated text for compliance violations before it leaves the service."""
+    if OUTPUT_GUARD == "off":
+        return content, None
+    result = compliance.DEFAULT_SCANNER.scan(content)
+    report = result.to_dict()
+    if not result.compliant and OUTPUT_GUARD == "block":
+        report["blocked"] = True
+        return compliance.REFUSAL_MESSAGE, report
+    return content, report
 
 
 class ChatRequest(BaseModel):
@@ -123,14 +230,28 @@ class RetrieveRequest(BaseModel):
     top_k: int = 5
 
 
+class AnswerRequest(BaseModel):
+    question: str
+    system: Optional[str] = None
+    top_k: int = 5
+    # Defaults to ANSWER_CONTEXT_TOKENS.
+    max_context_tokens: Optional[int] = None
+    max_new_tokens: int = 512
+    # Greedy by default: structured answers, and speculative decoding applies.
+    temperature: float = 0.0
+
+
 class ChatResponse(BaseModel):
     content: str
+    compliance: Optional[dict] = None
 
 
 class ClassifyResponse(BaseModel):
     eligibility: str
     confidence: float
     reasoning: dict
+    # Cascade stage that answered: linear, distilbert or llm.
+    stage: Optional[str] = None
 
 
 class EmbedResponse(BaseModel):
@@ -142,12 +263,102 @@ class RetrieveResponse(BaseModel):
     citations: List[dict] = []
 
 
+class AnswerResponse(BaseModel):
+    answer: str
+    citations: List[dict] = []
+    compliance: Optional[dict] = None
+    usage: dict
+    timings_ms: dict
+
+
 documents: List[str] = []
 doc_sources: List[str] = []
 doc_tokens: List[set] = []
 doc_embeddings = None
-mongo_client = None
-mongo_db = None
+mongo_storage = None  # storage.Storage when MONGODB_URI is set
+# Keyed by (normalized query, top_k); cleared whenever the knowledge base is (re)loaded.
+retrieve_cache = cache.LRUCache(RETRIEVE_CACHE_SIZE)
+# Replaced at startup once the persistent backend is available.
+classify_cache = cache.TieredCache(cache.LRUCache(CLASSIFY_CACHE_SIZE))
+classify_cascade: Optional[cascade.ClassificationCascade] = None
+# Identifies what produces /classify results; cached results are keyed by it.
+classify_results_hash: Optional[str] = None
+
+
+def distilbert_probabilities(text: str):
+    import classifier
+
+    names = classifier.label_names(bert_model.config)
+    return names, classifier.predict_proba(bert_tokenizer, bert_model, [text], DEVICE)[0]
+
+
+def build_cascade() -> Optional[cascade.ClassificationCascade]:
+    import classifier
+
+    if not os.path.exists(CASCADE_HEAD_PATH):
+        print(f"No cascade head at {CASCADE_HEAD_PATH} (train/train_cascade_head.py); classifying with DistilBERT only")
+        return None
+    head = cascade.LinearHead.load(CASCADE_HEAD_PATH)
+    if head.embedder_hash != model_content_hash(MINILM_MODEL_ID):
+        print(f"Cascade head {CASCADE_HEAD_PATH} was trained on a different MiniLM checkpoint; not using it")
+        return None
+    llm_stage = None
+    if CASCADE_LLM:
+        if ENABLE_LLM:
+            llm_stage = cascade.llm_labeler(
+                lambda system, user: generate_text(system, user, max_new_tokens=16, temperature=0.0),
+                list(classifier.LABELS),
+            )
+        else:
+            print("CASCADE_LLM=true but the LLM is disabled; the cascade stops at DistilBERT")
+    # Calibration stores inf when no threshold met the target accuracy: the head would
+    # never answer, and every request would pay for a MiniLM embedding for nothing.
+    linear = CASCADE_THRESHOLD is not None or math.isfinite(head.threshold)
+    if not linear:
+        reason = f"Cascade head {CASCADE_HEAD_PATH} has no calibrated threshold (it never reached its target accuracy)"
+        if llm_stage is None:
+            print(f"{reason}; classifying with DistilBERT only")
+            return None
+        print(f"{reason}; skipping the linear stage")
+    return cascade.ClassificationCascade(
+        head,
+        embed=lambda texts: minilm_model.encode(texts, normalize_embeddings=True),
+        classify=distilbert_probabilities,
+        threshold=CASCADE_THRESHOLD,
+        llm=llm_stage,
+        llm_threshold=CASCADE_LLM_THRESHOLD,
+        linear=linear,
+    )
+
+
+def cascade_results_hash(head_path: str, cascade_: cascade.ClassificationCascade) -> str:
+    digest = hashlib.sha256(DISTILBERT_CONTENT_HASH.encode("utf-8"))
+    with open(head_path, "rb") as f:
+        digest.update(f.read())
+    digest.update(f"{cascade_.threshold}:{cascade_.llm is not None}:{cascade_.llm_threshold}".encode("utf-8"))
+    if cascade_.llm is not None:
+        digest.update(model_content_hash(QWEN_MODEL_ID).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def build_classify_cache() -> cache.TieredCache:
+    store = None
+    if CLASSIFY_CACHE_BACKEND == "sqlite":
+        store = cache.SQLiteResultStore(CLASSIFY_CACHE_PATH, classify_results_hash)
+    elif CLASSIFY_CACHE_BACKEND == "mongo":
+        if mongo_storage is None:
+            print("CLASSIFY_CACHE_BACKEND=mongo but MongoDB is not configured; using the in-process cache only")
+        else:
+            store = cache.MongoResultStore(mongo_storage.db["classification_cache"], classify_results_hash)
+    elif CLASSIFY_CACHE_BACKEND != "none":
+        raise ValueError(f"Unknown CLASSIFY_CACHE_BACKEND {CLASSIFY_CACHE_BACKEND!r}")
+    return cache.TieredCache(cache.LRUCache(CLASSIFY_CACHE_SIZE), store)
+
+
+def log_request(endpoint: str, started: float, text: Optional[str] = None, **fields):
+    """Queue a request log entry (written in bulk in the background); no-op without MongoDB."""
+    if mongo_storage is not None:
+        mongo_storage.log_request(endpoint, (time.perf_counter() - started) * 1000, text=text, **fields)
 
 
 def tokenize(text: str) -> set:
@@ -167,20 +378,27 @@ def resolve_knowledge_dirs() -> List[str]:
     return default_dirs
 
 
-def strip_front_matter(content: str) -> str:
-    if not content.startswith("---"):
-        return content
-    end = content.find("\n---", 3)
-    if end == -1:
-        return content
-    return content[end + 4 :].lstrip()
-
-
 def load_knowledge_base():
     global documents, doc_sources, doc_tokens, doc_embeddings
-    docs = []
-    sources = []
-    tokens = []
+
+    retrieve_cache.clear()
+    # Prefer the index published by ingestion; it was chunked and embedded with
+    # the same code, so startup only maps it instead of re-encoding the corpus.
+    loaded = None
+    try:
+        loaded = kb_index.load_index(
+            KNOWLEDGE_INDEX_DIR, model_content_hash(MINILM_MODEL_ID), verify=KNOWLEDGE_INDEX_VERIFY
+        )
+    except (OSError, ValueError) as exc:
+        print(f"Ignoring knowledge index at {KNOWLEDGE_INDEX_DIR}: {exc}")
+    if loaded is not None:
+        chunks, embeddings, manifest = loaded
+        print(f"Loaded knowledge index {manifest['checksum'][:12]} ({manifest['count']} chunks)")
+        documents = [str(chunk["text"]) for chunk in chunks]
+        doc_sources = [str(chunk["source"]) for chunk in chunks]
+        doc_tokens = [tokenize(text) for text in documents]
+        doc_embeddings = embeddings if documents else None
+        return
 
     knowledge_dirs = [path for path in resolve_knowledge_dirs() if os.path.isdir(path)]
     if not knowledge_dirs:
@@ -188,87 +406,224 @@ def load_knowledge_base():
         doc_embeddings = None
         return
 
-    for base_dir in knowledge_dirs:
-        for root, _, files in os.walk(base_dir):
-            for name in files:
-                if not name.endswith(".md"):
-                    continue
-                path = os.path.join(root, name)
-                with open(path, "r", encoding="utf-8") as f:
-                    content = strip_front_matter(f.read())
-                for chunk in content.split("\n\n"):
-                    text = chunk.strip()
-                    if len(text) < 40:
-                        continue
-                    docs.append(text)
-                    sources.append(os.path.relpath(path, base_dir))
-                    tokens.append(tokenize(text))
-
-    documents = docs
-    doc_sources = sources
-    doc_tokens = tokens
+    # Chunk with the embedder's own tokenizer so each chunk fits its max sequence length.
+    count_tokens = chunking.make_token_counter(minilm_model.tokenizer)
+    max_tokens = chunking.max_chunk_tokens(minilm_model.tokenizer, minilm_model.max_seq_length)
+    chunks = kb_index.collect_chunks(knowledge_dirs, count_tokens, max_tokens, KNOWLEDGE_CHUNK_OVERLAP_TOKENS)
+
+    documents = [str(chunk["text"]) for chunk in chunks]
+    doc_sources = [str(chunk["source"]) for chunk in chunks]
+    doc_tokens = [tokenize(text) for text in documents]
     if documents:
         doc_embeddings = minilm_model.encode(documents, normalize_embeddings=True)
     else:
         doc_embeddings = None
 
 
+def connect_mongo():
+    global mongo_storage
+    import storage
+
+    mongo_storage = storage.connect_from_env()
+    if mongo_storage is not None:
+        settings = mongo_storage.settings
+        print(
+            f"MongoDB URI configured: {settings.uri[:20]}... "
+            f"(pool {settings.min_pool_size}-{settings.max_pool_size}, health checked in the background)"
+        )
+    else:
+        print("MongoDB not configured")
+
+
+def setup_classification():
+    """Cascade and result cache; needs the classifier, the embeddings, the LLM and MongoDB."""
+    global classify_cache, classify_cascade, classify_results_hash
+    classify_results_hash = DISTILBERT_CONTENT_HASH
+    if CLASSIFY_CASCADE:
+        classify_cascade = build_cascade()
+        if classify_cascade is not None:
+            classify_results_hash = cascade_results_hash(CASCADE_HEAD_PATH, classify_cascade)
+            first_stage = "no linear stage"
+            if classify_cascade.linear:
+                first_stage = f"linear threshold {classify_cascade.threshold:.4f}"
+            print(f"Classification cascade enabled ({first_stage})")
+    classify_cache = build_classify_cache()
+    print(f"Classification cache: LRU {CLASSIFY_CACHE_SIZE} + {CLASSIFY_CACHE_BACKEND}")
+
+
+# name -> {"status": running/done/failed, "seconds", "error"}, in start order.
+startup_phases: Dict[str, Dict[str, Any]] = {}
+startup_lock = threading.Lock()
+service_ready = threading.Event()
+startup_seconds: Optional[float] = None
+
+
+def run_phase(name: str, load: Callable[[], None]) -> None:
+    with startup_lock:
+        startup_phases[name] = {"status": "running"}
+    started = time.perf_counter()
+    try:
+        load()
+    except Exception as exc:
+        seconds = round(time.perf_counter() - started, 3)
+        with startup_lock:
+            startup_phases[name] = {"status": "failed", "seconds": seconds, "error": str(exc)}
+        raise
+    seconds = round(time.perf_counter() - started, 3)
+    with startup_lock:
+        startup_phases[name] = {"status": "done", "seconds": seconds}
+    print(f"[startup] {name}: {seconds:.2f}s")
+
+
+def load_embeddings_and_knowledge_base():
+    run_phase("embeddings", load_embeddings)
+    # Chunking and encoding the corpus (without a published index) needs the embedder.
+    run_phase("knowledge_base", load_knowledge_base)
+
+
+def load_service():
+    """Run the startup phases; the independent ones concurrently."""
+    global startup_seconds
+    started = time.perf_counter()
+    try:
+        run_phase("imports", import_frameworks)
+        with ThreadPoolExecutor(max_workers=STARTUP_WORKERS, thread_name_prefix="startup") as pool:
+            futures = [
+                pool.submit(run_phase, "mongo", connect_mongo),
+                pool.submit(run_phase, "classifier", load_classifier_model),
+                pool.submit(load_embeddings_and_knowledge_base),
+            ]
+            if ENABLE_LLM:
+                futures.append(pool.submit(run_phase, "llm", load_llm))
+            for future in futures:
+                future.result()
+        run_phase("classification", setup_classification)
+    except Exception:
+        if STARTUP_MODE == "blocking":
+            raise
+        traceback.print_exc()
+        print("Startup failed; /ready keeps returning 503")
+        return
+    startup_seconds = round(time.perf_counter() - started, 3)
+    service_ready.set()
+
+    with startup_lock:
+        breakdown = {name: phase["seconds"] for name, phase in startup_phases.items()}
+    print(f"Startup complete in {startup_seconds:.2f}s (phases add up to {sum(breakdown.values()):.2f}s):")
+    for name, seconds in sorted(breakdown.items(), key=lambda item: item[1], reverse=True):
+        print(f"  {name:<15} {seconds:7.2f}s")
+
+
 @app.on_event("startup")
 def startup_event():
-    global mongo_client, mongo_db
-    print("Starting up... checking MongoDB")
-    if MONGODB_URI:
-        print(f"MongoDB URI configured: {MONGODB_URI[:20]}...")
-        mongo_client = MongoClient(MONGODB_URI)
-        mongo_db = mongo_client[MONGODB_DB]
+    print(f"Starting up ({STARTUP_MODE})...")
+    if STARTUP_MODE == "blocking":
+        load_service()
+    elif STARTUP_MODE == "background":
+        threading.Thread(target=load_service, name="service-startup", daemon=True).start()
     else:
-        print("MongoDB not configured")
-    print("Loading knowledge base...")
-    load_knowledge_base()
-    print("Startup complete!")
+        raise ValueError(f"Unknown STARTUP_MODE {STARTUP_MODE!r}; expected background or blocking")
+
+
+# Served while the models load; everything else answers 503 until the service is ready.
+ALWAYS_AVAILABLE = {"/health", "/ready"}
+
+
+@app.middleware("http")
+async def refuse_until_ready(request: Request, call_next):
+    if not service_ready.is_set() and request.url.path not in ALWAYS_AVAILABLE:
+        return JSONResponse({"detail": "Service is starting"}, status_code=503, headers={"Retry-After": "5"})
+    return await call_next(request)
+
+
+@app.on_event("shutdown")
+def shutdown_event():
+    classify_cache.close()
+    if mongo_storage is not None:
+        mongo_storage.close()
 
 
 @app.get("/health")
 def health():
-    mongo_status = "disabled"
-    if mongo_client is not None:
-        try:
-            mongo_client.admin.command("ping")
-            mongo_status = "connected"
-        except Exception:
-            mongo_status = "error"
-    return {"status": "ok", "device": DEVICE, "mongo": mongo_status}
+    """Liveness: the process is up and serving, whether or not the models have loaded."""
+    # Cached status from the background pinger, so /health never waits on MongoDB.
+    mongo_status = mongo_storage.health()["status"] if mongo_storage is not None else "disabled"
+    return {"status": "ok", "ready": service_ready.is_set(), "device": DEVICE, "mongo": mongo_status}
+
+
+@app.get("/ready")
+def ready():
+    """Readiness: 200 once every startup phase has finished, 503 (with per-phase status) before."""
+    with startup_lock:
+        phases = {name: dict(phase) for name, phase in startup_phases.items()}
+    if service_ready.is_set():
+        return {"status": "ready", "startup_seconds": startup_seconds, "phases": phases}
+    failed = any(phase["status"] == "failed" for phase in phases.values())
+    return JSONResponse({"status": "failed" if failed else "starting", "phases": phases}, status_code=503)
 
 
 @app.get("/mongo/health")
-def mongo_health():
-    if mongo_client is None:
+async def mongo_health():
+    if mongo_storage is None:
         return {"status": "disabled"}
-    try:
-        mongo_client.admin.command("ping")
-        return {"status": "connected", "database": MONGODB_DB}
-    except Exception as exc:
-        return {"status": "error", "message": str(exc)}
+    status = await mongo_storage.ping_async()
+    if status["status"] == "error":
+        return {"status": "error", "message": status.get("error")}
+    return {
+        **status,
+        "database": MONGODB_DB,
+        "background": mongo_storage.health(),
+        "request_logs": mongo_storage.stats(),
+    }
+
+
+@app.get("/metrics")
+def metrics():
+    return {
+        "classify_cache": classify_cache.stats(),
+        "retrieve_cache": retrieve_cache.stats(),
+        "request_logs": mongo_storage.stats() if mongo_storage is not None else None,
+        "classify_cascade": classify_cascade.stats() if classify_cascade is not None else None,
+        "speculative_decoding": speculative_decoder.stats() if speculative_decoder is not None else None,
+    }
 
 
 @app.post("/chat", response_model=ChatResponse)
 def chat(req: ChatRequest):
+    started = time.perf_counter()
     content = generate_text(req.system, req.user, req.max_new_tokens, req.temperature)
-    return ChatResponse(content=content)
+    content, report = guard_output(content)
+    log_request(
+        "chat",
+        started,
+        text=req.user,
+        output_chars=len(content),
+        compliant=report["compliant"] if report else None,
+        blocked=bool(report and report.get("blocked")),
+    )
+    return ChatResponse(content=content, compliance=report)
 
 
 @app.post("/classify", response_model=ClassifyResponse)
 def classify(req: ClassifyRequest):
-    encoded = bert_tokenizer(req.text, padding=True, truncation=True, return_tensors="pt").to(DEVICE)
-    with torch.no_grad():
-        logits = bert_model(**encoded).logits
-    probs = torch.nn.functional.softmax(logits, dim=-1).cpu().numpy()[0]
-    best_idx = int(np.argmax(probs))
+    started = time.perf_counter()
+    key = cache.result_key(classify_results_hash, req.text, getattr(bert_tokenizer, "do_lower_case", False))
+    cached = classify_cache.get(key)
+    if cached is not None:
+        # Entries cached before the cascade existed hold only (label, confidence).
+        label, confidence, stage = cached[0], cached[1], cached[2] if len(cached) > 2 else "distilbert"
+    elif classify_cascade is not None:
+        label, confidence, stage = classify_cascade.classify(req.text)
+        classify_cache.put(key, [label, confidence, stage])
+    else:
+        import classifier
 
-    id2label = bert_model.config.id2label or {idx: label for idx, label in enumerate(LABELS.keys())}
-    label_key = id2label.get(best_idx, str(best_idx))
-    label = label_key if label_key in LABELS else label_key.lower()
-    confidence = float(probs[best_idx])
+        label, confidence = classifier.predict(bert_tokenizer, bert_model, [req.text], DEVICE)[0]
+        stage = "distilbert"
+        classify_cache.put(key, [label, confidence, stage])
+    log_request(
+        "classify", started, text=req.text, label=label, confidence=confidence, stage=stage, cached=cached is not None
+    )
 
     reasoning = {
         "factors": ["Semantic similarity match to eligibility criteria"],
@@ -280,46 +635,167 @@ def classify(req: ClassifyRequest):
         eligibility=label,
         confidence=confidence,
         reasoning=reasoning,
+        stage=stage,
     )
 
 
 @app.post("/embed", response_model=EmbedResponse)
 def embed(req: EmbedRequest):
+    started = time.perf_counter()
     embeddings = minilm_model.encode(req.texts, normalize_embeddings=True)
+    log_request("embed", started, texts=len(req.texts))
     return EmbedResponse(embeddings=embeddings.tolist())
 
 
-@app.post("/retrieve", response_model=RetrieveResponse)
-def retrieve(req: RetrieveRequest):
-    if not documents or doc_embeddings is None:
-        return RetrieveResponse(contexts=[], citations=[])
+def rank_documents(query: str, top_k: int):
+    """Top ``top_k`` chunks for ``query`` as (index, combined, semantic, overlap) tuples, and whether cached."""
+    # Keyed like /classify results: case folds into the key only when the MiniLM tokenizer is uncased.
+    lowercase = getattr(minilm_model.tokenizer, "do_lower_case", False)
+    cache_key = (cache.result_key(MINILM_CONTENT_HASH, query, lowercase), top_k)
+    cached = retrieve_cache.get(cache_key)
+    if cached is not None:
+        return cached, True
 
-    query_embedding = minilm_model.encode([req.query], normalize_embeddings=True)[0]
+    query_embedding = minilm_model.encode([query], normalize_embeddings=True)[0]
     scores = np.dot(doc_embeddings, query_embedding)
 
-    candidate_k = max(req.top_k * 2, req.top_k)
+    candidate_k = max(top_k * 2, top_k)
     initial_indices = np.argsort(scores)[-candidate_k:][::-1]
 
-    query_tokens = tokenize(req.query)
+    query_tokens = tokenize(query)
     reranked = []
     for idx in initial_indices:
         overlap = 0.0
         if query_tokens and doc_tokens[idx]:
             overlap = len(query_tokens & doc_tokens[idx]) / (len(query_tokens) ** 0.5)
         combined = (0.7 * float(scores[idx])) + (0.3 * overlap)
-        reranked.append((idx, combined, float(scores[idx]), overlap))
+        reranked.append((int(idx), combined, float(scores[idx]), overlap))
 
     reranked.sort(key=lambda item: item[1], reverse=True)
-    top_items = reranked[:req.top_k]
+    top_items = reranked[:top_k]
+    retrieve_cache.put(cache_key, top_items)
+    return top_items, False
+
+
+def citation(idx: int, combined: float, semantic: float, overlap: float) -> dict:
+    return {
+        "source": doc_sources[idx],
+        "score": round(combined, 6),
+        "semantic": round(semantic, 6),
+        "overlap": round(overlap, 6),
+    }
 
+
+def jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+def dedup_ranked(ranked: List[tuple], limit: int) -> List[tuple]:
+    """Drop chunks that repeat a higher-ranked one (same text, or token Jaccard >= ANSWER_DEDUP_THRESHOLD)."""
+    kept = []
+    seen_texts = set()
+    for item in ranked:
+        idx = item[0]
+        normalized = cache.normalize_text(documents[idx])
+        if normalized in seen_texts:
+            continue
+        if any(jaccard(doc_tokens[idx], doc_tokens[other[0]]) >= ANSWER_DEDUP_THRESHOLD for other in kept):
+            continue
+        seen_texts.add(normalized)
+        kept.append(item)
+        if len(kept) >= limit:
+            break
+    return kept
+
+
+def pack_contexts(ranked: List[tuple], budget: int):
+    """Contexts in rank order that fit ``budget`` Qwen tokens; returns (contexts, citations, tokens used).
+
+    The first context that does not fit is cut to the remaining budget when at
+    least ANSWER_MIN_CONTEXT_TOKENS remain; packing stops there.
+    """
+    contexts: List[str] = []
+    citations: List[dict] = []
+    used = 0
+    for idx, combined, semantic, overlap in ranked:
+        text = f"[{doc_sources[idx]}] {documents[idx]}"
+        token_ids = qwen_tokenizer.encode(text, add_special_tokens=False)
+        remaining = budget - used
+        truncated = len(token_ids) > remaining
+        if truncated:
+            if remaining < ANSWER_MIN_CONTEXT_TOKENS:
+                break
+            token_ids = token_ids[:remaining]
+            text = qwen_tokenizer.decode(token_ids)
+        contexts.append(text)
+        citations.append(
+            {**citation(idx, combined, semantic, overlap), "tokens": len(token_ids), "truncated": truncated}
+        )
+        used += len(token_ids)
+        if truncated:
+            break
+    return contexts, citations, used
+
+
+@app.post("/retrieve", response_model=RetrieveResponse)
+def retrieve(req: RetrieveRequest):
+    started = time.perf_counter()
+    if not documents or doc_embeddings is None:
+        return RetrieveResponse(contexts=[], citations=[])
+
+    top_items, cached = rank_documents(req.query, req.top_k)
     contexts = [f"[{doc_sources[i]}] {documents[i]}" for i, _, _, _ in top_items]
-    citations = [
-        {
-            "source": doc_sources[i],
-            "score": round(combined, 6),
-            "semantic": round(semantic, 6),
-            "overlap": round(overlap, 6),
-        }
-        for i, combined, semantic, overlap in top_items
-    ]
+    citations = [citation(*item) for item in top_items]
+    log_request("retrieve", started, text=req.query, top_k=req.top_k, cached=cached, citations=citations)
     return RetrieveResponse(contexts=contexts, citations=citations)
+
+
+@app.post("/answer", response_model=AnswerResponse)
+def answer(req: AnswerRequest):
+    """Retrieve, dedup and pack contexts into a token budget, then generate, in one request."""
+    require_llm()
+    started = time.perf_counter()
+    timings = {}
+
+    stage = time.perf_counter()
+    ranked = []
+    if documents and doc_embeddings is not None:
+        # Over-fetch so dropping duplicates still leaves top_k candidates.
+        candidates, _ = rank_documents(req.question, req.top_k * 2)
+        ranked = dedup_ranked(candidates, req.top_k)
+    timings["retrieve"] = round((time.perf_counter() - stage) * 1000, 2)
+
+    stage = time.perf_counter()
+    budget = ANSWER_CONTEXT_TOKENS if req.max_context_tokens is None else req.max_context_tokens
+    contexts, citations, context_tokens = pack_contexts(ranked, budget)
+    # Same input layout as the SFT data (train_sft.py), which the fine-tuned model expects.
+    user = json.dumps({"context": "\n\n".join(contexts), "user_question": req.question}, ensure_ascii=False, indent=2)
+    prompt = build_prompt(req.system or ANSWER_SYSTEM_PROMPT, user)
+    timings["pack"] = round((time.perf_counter() - stage) * 1000, 2)
+
+    stage = time.perf_counter()
+    content, prompt_tokens, completion_tokens = generate_from_prompt(prompt, req.max_new_tokens, req.temperature)
+    timings["generate"] = round((time.perf_counter() - stage) * 1000, 2)
+
+    stage = time.perf_counter()
+    content, report = guard_output(content)
+    timings["guard"] = round((time.perf_counter() - stage) * 1000, 2)
+    timings["total"] = round((time.perf_counter() - started) * 1000, 2)
+
+    usage = {
+        "context_tokens": context_tokens,
+        "context_budget": budget,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+    }
+    log_request(
+        "answer",
+        started,
+        text=req.question,
+        citations=citations,
+        compliant=report["compliant"] if report else None,
+        blocked=bool(report and report.get("blocked")),
+        timings_ms=timings,
+        **usage,
+    )
+    return AnswerResponse(answer=content, citations=citations, compliance=report, usage=usage, timings_ms=timings)
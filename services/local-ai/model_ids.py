@@ -0,0 +1,103 @@
+"""Model ids for the local AI service, shared with the offline scripts.
+
+Each id comes from its environment variable, else the first fine-tuned
+checkpoint under models/finetuned that exists, else the public base model.
+"""
+
+import hashlib
+import json
+import os
+from typing import List, Tuple
+
+BASE_DIR = os.path.dirname(__file__)
+MODEL_FILE_SUFFIXES = {".json", ".safetensors", ".bin", ".model", ".txt"}
+
+
+def resolve_model_id(env_var: str, default_id: str, *finetuned_rel_paths: str) -> str:
+    explicit = os.getenv(env_var)
+    if explicit:
+        return explicit
+    for finetuned_rel_path in finetuned_rel_paths:
+        finetuned_path = os.path.abspath(os.path.join(BASE_DIR, finetuned_rel_path))
+        if os.path.isdir(finetuned_path):
+            return finetuned_path
+    return default_id
+
+
+QWEN_MODEL_ID = resolve_model_id(
+    "QWEN_MODEL_ID",
+    "Qwen/Qwen2.5-1.5B-Instruct",
+    # Prefer the merged export (train/export_sft.py) over the raw LoRA adapter.
+    "../../models/finetuned/qwen-credit-sft-merged",
+    "../../models/finetuned/qwen-credit-sft",
+)
+# Draft model for speculative decoding; must share QWEN_MODEL_ID's tokenizer.
+QWEN_DRAFT_MODEL_ID = os.getenv("QWEN_DRAFT_MODEL_ID", "Qwen/Qwen2.5-0.5B-Instruct")
+DISTILBERT_MODEL_ID = resolve_model_id(
+    "DISTILBERT_MODEL_ID",
+    "distilbert-base-uncased",
+    "../../models/finetuned/distilbert-eligibility",
+)
+MINILM_MODEL_ID = resolve_model_id(
+    "MINILM_MODEL_ID",
+    "sentence-transformers/all-MiniLM-L6-v2",
+    "../../models/finetuned/minilm-embeddings",
+)
+
+
+# Written next to the weights by model_content_hash; not hashed itself (no MODEL_FILE_SUFFIXES suffix).
+CONTENT_HASH_FILE = ".content-hash"
+
+
+def model_files(model_id: str) -> List[Tuple[str, int, int]]:
+    """(relative path, size, mtime_ns) of the files model_content_hash reads, in hashing order."""
+    files = []
+    for root, dirs, names in os.walk(model_id):
+        dirs.sort()
+        for name in sorted(names):
+            if os.path.splitext(name)[1] not in MODEL_FILE_SUFFIXES:
+                continue
+            path = os.path.join(root, name)
+            stat = os.stat(path)
+            files.append((os.path.relpath(path, model_id), stat.st_size, stat.st_mtime_ns))
+    return files
+
+
+def model_content_hash(model_id: str) -> str:
+    """Content hash of a local model directory's config, tokenizer and weight files.
+
+    Hub ids that are not local directories hash to their name, since the
+    checkpoint behind them is not on disk to hash.
+
+    The hash is memoized in CONTENT_HASH_FILE, keyed by each file's path, size
+    and mtime, so only the first call after training or export reads the
+    weights. Any change to the files recomputes it.
+    """
+    if not os.path.isdir(model_id):
+        return hashlib.sha256(f"id:{model_id}".encode("utf-8")).hexdigest()
+    files = model_files(model_id)
+    fingerprint = [list(entry) for entry in files]
+    memo_path = os.path.join(model_id, CONTENT_HASH_FILE)
+    try:
+        with open(memo_path, "r", encoding="utf-8") as f:
+            memo = json.load(f)
+        if memo.get("files") == fingerprint:
+            return memo["sha256"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    digest = hashlib.sha256()
+    for relpath, _, _ in files:
+        digest.update(relpath.encode("utf-8"))
+        with open(os.path.join(model_id, relpath), "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    content_hash = digest.hexdigest()
+    try:
+        tmp = f"{memo_path}.tmp-{os.getpid()}"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"sha256": content_hash, "files": fingerprint}, f)
+        os.replace(tmp, memo_path)
+    except OSError:
+        pass  # read-only model directory: hash again next time
+    return content_hash
@@ -0,0 +1,268 @@
+"""MongoDB access for the local AI service.
+
+One ``Storage`` per process owns a pooled ``MongoClient``. Pool size and
+server-selection, connect and socket timeouts come from the environment (see
+``MongoSettings.from_env``). The endpoints never wait on MongoDB:
+- health is pinged by a background thread and read from a cached snapshot;
+- request logs are queued in memory and written by a flusher thread with
+  ``insert_many``, once ``log_batch_size`` entries are queued or every
+  ``log_flush_seconds``, whichever comes first. When the queue is full,
+  entries are dropped and counted rather than blocking a request.
+Async handlers can use ``async_database()``, a motor client with the same pool
+settings, when motor is installed.
+"""
+
+import hashlib
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from pymongo import ASCENDING, MongoClient
+from pymongo.errors import PyMongoError
+
+try:
+    from motor.motor_asyncio import AsyncIOMotorClient
+except ImportError:  # motor is optional; the sync client covers everything else
+    AsyncIOMotorClient = None
+
+
+def env_flag(name: str, default: str) -> bool:
+    return os.getenv(name, default).lower() == "true"
+
+
+@dataclass
+class MongoSettings:
+    uri: str
+    db: str = "credit_ai"
+    max_pool_size: int = 20
+    min_pool_size: int = 0
+    server_selection_timeout_ms: int = 2000
+    connect_timeout_ms: int = 2000
+    socket_timeout_ms: int = 5000
+    health_interval_seconds: float = 15.0
+    log_collection: str = "request_logs"
+    log_batch_size: int = 200
+    log_flush_seconds: float = 2.0
+    log_queue_size: int = 10000
+    # Store raw request text in logs; off by default (only its length and hash are stored).
+    log_text: bool = False
+    # Expire request logs after this many days via a TTL index; 0 keeps them.
+    log_ttl_days: int = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["MongoSettings"]:
+        uri = os.getenv("MONGODB_URI")
+        if not uri:
+            return None
+        return cls(
+            uri=uri,
+            db=os.getenv("MONGODB_DB", "credit_ai"),
+            max_pool_size=int(os.getenv("MONGODB_MAX_POOL_SIZE", "20")),
+            min_pool_size=int(os.getenv("MONGODB_MIN_POOL_SIZE", "0")),
+            server_selection_timeout_ms=int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "2000")),
+            connect_timeout_ms=int(os.getenv("MONGODB_CONNECT_TIMEOUT_MS", "2000")),
+            socket_timeout_ms=int(os.getenv("MONGODB_SOCKET_TIMEOUT_MS", "5000")),
+            health_interval_seconds=float(os.getenv("MONGODB_HEALTH_INTERVAL_SECONDS", "15")),
+            log_collection=os.getenv("REQUEST_LOG_COLLECTION", "request_logs"),
+            log_batch_size=int(os.getenv("REQUEST_LOG_BATCH_SIZE", "200")),
+            log_flush_seconds=float(os.getenv("REQUEST_LOG_FLUSH_SECONDS", "2")),
+            log_queue_size=int(os.getenv("REQUEST_LOG_QUEUE_SIZE", "10000")),
+            log_text=env_flag("REQUEST_LOG_TEXT", "false"),
+            log_ttl_days=int(os.getenv("REQUEST_LOG_TTL_DAYS", "0")),
+        )
+
+    def client_options(self) -> Dict[str, Any]:
+        return {
+            "maxPoolSize": self.max_pool_size,
+            "minPoolSize": self.min_pool_size,
+            "serverSelectionTimeoutMS": self.server_selection_timeout_ms,
+            "connectTimeoutMS": self.connect_timeout_ms,
+            "socketTimeoutMS": self.socket_timeout_ms,
+            "appname": "credit-ai-local",
+        }
+
+
+def text_fields(text: str, include_text: bool) -> Dict[str, Any]:
+    """How a request text appears in a log entry: always length and hash, the text itself if enabled."""
+    fields: Dict[str, Any] = {
+        "text_chars": len(text),
+        "text_sha256": hashlib.sha256(text.encode("utf-8")).hexdigest(),
+    }
+    if include_text:
+        fields["text"] = text
+    return fields
+
+
+class Storage:
+    def __init__(self, settings: MongoSettings, client: Optional[MongoClient] = None):
+        self.settings = settings
+        # MongoClient connects lazily, so constructing it never blocks startup.
+        self.client = client if client is not None else MongoClient(settings.uri, **settings.client_options())
+        self.db = self.client[settings.db]
+        self._async_client = None
+
+        self._health: Dict[str, Any] = {"status": "unknown", "checked_at": None}
+        self._health_lock = threading.Lock()
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=settings.log_queue_size)
+        self._stats = {"queued": 0, "written": 0, "dropped": 0, "failed_batches": 0}
+        self._stats_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._indexes_ready = False
+
+    def start(self) -> None:
+        for target, name in ((self._health_loop, "mongo-health"), (self._flush_loop, "mongo-request-log")):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Stop the background threads, write what is still queued and close the clients."""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        self.flush()
+        if self._async_client is not None:
+            self._async_client.close()
+        self.client.close()
+
+    def check_health(self) -> Dict[str, Any]:
+        """Ping the server now and update the cached snapshot."""
+        started = time.perf_counter()
+        snapshot: Dict[str, Any] = {"checked_at": datetime.now(timezone.utc).isoformat()}
+        try:
+            self.client.admin.command("ping")
+            snapshot.update(status="connected", latency_ms=round((time.perf_counter() - started) * 1000, 2))
+        except PyMongoError as exc:
+            snapshot.update(status="error", error=str(exc))
+        with self._health_lock:
+            self._health = snapshot
+        return dict(snapshot)
+
+    def health(self) -> Dict[str, Any]:
+        """Latest cached health snapshot; never touches the network."""
+        with self._health_lock:
+            return dict(self._health)
+
+    def _health_loop(self) -> None:
+        while not self._stop.is_set():
+            if self.check_health()["status"] == "connected" and not self._indexes_ready:
+                self.ensure_indexes()
+            self._stop.wait(self.settings.health_interval_seconds)
+
+    def ensure_indexes(self) -> None:
+        collection = self.db[self.settings.log_collection]
+        try:
+            collection.create_index([("endpoint", ASCENDING), ("created_at", ASCENDING)])
+            if self.settings.log_ttl_days > 0:
+                collection.create_index(
+                    "created_at", name="created_at_ttl", expireAfterSeconds=self.settings.log_ttl_days * 86400
+                )
+            self._indexes_ready = True
+        except PyMongoError as exc:
+            print(f"Could not create request log indexes: {exc}")
+
+    def async_database(self):
+        """Motor database handle for async handlers, or None when motor is not installed."""
+        if AsyncIOMotorClient is None:
+            return None
+        if self._async_client is None:
+            self._async_client = AsyncIOMotorClient(self.settings.uri, **self.settings.client_options())
+        return self._async_client[self.settings.db]
+
+    async def ping_async(self) -> Dict[str, Any]:
+        """Live ping through motor; falls back to the cached snapshot without it."""
+        database = self.async_database()
+        if database is None:
+            return self.health()
+        started = time.perf_counter()
+        try:
+            await database.command("ping")
+            return {"status": "connected", "latency_ms": round((time.perf_counter() - started) * 1000, 2)}
+        except PyMongoError as exc:
+            return {"status": "error", "error": str(exc)}
+
+    def log_request(self, endpoint: str, latency_ms: float, text: Optional[str] = None, **fields: Any) -> None:
+        """Queue one log entry; returns immediately and drops the entry if the queue is full."""
+        entry = {
+            "endpoint": endpoint,
+            "latency_ms": round(latency_ms, 3),
+            "created_at": datetime.now(timezone.utc),
+            **fields,
+        }
+        if text is not None:
+            entry.update(text_fields(text, self.settings.log_text))
+        try:
+            self._queue.put_nowait(entry)
+            self._count("queued")
+        except queue.Full:
+            self._count("dropped")
+
+    def flush(self) -> int:
+        """Write everything currently queued; returns the number of entries written."""
+        written = 0
+        while True:
+            batch = self._drain(self.settings.log_batch_size)
+            if not batch:
+                return written
+            written += self._write(batch)
+
+    def stats(self) -> Dict[str, int]:
+        with self._stats_lock:
+            return {**self._stats, "pending": self._queue.qsize()}
+
+    def _count(self, key: str, amount: int = 1) -> None:
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    def _drain(self, limit: int) -> List[Dict[str, Any]]:
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch: List[Dict[str, Any]]) -> int:
+        try:
+            self.db[self.settings.log_collection].insert_many(batch, ordered=False)
+        except PyMongoError as exc:
+            # Logs are best effort: a failed batch is counted and dropped, never retried forever.
+            self._count("failed_batches")
+            self._count("dropped", len(batch))
+            print(f"Dropped {len(batch)} request log entries: {exc}")
+            return 0
+        self._count("written", len(batch))
+        return len(batch)
+
+    def _flush_loop(self) -> None:
+        while not self._stop.is_set():
+            deadline = time.monotonic() + self.settings.log_flush_seconds
+            batch: List[Dict[str, Any]] = []
+            # Block for the first entry, then gather until the batch is full or the deadline passes.
+            while len(batch) < self.settings.log_batch_size and not self._stop.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=min(remaining, 0.5)))
+                except queue.Empty:
+                    continue
+            if batch:
+                self._write(batch)
+
+
+def connect_from_env() -> Optional[Storage]:
+    """Storage configured from MONGODB_* / REQUEST_LOG_* variables, started; None when MONGODB_URI is unset."""
+    settings = MongoSettings.from_env()
+    if settings is None:
+        return None
+    storage = Storage(settings)
+    storage.start()
+    return storage
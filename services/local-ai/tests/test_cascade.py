@@ -0,0 +1,130 @@
+import re
+
+import numpy as np
+import pytest
+
+import cascade
+
+LABELS = ["eligible", "conditionally_eligible", "not_eligible", "insufficient_information"]
+
+
+class ChatTokenizer:
+    """Whitespace tokenizer with Qwen-style chat markers as special tokens."""
+
+    SPECIAL = ("<|im_start|>", "<|im_end|>")
+
+    def __init__(self):
+        self.vocab = {token: idx for idx, token in enumerate(self.SPECIAL)}
+        self.tokens = list(self.SPECIAL)
+
+    def apply_chat_template(self, messages, tokenize=False, add_generation_prompt=True):
+        prompt = "".join(f"<|im_start|>{m['role']}\n{m['content']}<|im_end|>\n" for m in messages)
+        return prompt + "<|im_start|>assistant\n" if add_generation_prompt else prompt
+
+    def __call__(self, text, return_tensors=None):
+        ids = []
+        for token in re.findall(r"<\|im_(?:start|end)\|>|\S+", text):
+            if token not in self.vocab:
+                self.vocab[token] = len(self.tokens)
+                self.tokens.append(token)
+            ids.append(self.vocab[token])
+        return {"input_ids": np.array([ids])}
+
+    def decode(self, ids, skip_special_tokens=False):
+        tokens = [self.tokens[idx] for idx in ids]
+        if skip_special_tokens:
+            tokens = [token for token in tokens if token not in self.SPECIAL]
+        return " ".join(tokens)
+
+
+def echoing_generate(reply):
+    """generate(system, user) over a causal LM that, like generate(), returns the prompt ids before the reply."""
+    main = pytest.importorskip("main")
+    tokenizer = ChatTokenizer()
+
+    def generate(system, user):
+        prompt = tokenizer.apply_chat_template([{"role": "system", "content": system}, {"role": "user", "content": user}])
+        inputs = tokenizer(prompt)
+        outputs = np.concatenate([inputs["input_ids"], tokenizer(reply)["input_ids"]], axis=1)
+        text, prompt_tokens, new_tokens = main.decode_completion(tokenizer, inputs, outputs)
+        assert (prompt_tokens, new_tokens) == (inputs["input_ids"].shape[1], len(reply.split()))
+        return text
+
+    return generate
+
+
+def build(head_threshold, bert_probs, llm=None, llm_threshold=0.0):
+    head = cascade.LinearHead(np.eye(4, dtype=np.float32), np.zeros(4, dtype=np.float32), LABELS, head_threshold, "h")
+    return cascade.ClassificationCascade(
+        head,
+        embed=lambda texts: np.array([[4.0, 0.0, 0.0, 0.0]]),
+        classify=lambda text: (LABELS, np.asarray(bert_probs)),
+        llm=llm,
+        llm_threshold=llm_threshold,
+    )
+
+
+def test_linear_stage_answers_above_threshold():
+    result = build(0.5, [0.0, 0.0, 1.0, 0.0]).classify("text")
+    assert result[0] == "eligible" and result[2] == "linear"
+
+
+def test_low_confidence_escalates_to_distilbert():
+    cascade_ = build(float("inf"), [0.1, 0.1, 0.7, 0.1])
+    assert cascade_.classify("text") == ("not_eligible", pytest.approx(0.7), "distilbert")
+    stages = cascade_.stats()["stages"]
+    assert stages["linear"]["escalation_rate"] == 1.0
+    assert stages["distilbert"]["answered"] == 1
+
+
+def test_llm_stage_reads_the_reply_not_the_echoed_prompt():
+    # The system prompt lists every label, "eligible" first; only the reply may be parsed.
+    llm = cascade.llm_labeler(echoing_generate("not_eligible"), LABELS)
+    cascade_ = build(float("inf"), [0.3, 0.25, 0.25, 0.2], llm=llm, llm_threshold=0.6)
+    label, confidence, stage = cascade_.classify("Account reported late in March, paid on time per statement.")
+    assert (label, stage) == ("not_eligible", "llm")
+    assert confidence == pytest.approx(0.25)
+    assert cascade_.stats()["stages"]["llm"]["answered"] == 1
+
+
+def test_unparseable_llm_reply_keeps_distilbert_answer():
+    llm = cascade.llm_labeler(lambda system, user: "I cannot tell.", LABELS)
+    cascade_ = build(float("inf"), [0.3, 0.25, 0.25, 0.2], llm=llm, llm_threshold=0.6)
+    assert cascade_.classify("text")[::2] == ("eligible", "distilbert")
+    assert cascade_.stats()["stages"]["llm"]["answered"] == 0
+
+
+def test_parse_llm_label_prefers_earliest_and_longest():
+    assert cascade.parse_llm_label("Not eligible.", LABELS) == "not_eligible"
+    assert cascade.parse_llm_label("conditionally-eligible, maybe eligible", LABELS) == "conditionally_eligible"
+    assert cascade.parse_llm_label("no idea", LABELS) is None
+
+
+def test_disabled_linear_stage_skips_the_embedding():
+    def embed(texts):
+        raise AssertionError("the linear stage should not run")
+
+    cascade_ = build(float("inf"), [0.1, 0.1, 0.7, 0.1])
+    cascade_.embed, cascade_.linear = embed, False
+    assert cascade_.classify("text") == ("not_eligible", pytest.approx(0.7), "distilbert")
+    stats = cascade_.stats()
+    assert stats["requests"] == 1 and stats["threshold"] is None
+    assert stats["stages"]["linear"]["reached"] == 0
+
+
+def test_uncalibrated_head_is_not_used_without_an_override(tmp_path, monkeypatch):
+    main = pytest.importorskip("main")
+    pytest.importorskip("torch")  # build_cascade imports classifier
+    head_path = str(tmp_path / cascade.HEAD_FILE)
+    head = cascade.LinearHead(
+        np.eye(4, dtype=np.float32), np.zeros(4, dtype=np.float32), LABELS, float("inf"),
+        main.model_content_hash(main.MINILM_MODEL_ID),
+    )
+    head.save(head_path)
+    monkeypatch.setattr(main, "CASCADE_HEAD_PATH", head_path)
+    monkeypatch.setattr(main, "CASCADE_LLM", False)
+    assert main.build_cascade() is None
+
+    monkeypatch.setattr(main, "CASCADE_THRESHOLD", 0.9)
+    cascade_ = main.build_cascade()
+    assert cascade_.linear and cascade_.threshold == 0.9
@@ -0,0 +1,59 @@
+import pytest
+
+import compliance
+
+TEXTS = [
+    "Results may vary. This is for educational purposes and not financial advice.",
+    "We offer a 100% guarantee to DELETE ALL NEGATIVE ITEMS with our secret method.",
+    "You should sue the bureau.",
+    "You could take legal action; talk to an attorney first.",
+    "Consult a lawyer. Consult with a professional. Quick fix, overnight results!",
+    "",
+]
+
+
+@pytest.fixture(params=["automaton", "regex"])
+def backend(request, monkeypatch):
+    """Which single-pass matcher PhraseMatcher builds: pyahocorasick, or the regex fallback without it."""
+    if request.param == "automaton":
+        pytest.importorskip("ahocorasick")
+    else:
+        monkeypatch.setattr(compliance, "ahocorasick", None)
+    return request.param
+
+
+def assert_backend(matcher, backend):
+    assert (matcher.automaton is not None) == (backend == "automaton")
+    assert (matcher.pattern is not None) == (backend == "regex")
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_substring_and_single_pass_scans_agree(text, backend):
+    substring = compliance.ComplianceScanner(automaton_min_phrases=10**6)
+    automaton = compliance.ComplianceScanner(automaton_min_phrases=0)
+    assert substring.matcher is None
+    assert_backend(automaton.matcher, backend)
+    assert substring.scan(text) == automaton.scan(text)
+    assert substring.violations(text) == automaton.violations(text) == substring.scan(text).violations
+
+
+def test_default_scanner_uses_substring_checks_for_small_lists():
+    assert compliance.DEFAULT_SCANNER.matcher is None
+    compliant, violations = compliance.check_hallucination("A 100% guarantee you will be approved.")
+    assert not compliant
+    assert violations == ["Forbidden phrase: '100% guarantee'", "Unrealistic guarantee detected"]
+
+
+def test_large_lists_use_a_single_pass_matcher(backend):
+    phrases = compliance.FORBIDDEN_PHRASES + [f"banned phrase {idx}" for idx in range(compliance.AUTOMATON_MIN_PHRASES)]
+    scanner = compliance.ComplianceScanner(forbidden_phrases=phrases)
+    assert_backend(scanner.matcher, backend)
+    assert scanner.violations("this has Banned Phrase 7 in it") == ["Forbidden phrase: 'banned phrase 7'"]
+
+
+def test_matcher_finds_overlapping_and_nested_phrases(backend):
+    matcher = compliance.PhraseMatcher(["guarantee", "100% guarantee", "sue", "pursue", "a.b"])
+    assert_backend(matcher, backend)
+    assert matcher.find("we pursue a 100% guarantee") == {"guarantee", "100% guarantee", "sue", "pursue"}
+    assert matcher.find("axb") == set()
+    assert compliance.PhraseMatcher([]).find("anything") == set()
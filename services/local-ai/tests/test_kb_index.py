@@ -0,0 +1,67 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+import kb_index
+from model_ids import CONTENT_HASH_FILE, model_content_hash
+
+
+def publish(root, model_dir):
+    chunks = [{"text": "charge-off", "source": "a.md", "tokens": 3, "hash": kb_index.content_hash("charge-off")}]
+    return kb_index.publish_index(
+        str(root), chunks, np.ones((1, 4), dtype=np.float32), str(model_dir), {"max_tokens": 254, "overlap_tokens": 32}
+    )
+
+
+def test_index_is_keyed_on_the_embedder_content(tmp_path):
+    model_dir = tmp_path / "minilm"
+    model_dir.mkdir()
+    (model_dir / "config.json").write_text('{"hidden_size": 4}')
+    publish(tmp_path / "index", model_dir)
+
+    loaded = kb_index.load_index(str(tmp_path / "index"), model_content_hash(str(model_dir)))
+    assert loaded is not None and loaded[2]["model_id"] == str(model_dir)
+    # Another id for the same files still matches; the hub id of the base model does not.
+    copy = tmp_path / "copy"
+    copy.mkdir()
+    (copy / "config.json").write_text('{"hidden_size": 4}')
+    assert kb_index.load_index(str(tmp_path / "index"), model_content_hash(str(copy))) is not None
+    assert kb_index.load_index(str(tmp_path / "index"), model_content_hash("sentence-transformers/all-MiniLM-L6-v2")) is None
+
+    # Retrained in place: same path, different weights.
+    (model_dir / "model.safetensors").write_bytes(b"new weights")
+    assert kb_index.load_index(str(tmp_path / "index"), model_content_hash(str(model_dir))) is None
+    assert kb_index.cached_embeddings(str(tmp_path / "index"), model_content_hash(str(model_dir))) == {}
+
+
+def test_content_hash_is_memoized_until_the_files_change(tmp_path):
+    model_dir = tmp_path / "minilm"
+    model_dir.mkdir()
+    (model_dir / "config.json").write_text('{"hidden_size": 4}')
+    first = model_content_hash(str(model_dir))
+    assert (model_dir / CONTENT_HASH_FILE).exists()
+
+    # A stale memo with the current fingerprint is trusted, so a second call does not read the weights.
+    memo = json.loads((model_dir / CONTENT_HASH_FILE).read_text())
+    (model_dir / CONTENT_HASH_FILE).write_text(json.dumps({**memo, "sha256": "memoized"}))
+    assert model_content_hash(str(model_dir)) == "memoized"
+
+    (model_dir / "config.json").write_text('{"hidden_size": 8}')
+    assert model_content_hash(str(model_dir)) not in ("memoized", first)
+
+
+def test_size_check_rejects_a_truncated_index(tmp_path):
+    model_dir = tmp_path / "minilm"
+    model_dir.mkdir()
+    version_dir = publish(tmp_path / "index", model_dir)
+    model_hash = model_content_hash(str(model_dir))
+    with open(os.path.join(version_dir, kb_index.CHUNKS_FILE), "a", encoding="utf-8") as f:
+        f.write("\n")
+
+    assert kb_index.load_index(str(tmp_path / "index"), model_hash, verify="off") is not None
+    with pytest.raises(ValueError, match="Size mismatch"):
+        kb_index.load_index(str(tmp_path / "index"), model_hash)
+    with pytest.raises(ValueError, match="Checksum mismatch"):
+        kb_index.load_index(str(tmp_path / "index"), model_hash, verify="full")
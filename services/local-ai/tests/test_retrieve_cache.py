@@ -0,0 +1,34 @@
+import types
+
+import numpy as np
+import pytest
+
+
+class Embedder:
+    """Stands in for the MiniLM SentenceTransformer; counts encode calls."""
+
+    def __init__(self, do_lower_case):
+        self.tokenizer = types.SimpleNamespace(do_lower_case=do_lower_case)
+        self.calls = 0
+
+    def encode(self, texts, normalize_embeddings=True):
+        self.calls += 1
+        return np.ones((len(texts), 2), dtype=np.float32) / np.sqrt(2)
+
+
+@pytest.mark.parametrize("do_lower_case, encodes", [(True, 1), (False, 2)])
+def test_retrieve_cache_folds_case_only_for_uncased_tokenizers(monkeypatch, do_lower_case, encodes):
+    main = pytest.importorskip("main")
+    embedder = Embedder(do_lower_case)
+    monkeypatch.setattr(main, "minilm_model", embedder)
+    monkeypatch.setattr(main, "MINILM_CONTENT_HASH", "minilm")
+    monkeypatch.setattr(main, "doc_embeddings", embedder.encode(["chunk"]))
+    monkeypatch.setattr(main, "doc_tokens", [{"fcra"}])
+    monkeypatch.setattr(main, "retrieve_cache", main.cache.LRUCache(8))
+
+    embedder.calls = 0
+    ranked, cached = main.rank_documents("What is the FCRA?", 1)
+    assert [idx for idx, *_ in ranked] == [0] and not cached
+    assert main.rank_documents(" What  is the FCRA?", 1)[1] is True  # whitespace never matters
+    main.rank_documents("what is the fcra?", 1)
+    assert embedder.calls == encodes
@@ -0,0 +1,58 @@
+import os
+import sys
+
+import pytest
+
+for module in ("torch", "datasets", "peft", "transformers", "trl"):
+    pytest.importorskip(module)
+
+import torch  # noqa: E402
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "train")))
+
+import train_sft  # noqa: E402
+
+
+def block_causal(sizes, width):
+    """Allowed-attention matrix: causal within each example, nothing across examples or into padding."""
+    allowed = torch.zeros((width, width), dtype=torch.bool)
+    start = 0
+    for size in sizes:
+        allowed[start : start + size, start : start + size] = torch.ones((size, size), dtype=torch.bool).tril()
+        start += size
+    return allowed
+
+
+def test_pack_sequences_places_every_example_once_within_capacity():
+    lengths = [7, 3, 5, 2, 8, 1, 4]
+    rows = train_sft.pack_sequences(lengths, capacity=8)
+    assert sorted(idx for row in rows for idx in row) == list(range(len(lengths)))
+    assert all(sum(lengths[idx] for idx in row) <= 8 for row in rows)
+    assert len(rows) == 4  # 30 tokens cannot fit in fewer rows of 8
+    # An example longer than a row gets a row of its own (it is truncated when packed).
+    assert train_sft.pack_sequences([10, 2], capacity=8) == [[0], [1]]
+
+
+def test_collator_isolates_documents():
+    features = [
+        {"input_ids": [11, 12, 13, 21, 22], "position_ids": [0, 1, 2, 0, 1]},
+        {"input_ids": [31, 32], "position_ids": [0, 1]},
+    ]
+    batch = train_sft.PackedSequenceCollator(pad_token_id=0)(features)
+    allowed = batch["attention_mask"][:, 0] == 0
+
+    # No token attends to another document or to padding.
+    assert torch.equal(allowed[0], block_causal([3, 2], 5))
+    assert torch.equal(allowed[1], block_causal([2], 5))
+    # Positions restart at every document; padding gets position 0.
+    assert batch["position_ids"].tolist() == [[0, 1, 2, 0, 1], [0, 1, 0, 0, 0]]
+    # The first token of each document and all padding are left out of the loss.
+    assert batch["labels"].tolist() == [[-100, 12, 13, -100, 22], [-100, 32, -100, -100, -100]]
+    assert batch["input_ids"].tolist() == [[11, 12, 13, 21, 22], [31, 32, 0, 0, 0]]
+
+
+def test_packed_dataset_restarts_positions_per_example():
+    dataset = train_sft.Dataset.from_dict({"input_ids": [[1, 2, 3], [4, 5], [6, 7, 8, 9, 10]]})
+    packed = train_sft.build_packed_dataset(dataset, capacity=5)
+    rows = {tuple(ids): positions for ids, positions in zip(packed["input_ids"], packed["position_ids"])}
+    assert rows == {(6, 7, 8, 9, 10): [0, 1, 2, 3, 4], (1, 2, 3, 4, 5): [0, 1, 2, 0, 1]}
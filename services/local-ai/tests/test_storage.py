@@ -0,0 +1,131 @@
+import time
+
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+pytest.importorskip("pymongo")
+
+from pymongo.errors import ServerSelectionTimeoutError  # noqa: E402
+
+import cache  # noqa: E402
+from storage import MongoSettings, Storage  # noqa: E402
+
+
+def make_storage(**overrides):
+    settings = MongoSettings(uri="mongodb://test", health_interval_seconds=60, **overrides)
+    return Storage(settings, client=mongomock.MongoClient())
+
+
+@pytest.fixture
+def batches(monkeypatch):
+    """Sizes of the insert_many calls made against mongomock."""
+    sizes = []
+    insert_many = mongomock.collection.Collection.insert_many
+
+    def recording(self, documents, *args, **kwargs):
+        documents = list(documents)
+        sizes.append(len(documents))
+        return insert_many(self, documents, *args, **kwargs)
+
+    monkeypatch.setattr(mongomock.collection.Collection, "insert_many", recording)
+    return sizes
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.01)
+
+
+def test_flushes_full_batches_without_waiting_for_the_interval(batches):
+    storage = make_storage(log_batch_size=5, log_flush_seconds=30)
+    storage.start()
+    for idx in range(12):
+        storage.log_request("/classify", 1.0, text=f"text {idx}")
+    wait_for(lambda: storage.stats()["written"] == 10)
+    assert batches == [5, 5]
+    storage.close()
+    assert batches == [5, 5, 2]
+    assert storage.stats() == {"queued": 12, "written": 12, "dropped": 0, "failed_batches": 0, "pending": 0}
+    assert storage.db["request_logs"].count_documents({}) == 12
+
+
+def test_flushes_a_partial_batch_after_the_interval(batches):
+    storage = make_storage(log_batch_size=100, log_flush_seconds=0.2)
+    storage.start()
+    started = time.monotonic()
+    for idx in range(3):
+        storage.log_request("/embed", 2.0, count=idx)
+    wait_for(lambda: storage.stats()["written"] == 3)
+    assert time.monotonic() - started < 2
+    assert batches == [3]
+    storage.close()
+
+
+def test_log_entries_store_text_hash_not_text():
+    storage = make_storage()
+    storage.log_request("/classify", 1.23456, text="secret tradeline", label="eligible")
+    assert storage.flush() == 1
+    entry = storage.db["request_logs"].find_one()
+    assert entry["latency_ms"] == 1.235 and entry["label"] == "eligible"
+    assert entry["text_chars"] == len("secret tradeline") and "text" not in entry
+
+
+def test_full_queue_drops_and_counts_instead_of_blocking():
+    storage = make_storage(log_queue_size=3)
+    started = time.monotonic()
+    for _ in range(10):
+        storage.log_request("/classify", 1.0)
+    assert time.monotonic() - started < 1
+    assert storage.stats() == {"queued": 3, "written": 0, "dropped": 7, "failed_batches": 0, "pending": 3}
+    assert storage.flush() == 3
+
+
+def test_health_is_served_from_the_cached_snapshot(monkeypatch):
+    storage = make_storage()
+    assert storage.health()["status"] == "unknown"
+    assert storage.check_health()["status"] == "connected"
+
+    def unreachable(*args, **kwargs):
+        raise ServerSelectionTimeoutError("no servers")
+
+    monkeypatch.setattr(storage.client.admin, "command", unreachable)
+    # health() never pings; it keeps returning the last snapshot until the next check.
+    cached = storage.health()
+    assert cached["status"] == "connected" and "latency_ms" in cached
+    assert storage.check_health()["status"] == "error"
+    assert storage.health()["error"] == "no servers"
+
+
+def test_tiered_cache_over_mongo_store():
+    collection = mongomock.MongoClient()["credit_ai"]["classify_cache"]
+    collection.insert_many(
+        [
+            {"_id": "stale", "model": "old-model", "value": ["eligible", 0.9]},
+            {"_id": "kept", "model": "new-model", "value": ["not_eligible", 0.8]},
+        ]
+    )
+    tiered = cache.TieredCache(cache.LRUCache(16), cache.MongoResultStore(collection, "new-model"))
+    # Results of any other model are purged when the store opens.
+    assert [doc["_id"] for doc in collection.find()] == ["kept"]
+    assert tiered.get("stale") is None
+
+    key = cache.result_key("new-model", "Late payment  reported", lowercase=True)
+    tiered.put(key, ["conditionally_eligible", 0.7])
+    tiered.close()  # waits for the background write
+    assert collection.find_one({"_id": key}) == {
+        "_id": key,
+        "model": "new-model",
+        "value": ["conditionally_eligible", 0.7],
+    }
+
+    # A fresh process: LRU miss, store hit, promoted into the LRU.
+    restarted = cache.TieredCache(cache.LRUCache(16), cache.MongoResultStore(collection, "new-model"))
+    assert restarted.get(key) == ["conditionally_eligible", 0.7]
+    assert restarted.get(key) == ["conditionally_eligible", 0.7]
+    stats = restarted.stats()
+    assert (stats["hits"], stats["misses"], stats["store_hits"]) == (1, 1, 1)
+    assert stats["backend"] == "MongoResultStore"
+    restarted.close()
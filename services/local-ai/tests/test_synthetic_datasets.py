@@ -0,0 +1,61 @@
+import json
+import os
+import sys
+
+import pytest
+
+DATA_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..", "data", "finetune"))
+sys.path.insert(0, DATA_DIR)
+
+import generate_synthetic_datasets as generator  # noqa: E402
+
+
+def read_jsonl(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def texts(rows, fields):
+    return {generator.normalize_text(row[field]) for row in rows for field in fields}
+
+
+def assert_disjoint(split_rows, fields):
+    names = list(split_rows)
+    for idx, first in enumerate(names):
+        for second in names[idx + 1 :]:
+            shared = texts(split_rows[first], fields) & texts(split_rows[second], fields)
+            assert not shared, f"{first} and {second} share {len(shared)} texts, e.g. {sorted(shared)[0]!r}"
+
+
+def test_text_components_join_texts_through_shared_rows(tmp_path):
+    path = tmp_path / "pairs.jsonl"
+    rows = [("a", "B"), ("b", "c"), ("d", "e"), ("f", "f")]
+    path.write_text("".join(json.dumps({"text_1": x, "text_2": y}) + "\n" for x, y in rows), encoding="utf-8")
+    components = generator.text_components([str(path)], ("text_1", "text_2"))
+    assert components["a"] == components["b"] == components["c"]
+    assert components["d"] == components["e"] != components["a"]
+    assert len(set(components.values())) == 3
+
+
+@pytest.mark.parametrize("seed", [1, 42])
+def test_embedding_splits_share_no_text(tmp_path, monkeypatch, seed):
+    monkeypatch.setattr(generator, "BASE_DIR", str(tmp_path))
+    report = generator.generate_dataset("embedding", 2000, seed, None, str(tmp_path))
+    files = [filename for filename, _ in generator.DATASETS["embedding"][1]]
+    splits = {filename.rsplit(".", 2)[-2]: read_jsonl(tmp_path / filename) for filename in files}
+    assert splits["valid"], report
+    assert {row["label"] for row in splits["valid"]} == {0, 1}
+    assert_disjoint(splits, ("text_1", "text_2"))
+    # Eval splits drop repeated rows by default.
+    assert report["splits"]["valid"]["rows"] == report["splits"]["valid"]["unique"]
+
+
+@pytest.mark.parametrize(
+    "name,fields",
+    [("embedding", ("text_1", "text_2")), ("classifier", ("text",))],
+)
+def test_checked_in_splits_share_no_text(name, fields):
+    files = generator.DATASETS[name][1]
+    splits = {filename: read_jsonl(os.path.join(DATA_DIR, filename)) for filename, _ in files}
+    assert all(splits.values())
+    assert_disjoint(splits, fields)
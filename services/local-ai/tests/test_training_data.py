@@ -0,0 +1,72 @@
+import json
+import os
+
+import pytest
+
+import training_data
+
+
+def write_jsonl(path, rows):
+    with open(path, "w", encoding="utf-8") as f:
+        for row in rows:
+            f.write((row if isinstance(row, str) else json.dumps(row)) + "\n")
+    return str(path)
+
+
+PAIRS = [
+    {"text_1": "What is a charge-off?", "text_2": "A charge-off is a debt written off as a loss.", "label": 1.0},
+    {"query": "How long do late payments stay?", "document": "Late payments stay for seven years.", "score": 0},
+]
+
+
+def test_convert_jsonl_rejects_a_bad_row_with_file_and_line(tmp_path):
+    path = write_jsonl(
+        tmp_path / "model2_classifier.train.jsonl",
+        [{"text": "Fine", "label": "eligible"}, "", {"text": "Bad", "label": "maybe"}],
+    )
+    with pytest.raises(training_data.SchemaError, match=rf"{path}:3: unknown label 'maybe'"):
+        training_data.convert_jsonl(path)
+    assert not os.path.exists(training_data.columnar_path(path))
+    assert not os.listdir(tmp_path / training_data.COLUMNAR_DIR)
+
+
+def test_arrow_copy_goes_stale_when_the_jsonl_changes(tmp_path):
+    path = write_jsonl(tmp_path / "model3_pairs.train.jsonl", PAIRS)
+    assert not training_data.is_current(path)
+    training_data.convert_jsonl(path)
+    assert training_data.is_current(path)
+    assert training_data.resolve([path]) == [training_data.columnar_path(path)]
+
+    write_jsonl(path, PAIRS[:1])
+    assert not training_data.is_current(path)
+    assert training_data.resolve([path]) == [path]
+
+
+def test_load_table_has_canonical_columns_from_jsonl_and_arrow(tmp_path):
+    path = write_jsonl(tmp_path / "model3_pairs.train.jsonl", PAIRS)
+    from_jsonl = training_data.load_table(path)
+    training_data.convert_jsonl(path)
+    from_arrow = training_data.load_table(path)
+
+    for table in (from_jsonl, from_arrow):
+        assert table.column_names == ["text_1", "text_2", "label"]
+        assert table.column("text_2").to_pylist() == [PAIRS[0]["text_2"], PAIRS[1]["document"]]
+        assert table.column("label").to_pylist() == [1.0, 0.0]
+    assert training_data.load_table(str(tmp_path / "model3_pairs.test.jsonl")).num_rows == 0
+
+
+def test_load_dataset_dict_reads_jsonl_unless_every_split_is_current(tmp_path):
+    pytest.importorskip("datasets")
+    train = write_jsonl(tmp_path / "model3_pairs.train.jsonl", PAIRS)
+    valid = write_jsonl(tmp_path / "model3_pairs.valid.jsonl", PAIRS[:1])
+    training_data.convert_jsonl(train)
+
+    # One stale split sends both to JSONL, whose raw keys are not mapped onto the schema.
+    mixed = training_data.load_dataset_dict({"train": [train], "validation": [valid]})
+    assert "query" in mixed["train"].column_names
+    assert training_data.columnar_path(train) not in [cache["filename"] for cache in mixed["train"].cache_files]
+
+    training_data.convert_jsonl(valid)
+    columnar = training_data.load_dataset_dict({"train": [train], "validation": [valid]})
+    assert [cache["filename"] for cache in columnar["validation"].cache_files] == [training_data.columnar_path(valid)]
+    assert columnar["train"].column_names == columnar["validation"].column_names == ["text_1", "text_2", "label"]
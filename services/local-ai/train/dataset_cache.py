@@ -0,0 +1,118 @@
+"""Persistent cache of tokenized training datasets.
+
+Templating and tokenizing the JSONL files dominates start-up time of the
+training scripts. The result of ``preprocess`` is saved with
+``DatasetDict.save_to_disk`` under a key built from:
+- the content hashes of the data files;
+- the tokenizer id and vocabulary size, plus a hash of its chat template;
+- ``max_length`` and any extra parameters the caller passes.
+JSONL files with a current Arrow copy (see training_data.py) are read from
+that copy by memory mapping, and the key hashes the Arrow files instead.
+Later runs with the same inputs ``load_from_disk`` the memory-mapped Arrow
+files instead. On a cache miss, batched preprocessing runs with ``num_proc``
+worker processes.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+from typing import Any, Callable, Dict, List, Optional
+
+from datasets import DatasetDict, load_from_disk
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import training_data  # noqa: E402
+
+CACHE_FORMAT_VERSION = 1
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def tokenizer_fingerprint(tokenizer) -> Dict[str, Any]:
+    chat_template = getattr(tokenizer, "chat_template", None) or ""
+    return {
+        "id": tokenizer.name_or_path,
+        "class": type(tokenizer).__name__,
+        "vocab_size": len(tokenizer),
+        "chat_template": hashlib.sha256(str(chat_template).encode("utf-8")).hexdigest(),
+    }
+
+
+def cache_key(
+    name: str,
+    data_files: Dict[str, List[str]],
+    tokenizer,
+    max_length: int,
+    extra: Optional[Dict[str, Any]] = None,
+) -> str:
+    payload = {
+        "format": CACHE_FORMAT_VERSION,
+        "name": name,
+        "files": {split: [file_sha256(path) for path in paths] for split, paths in sorted(data_files.items())},
+        "tokenizer": tokenizer_fingerprint(tokenizer),
+        "max_length": max_length,
+        "extra": extra or {},
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def load_tokenized(
+    name: str,
+    data_files: Dict[str, List[str]],
+    tokenizer,
+    max_length: int,
+    preprocess: Callable[[Dict[str, List[Any]]], Dict[str, List[Any]]],
+    cache_dir: Optional[str],
+    num_proc: Optional[int] = None,
+    extra: Optional[Dict[str, Any]] = None,
+) -> DatasetDict:
+    """Return the JSONL ``data_files`` mapped through batched ``preprocess``, cached on disk.
+
+    ``extra`` must capture every other setting ``preprocess`` depends on (label
+    sets, field names, a preprocessing version), since the function itself is
+    not part of the key. ``cache_dir=None`` disables the cache.
+    """
+    num_proc = num_proc if num_proc is not None else max((os.cpu_count() or 1) - 1, 1)
+    resolved = {split: training_data.resolve(list(paths)) for split, paths in data_files.items()}
+    target = None
+    if cache_dir:
+        key = cache_key(name, resolved, tokenizer, max_length, extra)
+        target = os.path.join(cache_dir, f"{name}-{key[:16]}")
+        if os.path.isdir(target):
+            print(f"Loading tokenized dataset from cache {target}")
+            return load_from_disk(target)
+
+    dataset = training_data.load_dataset_dict(data_files)
+    if num_proc > 1:
+        # Fast tokenizers would otherwise fight the worker processes for cores.
+        os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    smallest = min(len(split) for split in dataset.values())
+    dataset = dataset.map(
+        preprocess,
+        batched=True,
+        num_proc=min(num_proc, smallest) if smallest > 1 else None,
+        remove_columns=dataset[next(iter(dataset))].column_names,
+        desc=f"Tokenizing {name}",
+    )
+
+    if target:
+        staging = f"{target}.tmp-{os.getpid()}"
+        shutil.rmtree(staging, ignore_errors=True)
+        dataset.save_to_disk(staging)
+        try:
+            os.replace(staging, target)
+        except OSError:
+            # Another run published the same key first; its copy is identical.
+            shutil.rmtree(staging, ignore_errors=True)
+        print(f"Cached tokenized dataset at {target}")
+        return load_from_disk(target)
+    return dataset
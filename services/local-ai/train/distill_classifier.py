@@ -0,0 +1,301 @@
+import json
+import os
+import random
+import re
+import sys
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from datasets import Dataset
+from transformers import (AutoConfig, AutoModelForSequenceClassification, AutoTokenizer,
+                          DataCollatorWithPadding, Trainer, TrainingArguments)
+
+from train_classifier import Config, load_config, make_compute_metrics, tokenized_splits
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import classifier  # noqa: E402
+import training_data  # noqa: E402
+from model_ids import model_content_hash  # noqa: E402
+
+LAYER_KEY_RE = re.compile(r"\.layer\.(\d+)\.")
+
+
+@dataclass
+class DistillConfig(Config):
+    # model_id is the fine-tuned teacher. The student is either a smaller
+    # pretrained checkpoint (student_model_id, e.g. a 4-layer/256-hidden BERT
+    # with the same uncased vocabulary) or the teacher cut to student_layers
+    # layers, initialised from evenly spaced teacher layers.
+    student_model_id: Optional[str] = None
+    student_layers: int = 2
+    temperature: float = 2.0
+    # Weight of the soft-target KL term; the rest goes to cross-entropy on gold labels.
+    alpha: float = 0.7
+    # Augmented copies per training example, labelled only by the teacher's soft logits.
+    augment_copies: int = 2
+    teacher_batch_size: int = 64
+    latency_samples: int = 200
+
+
+def augment_text(text: str, rng: random.Random) -> str:
+    """Perturb a tradeline description while keeping it plausible.
+
+    Structured "Key: Value | Key: Value" records get their fields shuffled and
+    occasionally one dropped; free text gets word dropout. The teacher relabels
+    the result, so a perturbation that changes the answer is still a valid target.
+    """
+    fields = [field.strip() for field in text.split("|") if field.strip()]
+    if len(fields) > 1:
+        rng.shuffle(fields)
+        if len(fields) > 2 and rng.random() < 0.3:
+            fields.pop(rng.randrange(len(fields)))
+        augmented = " | ".join(fields)
+    else:
+        words = text.split()
+        kept = [word for word in words if rng.random() > 0.1] or words
+        augmented = " ".join(kept)
+    return augmented.lower() if rng.random() < 0.2 else augmented
+
+
+def build_student(cfg: DistillConfig, teacher, label2id: Dict[str, int], id2label: Dict[int, str]):
+    if cfg.student_model_id:
+        return AutoModelForSequenceClassification.from_pretrained(
+            cfg.student_model_id,
+            num_labels=len(cfg.labels),
+            id2label=id2label,
+            label2id=label2id,
+        )
+
+    config = AutoConfig.from_pretrained(cfg.model_id)
+    layer_attr = "n_layers" if hasattr(config, "n_layers") else "num_hidden_layers"
+    teacher_layers = getattr(config, layer_attr)
+    keep = sorted({int(round(idx)) for idx in np.linspace(0, teacher_layers - 1, cfg.student_layers)})
+    setattr(config, layer_attr, len(keep))
+    student = AutoModelForSequenceClassification.from_config(config)
+
+    # Copy embeddings, head and the selected layers (renumbered) from the teacher.
+    mapping = {old: new for new, old in enumerate(keep)}
+    state = {}
+    for key, value in teacher.state_dict().items():
+        match = LAYER_KEY_RE.search(key)
+        if match is None:
+            state[key] = value
+        elif int(match.group(1)) in mapping:
+            state[LAYER_KEY_RE.sub(f".layer.{mapping[int(match.group(1))]}.", key, count=1)] = value
+    missing, unexpected = student.load_state_dict(state, strict=False)
+    if missing or unexpected:
+        print(f"Student init: {len(missing)} missing, {len(unexpected)} unexpected keys")
+    print(f"Student keeps teacher layers {keep} of {teacher_layers}")
+    return student
+
+
+def teacher_logits(teacher, tokenizer, texts: List[str], cfg: DistillConfig, device: str) -> np.ndarray:
+    order = np.argsort([len(text) for text in texts], kind="stable")
+    logits = np.zeros((len(texts), len(cfg.labels)), dtype=np.float32)
+    for start in range(0, len(order), cfg.teacher_batch_size):
+        batch = order[start : start + cfg.teacher_batch_size]
+        logits[batch] = classifier.predict_logits(
+            tokenizer, teacher, [texts[idx] for idx in batch], device, cfg.max_length
+        ).cpu().numpy()
+    return logits
+
+
+class DistillationTrainer(Trainer):
+    def __init__(self, *args, temperature: float = 2.0, alpha: float = 0.7, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.temperature = temperature
+        self.alpha = alpha
+
+    def compute_loss(self, model, inputs, return_outputs=False, **kwargs):
+        labels = inputs.pop("labels")
+        soft_targets = inputs.pop("teacher_logits", None)
+        outputs = model(**inputs)
+        logits = outputs.logits
+
+        labelled = labels >= 0
+        loss = logits.new_zeros(())
+        if labelled.any():
+            loss = F.cross_entropy(logits[labelled], labels[labelled])
+        if soft_targets is not None:
+            temperature = self.temperature
+            kl = F.kl_div(
+                F.log_softmax(logits / temperature, dim=-1),
+                F.softmax(soft_targets / temperature, dim=-1),
+                reduction="batchmean",
+            ) * (temperature ** 2)
+            loss = self.alpha * kl + (1 - self.alpha) * loss
+        return (loss, outputs) if return_outputs else loss
+
+
+def measure_latency(model, tokenizer, texts: List[str], device: str, max_length: int) -> Dict[str, float]:
+    """Per-item latency as /classify sees it (one text per forward pass)."""
+    model.eval()
+    for text in texts[:10]:
+        classifier.predict_logits(tokenizer, model, [text], device, max_length)
+    timings = []
+    for text in texts:
+        started = time.perf_counter()
+        classifier.predict_logits(tokenizer, model, [text], device, max_length)
+        timings.append((time.perf_counter() - started) * 1000)
+    values = np.asarray(timings)
+    return {
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "mean_ms": round(float(values.mean()), 3),
+    }
+
+
+def model_summary(model, path: Optional[str] = None) -> Dict[str, object]:
+    summary: Dict[str, object] = {"parameters": int(sum(p.numel() for p in model.parameters()))}
+    if path and os.path.isdir(path):
+        summary["disk_mb"] = round(
+            sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path)) / 1e6, 1
+        )
+    return summary
+
+
+def main():
+    config_path = os.getenv("CONFIG", "configs/model2_classifier_distill.yaml")
+    cfg = load_config(config_path, DistillConfig)
+    for key in ("temperature", "alpha"):
+        setattr(cfg, key, float(getattr(cfg, key)))
+
+    if not cfg.train_files or not cfg.valid_files or not cfg.test_files:
+        raise ValueError("Config must specify train_files, valid_files, and test_files")
+
+    label2id = {label: idx for idx, label in enumerate(cfg.labels)}
+    id2label = {idx: label for label, idx in label2id.items()}
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    torch.manual_seed(cfg.seed)
+
+    teacher_tokenizer, teacher = classifier.load_classifier(cfg.model_id, device)
+    student_tokenizer = AutoTokenizer.from_pretrained(cfg.student_model_id or cfg.model_id)
+    student = build_student(cfg, teacher, label2id, id2label).to(device)
+
+    # Training set: gold examples plus augmented copies, all with teacher soft targets.
+    raw = training_data.load_dataset_dict({"train": cfg.train_files})["train"]
+    rng = random.Random(cfg.seed)
+    texts: List[str] = []
+    labels: List[int] = []
+    for example in raw:
+        text = example[cfg.text_field]
+        texts.append(text)
+        labels.append(label2id[example[cfg.label_field]])
+        for _ in range(cfg.augment_copies):
+            texts.append(augment_text(text, rng))
+            labels.append(-100)
+    print(f"Scoring {len(texts)} training texts ({len(raw)} gold, {len(texts) - len(raw)} augmented) with the teacher")
+    soft = teacher_logits(teacher, teacher_tokenizer, texts, cfg, device)
+
+    tokenized = student_tokenizer(texts, truncation=True, max_length=cfg.max_length)
+    train_dataset = Dataset.from_dict(
+        {**{key: tokenized[key] for key in tokenized.keys()}, "labels": labels, "teacher_logits": soft.tolist()}
+    )
+
+    data_files = {"validation": cfg.valid_files, "test": cfg.test_files}
+    eval_splits = tokenized_splits(student_tokenizer, cfg, label2id, data_files)
+
+    args = TrainingArguments(
+        output_dir=cfg.output_dir,
+        per_device_train_batch_size=cfg.batch_size,
+        per_device_eval_batch_size=cfg.eval_batch_size,
+        learning_rate=cfg.learning_rate,
+        num_train_epochs=cfg.epochs,
+        weight_decay=cfg.weight_decay,
+        evaluation_strategy="epoch",
+        save_strategy="epoch",
+        logging_strategy="steps",
+        logging_steps=50,
+        seed=cfg.seed,
+        load_best_model_at_end=True,
+        metric_for_best_model="macro_f1",
+        # teacher_logits is not a model input but the loss needs it.
+        remove_unused_columns=False,
+        report_to=[],
+    )
+
+    trainer = DistillationTrainer(
+        model=student,
+        args=args,
+        train_dataset=train_dataset,
+        eval_dataset=eval_splits["validation"],
+        tokenizer=student_tokenizer,
+        data_collator=DataCollatorWithPadding(student_tokenizer),
+        compute_metrics=make_compute_metrics(cfg.labels),
+        temperature=cfg.temperature,
+        alpha=cfg.alpha,
+    )
+    trainer.train()
+
+    os.makedirs(cfg.output_dir, exist_ok=True)
+    trainer.save_model(cfg.output_dir)
+    student_tokenizer.save_pretrained(cfg.output_dir)
+
+    # Quality vs latency, teacher and student on the same test split.
+    student_metrics = trainer.evaluate(eval_splits["test"], metric_key_prefix="test")
+    teacher_eval = Trainer(
+        model=teacher,
+        args=TrainingArguments(
+            output_dir=os.path.join(cfg.output_dir, "teacher_eval"),
+            per_device_eval_batch_size=cfg.eval_batch_size,
+            report_to=[],
+        ),
+        data_collator=DataCollatorWithPadding(teacher_tokenizer),
+        compute_metrics=make_compute_metrics(cfg.labels),
+    )
+    teacher_test = tokenized_splits(teacher_tokenizer, cfg, label2id, {"test": cfg.test_files})["test"]
+    teacher_metrics = teacher_eval.evaluate(teacher_test, metric_key_prefix="test")
+
+    test_texts = training_data.load_dataset_dict({"test": cfg.test_files})["test"][cfg.text_field]
+    sample = test_texts[: cfg.latency_samples]
+    threads = torch.get_num_threads()
+    teacher_latency = measure_latency(teacher, teacher_tokenizer, sample, device, cfg.max_length)
+    student_latency = measure_latency(trainer.model, student_tokenizer, sample, device, cfg.max_length)
+
+    report = {
+        "device": device,
+        "torch_threads": threads,
+        "teacher": {
+            "model": cfg.model_id,
+            **model_summary(teacher, cfg.model_id),
+            "accuracy": teacher_metrics.get("test_accuracy"),
+            "macro_f1": teacher_metrics.get("test_macro_f1"),
+            "latency": teacher_latency,
+        },
+        "student": {
+            "model": cfg.output_dir,
+            **model_summary(trainer.model, cfg.output_dir),
+            "accuracy": student_metrics.get("test_accuracy"),
+            "macro_f1": student_metrics.get("test_macro_f1"),
+            "latency": student_latency,
+        },
+        "speedup_p50": round(teacher_latency["p50_ms"] / student_latency["p50_ms"], 2),
+        "training": {
+            "gold_examples": len(raw),
+            "augmented_examples": len(texts) - len(raw),
+            "temperature": cfg.temperature,
+            "alpha": cfg.alpha,
+        },
+    }
+    with open(os.path.join(cfg.output_dir, "distillation_report.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    # Memoize the content hash now, so the service's first startup does not read the weights to hash them.
+    model_content_hash(cfg.output_dir)
+
+    print("\nDistillation report (test split):")
+    for role in ("teacher", "student"):
+        entry = report[role]
+        print(
+            f"  {role:>7}: {entry['parameters'] / 1e6:.1f}M params, accuracy {entry['accuracy']:.2%}, "
+            f"macro F1 {entry['macro_f1']:.4f}, p50 {entry['latency']['p50_ms']} ms/item"
+        )
+    print(f"  speedup (p50 per item): {report['speedup_p50']}x")
+
+
+if __name__ == "__main__":
+    main()
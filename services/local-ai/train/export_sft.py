@@ -0,0 +1,176 @@
+"""Export the SFT model for inference: merge LoRA, convert dtype, write safetensors, check parity.
+
+    python services/local-ai/train/export_sft.py \
+        --model models/finetuned/qwen-credit-sft \
+        --output models/finetuned/qwen-credit-sft-merged --dtype bfloat16 [--int8]
+
+Parity is checked against the unmerged float32 model on a sample of the SFT
+validation set:
+- exact matches of greedy generations are reported;
+- the gate is teacher-forced agreement: how often the exported model's
+  next-token argmax equals the reference token.
+Results go to parity.json. The export replaces --output only when agreement
+reaches --min-agreement; otherwise it stays in <output>.tmp and the script
+exits non-zero.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+from typing import Dict, List
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from train_sft import build_messages
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import llm  # noqa: E402
+from model_ids import model_content_hash  # noqa: E402
+
+
+def load_reference(model_path: str):
+    """The model exactly as training left it, in float32, with adapters unmerged."""
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    if llm.is_adapter_dir(model_path):
+        from peft import PeftModel
+
+        base = AutoModelForCausalLM.from_pretrained(
+            llm.adapter_base_model(model_path), torch_dtype=torch.float32, low_cpu_mem_usage=True
+        )
+        model = PeftModel.from_pretrained(base, model_path)
+    else:
+        model = AutoModelForCausalLM.from_pretrained(model_path, torch_dtype=torch.float32, low_cpu_mem_usage=True)
+    model.eval()
+    return tokenizer, model
+
+
+def sample_prompts(tokenizer, valid_file: str, samples: int) -> List[str]:
+    prompts = []
+    with open(valid_file, "r", encoding="utf-8") as f:
+        for line in f:
+            if len(prompts) >= samples:
+                break
+            if not line.strip():
+                continue
+            messages = [m for m in build_messages(json.loads(line)) if m["role"] != "assistant"]
+            if any(m["role"] == "user" for m in messages):
+                prompts.append(tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True))
+    return prompts
+
+
+def greedy(model, tokenizer, prompt: str, max_new_tokens: int) -> List[int]:
+    inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
+    with torch.inference_mode():
+        output = model.generate(
+            **inputs, max_new_tokens=max_new_tokens, do_sample=False, pad_token_id=tokenizer.eos_token_id
+        )
+    return output[0, inputs["input_ids"].shape[1] :].tolist()
+
+
+def teacher_forced_agreement(model, tokenizer, prompt: str, reference: List[int]) -> int:
+    """How many reference tokens the model also ranks first when fed the reference prefix."""
+    if not reference:
+        return 0
+    prompt_ids = tokenizer(prompt, return_tensors="pt")["input_ids"][0].tolist()
+    input_ids = torch.tensor([prompt_ids + reference[:-1]], device=model.device)
+    with torch.inference_mode():
+        logits = model(input_ids=input_ids).logits[0, len(prompt_ids) - 1 :]
+    return int((logits.argmax(dim=-1).cpu() == torch.tensor(reference)).sum())
+
+
+def directory_mb(path: str) -> float:
+    return round(sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path)) / 1e6, 1)
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Merge and export the SFT model for inference")
+    parser.add_argument("--model", default="models/finetuned/qwen-credit-sft", help="train_sft.py output")
+    parser.add_argument("--output", default="models/finetuned/qwen-credit-sft-merged")
+    parser.add_argument("--dtype", choices=["bfloat16", "float16", "float32"], default="bfloat16")
+    parser.add_argument("--int8", action="store_true", help="Serve with weight-only int8 (dynamic quantization on CPU)")
+    parser.add_argument("--valid-file", default="data/finetune/model1_sft.valid.jsonl")
+    parser.add_argument("--samples", type=int, default=8)
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--min-agreement", type=float, default=None,
+                        help="Minimum teacher-forced top-1 agreement (default 0.98, or 0.9 with --int8)")
+    parser.add_argument("--max-shard-size", default="2GB")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    min_agreement = args.min_agreement if args.min_agreement is not None else (0.9 if args.int8 else 0.98)
+
+    print(f"Loading reference model from {args.model}")
+    tokenizer, reference_model = load_reference(args.model)
+    prompts = sample_prompts(tokenizer, args.valid_file, args.samples)
+    print(f"Generating reference outputs for {len(prompts)} validation prompts")
+    references = [greedy(reference_model, tokenizer, prompt, args.max_new_tokens) for prompt in prompts]
+
+    if llm.is_adapter_dir(args.model):
+        print("Merging LoRA adapters into the base weights")
+        merged = reference_model.merge_and_unload()
+    else:
+        merged = reference_model
+    merged = merged.to(getattr(torch, args.dtype))
+
+    staging = args.output.rstrip("/") + ".tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    merged.save_pretrained(staging, safe_serialization=True, max_shard_size=args.max_shard_size)
+    tokenizer.save_pretrained(staging)
+    inference_config = {
+        "source": os.path.abspath(args.model),
+        "torch_dtype": args.dtype,
+        "quantization": "dynamic_int8" if args.int8 else None,
+    }
+    with open(os.path.join(staging, llm.INFERENCE_CONFIG), "w", encoding="utf-8") as f:
+        json.dump(inference_config, f, indent=2)
+    del merged, reference_model
+
+    # Parity: load the staged export exactly as the service will.
+    _, exported = llm.load_causal_lm(staging, "cpu")
+    exact = 0
+    agreed = 0
+    total = 0
+    per_sample: List[Dict[str, object]] = []
+    for prompt, reference in zip(prompts, references):
+        candidate = greedy(exported, tokenizer, prompt, args.max_new_tokens)
+        matches = teacher_forced_agreement(exported, tokenizer, prompt, reference)
+        exact += int(candidate == reference)
+        agreed += matches
+        total += len(reference)
+        per_sample.append({"reference_tokens": len(reference), "agreement": matches, "exact": candidate == reference})
+    del exported
+
+    agreement = agreed / total if total else 1.0
+    report = {
+        **inference_config,
+        "samples": len(prompts),
+        "exact_match_rate": round(exact / len(prompts), 4) if prompts else None,
+        "token_agreement": round(agreement, 4),
+        "min_agreement": min_agreement,
+        "passed": agreement >= min_agreement,
+        "size_mb": directory_mb(staging),
+        "per_sample": per_sample,
+    }
+    with open(os.path.join(staging, "parity.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Parity: exact generations {exact}/{len(prompts)}, teacher-forced token agreement {agreement:.2%}")
+
+    if not report["passed"]:
+        # Leave the live export untouched; the staged copy is kept for inspection.
+        print(f"Token agreement below {min_agreement:.0%}; export left in {staging} and not published")
+        sys.exit(1)
+
+    model_content_hash(staging)  # memoized next to the weights; the rename keeps their mtimes
+    shutil.rmtree(args.output, ignore_errors=True)
+    os.replace(staging, args.output)
+    print(f"Wrote {args.output} ({report['size_mb']} MB)")
+
+
+if __name__ == "__main__":
+    main()
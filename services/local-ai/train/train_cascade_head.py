@@ -0,0 +1,161 @@
+import json
+import os
+import sys
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+import numpy as np
+import torch
+import yaml
+from sentence_transformers import SentenceTransformer
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import cascade  # noqa: E402
+import classifier  # noqa: E402
+import training_data  # noqa: E402
+from model_ids import model_content_hash  # noqa: E402
+
+
+@dataclass
+class CascadeConfig:
+    # The MiniLM checkpoint the service embeds with, and the DistilBERT
+    # checkpoint that answers escalated texts (used here for the cascade report).
+    embedding_model_id: str
+    classifier_model_id: str
+    output_dir: str
+    text_field: str
+    label_field: str
+    labels: List[str]
+    train_files: List[str]
+    valid_files: List[str]
+    test_files: List[str]
+    target_accuracy: float = 0.98
+    epochs: int = 300
+    learning_rate: float = 0.05
+    l2: float = 1e-4
+    batch_size: int = 128
+    max_length: int = 256
+    seed: int = 42
+
+
+def load_config(path: str) -> CascadeConfig:
+    with open(path, "r", encoding="utf-8") as f:
+        data = yaml.safe_load(f)
+    for split in ("train", "valid", "test"):
+        if f"{split}_files" not in data:
+            data[f"{split}_files"] = [data.pop(f"{split}_file")] if data.get(f"{split}_file") else []
+        data.pop(f"{split}_file", None)
+    for key in ("target_accuracy", "learning_rate", "l2"):
+        if key in data:
+            data[key] = float(data[key])
+    return CascadeConfig(**data)
+
+
+def load_split(paths: List[str], cfg: CascadeConfig, label2id: Dict[str, int]) -> Tuple[List[str], np.ndarray]:
+    texts: List[str] = []
+    targets: List[int] = []
+    for path in paths:
+        table = training_data.load_table(path, "classifier")
+        texts.extend(table.column(cfg.text_field).to_pylist())
+        targets.extend(label2id[label] for label in table.column(cfg.label_field).to_pylist())
+    return texts, np.asarray(targets, dtype=np.int64)
+
+
+def bert_probabilities(tokenizer, model, texts: List[str], labels: List[str], cfg: CascadeConfig, device: str):
+    """DistilBERT probabilities [len(texts), len(labels)] in the head's label order."""
+    names = classifier.label_names(model.config)
+    columns = [names.index(label) for label in labels]
+    order = np.argsort([len(text) for text in texts], kind="stable")
+    probs = np.zeros((len(texts), len(labels)), dtype=np.float32)
+    for start in range(0, len(order), cfg.batch_size):
+        batch = order[start : start + cfg.batch_size]
+        probs[batch] = classifier.predict_proba(
+            tokenizer, model, [texts[idx] for idx in batch], device, cfg.max_length
+        )[:, columns]
+    return probs
+
+
+def per_item_ms(fn, texts: List[str]) -> float:
+    """Mean latency of one text per call, as /classify sees it."""
+    for text in texts[:10]:
+        fn(text)
+    started = time.perf_counter()
+    for text in texts:
+        fn(text)
+    return round((time.perf_counter() - started) * 1000 / max(len(texts), 1), 3)
+
+
+def main():
+    config_path = os.getenv("CONFIG", "configs/model2_cascade_head.yaml")
+    cfg = load_config(config_path)
+    if not cfg.train_files or not cfg.valid_files or not cfg.test_files:
+        raise ValueError("Config must specify train_files, valid_files, and test_files")
+
+    label2id = {label: idx for idx, label in enumerate(cfg.labels)}
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    embedder = SentenceTransformer(cfg.embedding_model_id, device=device)
+    embedder_hash = model_content_hash(cfg.embedding_model_id)
+
+    splits = {}
+    for split, paths in (("train", cfg.train_files), ("valid", cfg.valid_files), ("test", cfg.test_files)):
+        texts, targets = load_split(paths, cfg, label2id)
+        # Same call as the service, so the head sees the embeddings it will be served.
+        embeddings = embedder.encode(texts, batch_size=cfg.batch_size, normalize_embeddings=True)
+        splits[split] = (texts, targets, embeddings)
+        print(f"{split}: {len(texts)} examples")
+
+    _, train_targets, train_embeddings = splits["train"]
+    weights, bias = cascade.fit_linear_head(
+        train_embeddings, train_targets, len(cfg.labels), cfg.epochs, cfg.learning_rate, cfg.l2, cfg.seed
+    )
+    head = cascade.LinearHead(weights, bias, cfg.labels, float("inf"), embedder_hash)
+
+    _, valid_targets, valid_embeddings = splits["valid"]
+    valid_probs = head.predict_proba(valid_embeddings)
+    head.threshold = cascade.calibrate_threshold(
+        valid_probs.max(axis=-1), valid_probs.argmax(axis=-1) == valid_targets, cfg.target_accuracy
+    )
+    head_path = os.path.join(cfg.output_dir, cascade.HEAD_FILE)
+    head.save(head_path)
+    print(f"Saved linear head to {head_path} (threshold {head.threshold:.4f})")
+
+    # End-to-end accuracy and escalation, against DistilBERT alone.
+    bert_tokenizer, bert_model = classifier.load_classifier(cfg.classifier_model_id, device)
+    results = {}
+    for split in ("valid", "test"):
+        texts, targets, embeddings = splits[split]
+        bert_probs = bert_probabilities(bert_tokenizer, bert_model, texts, cfg.labels, cfg, device)
+        results[split] = cascade.simulate(head.predict_proba(embeddings), bert_probs, targets, head.threshold)
+    sample = splits["test"][0][:200]
+    latency = {
+        "linear_ms": per_item_ms(
+            lambda text: head.predict_proba(embedder.encode([text], normalize_embeddings=True)), sample
+        ),
+        "distilbert_ms": per_item_ms(
+            lambda text: classifier.predict_logits(bert_tokenizer, bert_model, [text], device, cfg.max_length),
+            sample,
+        ),
+    }
+    report = {
+        "embedding_model": cfg.embedding_model_id,
+        "classifier_model": cfg.classifier_model_id,
+        "target_accuracy": cfg.target_accuracy,
+        "validation": results["valid"],
+        "test": results["test"],
+        "latency": latency,
+    }
+    with open(os.path.join(cfg.output_dir, "cascade_report.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    test = report["test"]
+    print("\nCascade report (test split):")
+    print(f"  linear stage answers {test['linear_answered']} texts (accuracy {test['linear_accuracy_on_answered']})")
+    print(f"  escalated to DistilBERT: {test['escalation_rate']:.1%}")
+    print(f"  cascade accuracy {test['accuracy']:.2%} vs DistilBERT alone {test['distilbert_only_accuracy']:.2%}")
+    print(f"  per item: linear {latency['linear_ms']} ms, DistilBERT {latency['distilbert_ms']} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,23 @@
 import json
 import os
+import sys
 from dataclasses import dataclass
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 import numpy as np
 import yaml
-from datasets import load_dataset
 from transformers import (AutoModelForSequenceClassification, AutoTokenizer,
                           DataCollatorWithPadding, Trainer, TrainingArguments)
 
+import dataset_cache
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from model_ids import model_content_hash  # noqa: E402
+
+# Bump when preprocess() changes so cached tokenized datasets are rebuilt.
+PREPROCESS_VERSION = 1
+
 
 @dataclass
 class Config:
@@ -30,9 +39,11 @@ class Config:
     train_files: Optional[List[str]] = None
     valid_files: Optional[List[str]] = None
     test_files: Optional[List[str]] = None
+    dataset_cache_dir: Optional[str] = ".cache/datasets"
+    num_proc: Optional[int] = None
 
 
-def load_config(path: str) -> Config:
+def load_config(path: str, config_class=Config) -> Config:
     with open(path, "r", encoding="utf-8") as f:
         data = yaml.safe_load(f)
     if "train_files" not in data:
@@ -53,27 +64,10 @@ def load_config(path: str) -> Config:
         data["max_length"] = int(data["max_length"])
     if "weight_decay" in data:
         data["weight_decay"] = float(data["weight_decay"])
-    return Config(**data)
-
-
-def main():
-    config_path = os.getenv("CONFIG", "configs/model2_classifier.yaml")
-    cfg = load_config(config_path)
+    return config_class(**data)
 
-    label2id = {label: idx for idx, label in enumerate(cfg.labels)}
-    id2label = {idx: label for label, idx in label2id.items()}
-
-    if not cfg.train_files or not cfg.valid_files or not cfg.test_files:
-        raise ValueError("Config must specify train_files, valid_files, and test_files")
-
-    dataset = load_dataset("json", data_files={
-        "train": cfg.train_files,
-        "validation": cfg.valid_files,
-        "test": cfg.test_files,
-    })
-
-    tokenizer = AutoTokenizer.from_pretrained(cfg.model_id)
 
+def make_preprocess(tokenizer, cfg: Config, label2id: Dict[str, int]):
     def preprocess(examples):
         texts = examples[cfg.text_field]
         labels = [label2id[label] for label in examples[cfg.label_field]]
@@ -85,26 +79,21 @@ def main():
         tokenized["labels"] = labels
         return tokenized
 
-    dataset = dataset.map(preprocess, batched=True, remove_columns=dataset["train"].column_names)
+    return preprocess
 
-    model = AutoModelForSequenceClassification.from_pretrained(
-        cfg.model_id,
-        num_labels=len(cfg.labels),
-        id2label=id2label,
-        label2id=label2id,
-    )
 
+def make_compute_metrics(labels: List[str]):
     def compute_metrics(eval_pred):
-        logits, labels = eval_pred
+        logits, label_ids = eval_pred
         preds = np.argmax(logits, axis=-1)
-        accuracy = (preds == labels).mean().item()
+        accuracy = (preds == label_ids).mean().item()
 
         f1_scores = []
         per_class = {}
-        for idx, label in enumerate(cfg.labels):
-            tp = ((preds == idx) & (labels == idx)).sum()
-            fp = ((preds == idx) & (labels != idx)).sum()
-            fn = ((preds != idx) & (labels == idx)).sum()
+        for idx, label in enumerate(labels):
+            tp = ((preds == idx) & (label_ids == idx)).sum()
+            fp = ((preds == idx) & (label_ids != idx)).sum()
+            fn = ((preds != idx) & (label_ids == idx)).sum()
             precision = tp / (tp + fp) if (tp + fp) > 0 else 0.0
             recall = tp / (tp + fn) if (tp + fn) > 0 else 0.0
             f1 = (2 * precision * recall / (precision + recall)) if (precision + recall) > 0 else 0.0
@@ -116,6 +105,54 @@ def main():
         metrics.update(per_class)
         return metrics
 
+    return compute_metrics
+
+
+def tokenized_splits(tokenizer, cfg: Config, label2id: Dict[str, int], data_files: Dict[str, List[str]]):
+    return dataset_cache.load_tokenized(
+        "classifier",
+        data_files,
+        tokenizer,
+        cfg.max_length,
+        make_preprocess(tokenizer, cfg, label2id),
+        cfg.dataset_cache_dir,
+        num_proc=cfg.num_proc,
+        extra={
+            "version": PREPROCESS_VERSION,
+            "text_field": cfg.text_field,
+            "label_field": cfg.label_field,
+            "labels": cfg.labels,
+        },
+    )
+
+
+def main():
+    config_path = os.getenv("CONFIG", "configs/model2_classifier.yaml")
+    cfg = load_config(config_path)
+
+    label2id = {label: idx for idx, label in enumerate(cfg.labels)}
+    id2label = {idx: label for label, idx in label2id.items()}
+
+    if not cfg.train_files or not cfg.valid_files or not cfg.test_files:
+        raise ValueError("Config must specify train_files, valid_files, and test_files")
+
+    data_files = {
+        "train": cfg.train_files,
+        "validation": cfg.valid_files,
+        "test": cfg.test_files,
+    }
+
+    tokenizer = AutoTokenizer.from_pretrained(cfg.model_id)
+
+    dataset = tokenized_splits(tokenizer, cfg, label2id, data_files)
+
+    model = AutoModelForSequenceClassification.from_pretrained(
+        cfg.model_id,
+        num_labels=len(cfg.labels),
+        id2label=id2label,
+        label2id=label2id,
+    )
+
     args = TrainingArguments(
         output_dir=cfg.output_dir,
         per_device_train_batch_size=cfg.batch_size,
@@ -140,7 +177,7 @@ def main():
         eval_dataset=dataset["validation"],
         tokenizer=tokenizer,
         data_collator=DataCollatorWithPadding(tokenizer),
-        compute_metrics=compute_metrics,
+        compute_metrics=make_compute_metrics(cfg.labels),
     )
 
     trainer.train()
@@ -151,6 +188,8 @@ def main():
 
     trainer.save_model(cfg.output_dir)
     tokenizer.save_pretrained(cfg.output_dir)
+    # Memoize the content hash now, so the service's first startup does not read the weights to hash them.
+    model_content_hash(cfg.output_dir)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,356 @@
+import json
+import os
+import random
+import sys
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import yaml
+from datasets import Dataset
+from sentence_transformers import (
+    SentenceTransformer,
+    SentenceTransformerTrainer,
+    SentenceTransformerTrainingArguments,
+    losses,
+)
+from sentence_transformers.evaluation import (
+    BinaryClassificationEvaluator,
+    InformationRetrievalEvaluator,
+    SequentialEvaluator,
+)
+from sentence_transformers.training_args import BatchSamplers
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import chunking  # noqa: E402
+import kb_index  # noqa: E402
+import training_data  # noqa: E402
+from model_ids import model_content_hash  # noqa: E402
+
+
+@dataclass
+class Config:
+    model_id: str
+    output_dir: str
+    batch_size: int
+    epochs: int
+    seed: int
+    train_file: Optional[str] = None
+    valid_file: Optional[str] = None
+    train_files: Optional[List[str]] = None
+    valid_files: Optional[List[str]] = None
+    learning_rate: float = 2e-5
+    warmup_ratio: float = 0.1
+    # In-batch negatives come from the full batch_size; gradients are cached so
+    # only mini_batch_size examples are in memory at once.
+    mini_batch_size: int = 16
+    # Hard negatives per anchor, mined from the knowledge-base chunks.
+    hard_negatives: int = 1
+    hard_negative_top_k: int = 30
+    # A candidate is only a negative if it scores below margin * score(anchor, positive).
+    hard_negative_margin: float = 0.95
+    index_dir: str = "data/knowledge-base/index"
+    knowledge_dirs: List[str] = field(
+        default_factory=lambda: ["data/knowledge-base", "src/data/knowledge-base"]
+    )
+    chunk_overlap_tokens: int = 32
+    eval_distractors: int = 2000
+    export_index: bool = True
+    index_keep_versions: int = 3
+
+
+def load_config(path: str) -> Config:
+    with open(path, "r", encoding="utf-8") as f:
+        data = yaml.safe_load(f)
+    if "train_files" not in data:
+        data["train_files"] = [data["train_file"]] if data.get("train_file") else None
+    if "valid_files" not in data:
+        data["valid_files"] = [data["valid_file"]] if data.get("valid_file") else None
+    for key in ("learning_rate", "warmup_ratio", "hard_negative_margin"):
+        if key in data:
+            data[key] = float(data[key])
+    for key in ("batch_size", "epochs", "mini_batch_size", "hard_negatives", "hard_negative_top_k", "eval_distractors"):
+        if key in data:
+            data[key] = int(data[key])
+    return Config(**data)
+
+
+def load_pairs(paths: List[str]) -> List[Tuple[str, str, int]]:
+    """Unique (text_1, text_2, label) rows; duplicates would be false in-batch negatives."""
+    pairs: List[Tuple[str, str, int]] = []
+    seen = set()
+    for path in paths:
+        table = training_data.load_table(path, "pairs")
+        columns = (table.column(name).to_pylist() for name in ("text_1", "text_2", "label"))
+        for text_1, text_2, label in zip(*columns):
+            key = (text_1, text_2, int(label >= 0.5))
+            if key not in seen:
+                seen.add(key)
+                pairs.append(key)
+    return pairs
+
+
+def load_knowledge_corpus(model: SentenceTransformer, cfg: Config) -> Tuple[List[str], Optional[np.ndarray]]:
+    """Knowledge-base chunks and their embeddings under the starting model (for mining and evaluation).
+
+    The published index is reused when it was built with the ``cfg.model_id``
+    checkpoint; otherwise the knowledge base is chunked and encoded here.
+    """
+    try:
+        loaded = kb_index.load_index(cfg.index_dir, model_content_hash(cfg.model_id), verify="off")
+    except (OSError, ValueError):
+        loaded = None
+    if loaded is not None:
+        chunks, embeddings, manifest = loaded
+        print(f"Using knowledge index {manifest['checksum'][:12]} ({len(chunks)} chunks) for hard negatives")
+        return [str(chunk["text"]) for chunk in chunks], np.asarray(embeddings)
+
+    knowledge_dirs = [os.path.abspath(path) for path in cfg.knowledge_dirs if os.path.isdir(path)]
+    count_tokens = chunking.make_token_counter(model.tokenizer)
+    max_tokens = chunking.max_chunk_tokens(model.tokenizer, model.max_seq_length)
+    chunks = kb_index.collect_chunks(knowledge_dirs, count_tokens, max_tokens, cfg.chunk_overlap_tokens)
+    texts = [str(chunk["text"]) for chunk in chunks]
+    if not texts:
+        return [], None
+    print(f"Encoding {len(texts)} knowledge-base chunks for hard negatives")
+    return texts, model.encode(texts, batch_size=64, normalize_embeddings=True, convert_to_numpy=True)
+
+
+def mine_hard_negatives(
+    model: SentenceTransformer,
+    anchors: List[str],
+    positives: List[str],
+    corpus: List[str],
+    corpus_embeddings: np.ndarray,
+    explicit: Dict[str, List[str]],
+    cfg: Config,
+) -> List[List[str]]:
+    """Up to ``cfg.hard_negatives`` negatives per (anchor, positive).
+
+    Labelled negatives from the pair files come first. The rest are the
+    highest-scoring knowledge-base chunks that stay below the margin, so
+    near-duplicates of the positive are not pushed away.
+    """
+    rng = random.Random(cfg.seed)
+    anchor_embeddings = model.encode(anchors, batch_size=64, normalize_embeddings=True, convert_to_numpy=True)
+    positive_embeddings = model.encode(positives, batch_size=64, normalize_embeddings=True, convert_to_numpy=True)
+    positive_scores = (anchor_embeddings * positive_embeddings).sum(axis=1)
+    top_k = min(cfg.hard_negative_top_k, len(corpus))
+
+    negatives: List[List[str]] = []
+    for start in range(0, len(anchors), 1024):
+        scores = anchor_embeddings[start : start + 1024] @ corpus_embeddings.T
+        candidates = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+        for offset, row in enumerate(candidates):
+            idx = start + offset
+            chosen = [text for text in explicit.get(anchors[idx], []) if text != positives[idx]]
+            ceiling = cfg.hard_negative_margin * positive_scores[idx]
+            for candidate in row[np.argsort(-scores[offset, row])]:
+                if len(chosen) >= cfg.hard_negatives:
+                    break
+                text = corpus[candidate]
+                if scores[offset, candidate] < ceiling and text != positives[idx] and text not in chosen:
+                    chosen.append(text)
+            # Pad with random chunks so every row has the same number of columns.
+            while len(chosen) < cfg.hard_negatives:
+                chosen.append(corpus[rng.randrange(len(corpus))])
+            negatives.append(chosen[: cfg.hard_negatives])
+    return negatives
+
+
+def build_train_dataset(
+    model: SentenceTransformer,
+    pairs: List[Tuple[str, str, int]],
+    corpus: List[str],
+    corpus_embeddings: Optional[np.ndarray],
+    cfg: Config,
+) -> Dataset:
+    positives = [(text_1, text_2) for text_1, text_2, label in pairs if label == 1]
+    if not positives:
+        raise ValueError("Training files contain no positive pairs")
+    explicit: Dict[str, List[str]] = {}
+    for text_1, text_2, label in pairs:
+        if label == 0:
+            explicit.setdefault(text_1, []).append(text_2)
+
+    columns: Dict[str, List[str]] = {
+        "anchor": [anchor for anchor, _ in positives],
+        "positive": [positive for _, positive in positives],
+    }
+    if cfg.hard_negatives > 0:
+        if corpus_embeddings is not None and len(corpus) > 0:
+            mined = mine_hard_negatives(
+                model, columns["anchor"], columns["positive"], corpus, corpus_embeddings, explicit, cfg
+            )
+            for idx in range(cfg.hard_negatives):
+                columns[f"negative_{idx + 1}"] = [row[idx] for row in mined]
+        else:
+            print("No knowledge base found; training with in-batch negatives only")
+    return Dataset.from_dict(columns)
+
+
+def build_evaluator(pairs: List[Tuple[str, str, int]], distractors: List[str]):
+    """Pair classification on the validation pairs plus retrieval of their positives among KB chunks."""
+    evaluators = [
+        BinaryClassificationEvaluator(
+            sentences1=[text_1 for text_1, _, _ in pairs],
+            sentences2=[text_2 for _, text_2, _ in pairs],
+            labels=[label for _, _, label in pairs],
+            name="valid_pairs",
+        )
+    ]
+    queries: Dict[str, str] = {}
+    corpus: Dict[str, str] = {}
+    relevant: Dict[str, set] = {}
+    doc_ids: Dict[str, str] = {}
+    for text_1, text_2, label in pairs:
+        if label != 1:
+            continue
+        query_id = queries.setdefault(text_1, f"q{len(queries)}")
+        doc_id = doc_ids.setdefault(text_2, f"d{len(doc_ids)}")
+        relevant.setdefault(query_id, set()).add(doc_id)
+    if relevant:
+        corpus = {doc_id: text for text, doc_id in doc_ids.items()}
+        for idx, text in enumerate(distractors):
+            if text not in doc_ids:
+                corpus[f"kb{idx}"] = text
+        evaluators.append(
+            InformationRetrievalEvaluator(
+                queries={query_id: text for text, query_id in queries.items()},
+                corpus=corpus,
+                relevant_docs=relevant,
+                name="valid_retrieval",
+                mrr_at_k=[10],
+                ndcg_at_k=[10],
+                accuracy_at_k=[1, 5],
+                precision_recall_at_k=[1, 5, 10],
+                map_at_k=[10],
+                show_progress_bar=False,
+            )
+        )
+    return SequentialEvaluator(evaluators)
+
+
+def export_knowledge_index(model: SentenceTransformer, cfg: Config) -> Optional[str]:
+    """Re-encode the knowledge base with the fine-tuned model and publish it as the live index.
+
+    Call after the model is saved: the index is tagged with the content hash of
+    the files in ``cfg.output_dir``, which the service compares with its
+    MINILM_MODEL_ID checkpoint. ingest_rag --embed embeds with that checkpoint
+    too, so it reuses these vectors instead of replacing them.
+    """
+    knowledge_dirs = [os.path.abspath(path) for path in cfg.knowledge_dirs if os.path.isdir(path)]
+    if not knowledge_dirs:
+        print("No knowledge base directories found; skipping index export")
+        return None
+    count_tokens = chunking.make_token_counter(model.tokenizer)
+    max_tokens = chunking.max_chunk_tokens(model.tokenizer, model.max_seq_length)
+    chunks = kb_index.collect_chunks(knowledge_dirs, count_tokens, max_tokens, cfg.chunk_overlap_tokens)
+    if not chunks:
+        print("Knowledge base is empty; skipping index export")
+        return None
+    print(f"Re-encoding {len(chunks)} knowledge-base chunks with the fine-tuned model")
+    embeddings = model.encode(
+        [str(chunk["text"]) for chunk in chunks],
+        batch_size=64,
+        normalize_embeddings=True,
+        convert_to_numpy=True,
+        show_progress_bar=True,
+    )
+    return kb_index.publish_index(
+        cfg.index_dir,
+        chunks,
+        embeddings,
+        model_id=os.path.abspath(cfg.output_dir),
+        chunking_params={"max_tokens": max_tokens, "overlap_tokens": cfg.chunk_overlap_tokens},
+        keep_versions=cfg.index_keep_versions,
+        model_hash=model_content_hash(cfg.output_dir),
+    )
+
+
+def main():
+    config_path = os.getenv("CONFIG", "configs/model3_embeddings.yaml")
+    cfg = load_config(config_path)
+
+    if not cfg.train_files or not cfg.valid_files:
+        raise ValueError("Config must specify train_files and valid_files")
+
+    random.seed(cfg.seed)
+    np.random.seed(cfg.seed)
+
+    model = SentenceTransformer(cfg.model_id)
+    train_pairs = load_pairs(cfg.train_files)
+    valid_pairs = load_pairs(cfg.valid_files)
+    print(f"Loaded {len(train_pairs)} unique training pairs and {len(valid_pairs)} unique validation pairs")
+
+    corpus: List[str] = []
+    corpus_embeddings = None
+    if cfg.hard_negatives > 0 or cfg.eval_distractors > 0:
+        corpus, corpus_embeddings = load_knowledge_corpus(model, cfg)
+
+    train_dataset = build_train_dataset(model, train_pairs, corpus, corpus_embeddings, cfg)
+    print(f"Training on {len(train_dataset)} rows with columns {train_dataset.column_names}")
+
+    distractors = random.Random(cfg.seed).sample(corpus, min(cfg.eval_distractors, len(corpus)))
+    evaluator = build_evaluator(valid_pairs, distractors)
+
+    baseline = evaluator(model)
+    print(f"Baseline metrics: {json.dumps(baseline, indent=2)}")
+
+    # Gradient caching: the loss sees all batch_size in-batch negatives while
+    # only mini_batch_size examples are in the graph at a time.
+    loss = losses.CachedMultipleNegativesRankingLoss(model, mini_batch_size=cfg.mini_batch_size)
+
+    args = SentenceTransformerTrainingArguments(
+        output_dir=cfg.output_dir,
+        per_device_train_batch_size=cfg.batch_size,
+        learning_rate=cfg.learning_rate,
+        num_train_epochs=cfg.epochs,
+        warmup_ratio=cfg.warmup_ratio,
+        # Repeated texts in one batch would be scored as each other's negatives.
+        batch_sampler=BatchSamplers.NO_DUPLICATES,
+        save_strategy="no",
+        logging_strategy="steps",
+        logging_steps=50,
+        seed=cfg.seed,
+        report_to=[],
+    )
+
+    trainer = SentenceTransformerTrainer(
+        model=model,
+        args=args,
+        train_dataset=train_dataset,
+        loss=loss,
+    )
+    trainer.train()
+
+    metrics = evaluator(model)
+    print(f"Fine-tuned metrics: {json.dumps(metrics, indent=2)}")
+
+    os.makedirs(cfg.output_dir, exist_ok=True)
+    model.save(cfg.output_dir)
+    with open(os.path.join(cfg.output_dir, "train_metrics.json"), "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "baseline": baseline,
+                "fine_tuned": metrics,
+                "train_rows": len(train_dataset),
+                "columns": train_dataset.column_names,
+                "log_history": trainer.state.log_history,
+            },
+            f,
+            indent=2,
+        )
+
+    # Memoize the content hash now, so the service's first startup does not read the weights to hash them.
+    model_content_hash(cfg.output_dir)
+
+    if cfg.export_index:
+        version_dir = export_knowledge_index(model, cfg)
+        if version_dir:
+            print(f"Published knowledge index {version_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,32 @@
+import bisect
 import json
 import os
+import sys
 from dataclasses import dataclass
 from typing import Any, Dict, List, Optional
 
+import numpy as np
 import torch
 import yaml
-from datasets import load_dataset
+from datasets import Dataset
 from peft import LoraConfig
-from transformers import AutoModelForCausalLM, AutoTokenizer, TrainingArguments
-from trl import SFTTrainer
+from transformers import AutoModelForCausalLM, AutoTokenizer, DataCollatorForLanguageModeling
+from transformers.trainer_pt_utils import get_length_grouped_indices
+from trl import SFTConfig, SFTTrainer
+
+import dataset_cache
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from model_ids import model_content_hash  # noqa: E402
+
+# Bump when build_messages()/format_examples() change so cached datasets are rebuilt.
+PREPROCESS_VERSION = 1
+
+# pad: random batches padded to their longest example (original behaviour)
+# group_by_length: batches drawn from length-sorted mega-batches
+# pack: several examples per row, with attention and positions reset at each boundary
+BATCHING_MODES = ("pad", "group_by_length", "pack")
 
 
 @dataclass
@@ -29,6 +47,9 @@ class Config:
     use_8bit: bool = False
     lora_r: int = 8
     lora_alpha: int = 16
+    batching: str = "pad"
+    dataset_cache_dir: Optional[str] = ".cache/datasets"
+    num_proc: Optional[int] = None
 
 
 def load_config(path: str) -> Config:
@@ -50,6 +71,8 @@ def load_config(path: str) -> Config:
         data["gradient_accumulation_steps"] = int(data["gradient_accumulation_steps"])
     if "max_length" in data:
         data["max_length"] = int(data["max_length"])
+    if data.get("batching", "pad") not in BATCHING_MODES:
+        raise ValueError(f"batching must be one of {', '.join(BATCHING_MODES)}")
     return Config(**data)
 
 
@@ -95,6 +118,121 @@ def build_messages(example: Dict[str, Any]) -> List[Dict[str, str]]:
     return messages
 
 
+def pack_sequences(lengths: List[int], capacity: int) -> List[List[int]]:
+    """Best-fit-decreasing bin packing of example indices into rows of ``capacity`` tokens."""
+    rows: List[List[int]] = []
+    # Sorted (remaining capacity, row index) pairs; bisect finds the tightest row that fits.
+    free: List[tuple] = []
+    for idx in sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True):
+        size = min(lengths[idx], capacity)
+        pos = bisect.bisect_left(free, (size, -1))
+        if pos == len(free):
+            rows.append([idx])
+            remaining, row = capacity - size, len(rows) - 1
+        else:
+            remaining, row = free.pop(pos)
+            rows[row].append(idx)
+            remaining -= size
+        if remaining > 0:
+            bisect.insort(free, (remaining, row))
+    return rows
+
+
+def build_packed_dataset(dataset: Dataset, capacity: int) -> Dataset:
+    """Concatenate tokenized examples into rows; position_ids restart at 0 for every example."""
+    input_ids = dataset["input_ids"]
+    packed_ids: List[List[int]] = []
+    packed_positions: List[List[int]] = []
+    for row in pack_sequences([len(ids) for ids in input_ids], capacity):
+        ids: List[int] = []
+        positions: List[int] = []
+        for idx in row:
+            example = input_ids[idx][:capacity]
+            ids.extend(example)
+            positions.extend(range(len(example)))
+        packed_ids.append(ids)
+        packed_positions.append(positions)
+    return Dataset.from_dict(
+        {"input_ids": packed_ids, "position_ids": packed_positions, "length": [len(ids) for ids in packed_ids]}
+    )
+
+
+@dataclass
+class PackedSequenceCollator:
+    """Pads packed rows and builds a block-diagonal causal mask from position_ids resets.
+
+    The 4D float mask is passed straight through by the model, so tokens never
+    attend across example boundaries, and the first token of each example is
+    excluded from the loss (it would otherwise be predicted from the previous one).
+    """
+
+    pad_token_id: int
+    dtype: torch.dtype = torch.float32
+
+    def __call__(self, features: List[Dict[str, Any]]) -> Dict[str, torch.Tensor]:
+        width = max(len(feature["input_ids"]) for feature in features)
+        batch = len(features)
+        min_value = torch.finfo(self.dtype).min
+        input_ids = torch.full((batch, width), self.pad_token_id, dtype=torch.long)
+        labels = torch.full((batch, width), -100, dtype=torch.long)
+        position_ids = torch.zeros((batch, width), dtype=torch.long)
+        attention_mask = torch.full((batch, 1, width, width), min_value, dtype=self.dtype)
+
+        for row, feature in enumerate(features):
+            ids = torch.tensor(feature["input_ids"], dtype=torch.long)
+            positions = torch.tensor(feature["position_ids"], dtype=torch.long)
+            length = ids.numel()
+            input_ids[row, :length] = ids
+            labels[row, :length] = ids
+            position_ids[row, :length] = positions
+
+            starts = (positions == 0).nonzero().flatten().tolist() + [length]
+            for start, end in zip(starts, starts[1:]):
+                size = end - start
+                block = torch.full((size, size), min_value, dtype=self.dtype).triu(1)
+                attention_mask[row, 0, start:end, start:end] = block
+            labels[row, starts[:-1]] = -100
+
+        return {
+            "input_ids": input_ids,
+            "labels": labels,
+            "position_ids": position_ids,
+            "attention_mask": attention_mask,
+        }
+
+
+def padding_ratio(batches: List[List[int]]) -> Dict[str, float]:
+    """Fraction of token slots that are padding when each batch pads to its longest row."""
+    real = sum(sum(batch) for batch in batches)
+    slots = sum(max(batch) * len(batch) for batch in batches if batch)
+    return {
+        "rows": sum(len(batch) for batch in batches),
+        "steps": len(batches),
+        "tokens": int(real),
+        "slots": int(slots),
+        "padding_ratio": round(1 - real / slots, 4) if slots else 0.0,
+    }
+
+
+def padding_report(lengths: List[int], batch_size: int, capacity: int, seed: int) -> Dict[str, Dict[str, float]]:
+    """Simulate one epoch of each batching mode over the same tokenized examples."""
+    lengths = [min(length, capacity) for length in lengths]
+    generator = torch.Generator().manual_seed(seed)
+
+    def batched(values: List[int]) -> List[List[int]]:
+        return [values[start : start + batch_size] for start in range(0, len(values), batch_size)]
+
+    shuffled = torch.randperm(len(lengths), generator=generator).tolist()
+    grouped = get_length_grouped_indices(lengths, batch_size, generator=generator)
+    rows = [sum(lengths[idx] for idx in row) for row in pack_sequences(lengths, capacity)]
+    packed_order = torch.randperm(len(rows), generator=generator).tolist()
+    return {
+        "pad": padding_ratio(batched([lengths[idx] for idx in shuffled])),
+        "group_by_length": padding_ratio(batched([lengths[idx] for idx in grouped])),
+        "pack": padding_ratio(batched([rows[idx] for idx in packed_order])),
+    }
+
+
 def main():
     config_path = os.getenv("CONFIG", "configs/model1_sft.yaml")
     cfg = load_config(config_path)
@@ -102,13 +240,52 @@ def main():
     if not cfg.train_files or not cfg.valid_files:
         raise ValueError("Config must specify train_files and valid_files")
 
-    dataset = load_dataset("json", data_files={
+    data_files = {
         "train": cfg.train_files,
         "validation": cfg.valid_files,
-    })
+    }
 
     tokenizer = AutoTokenizer.from_pretrained(cfg.model_id)
     
+    # Tokenize (or load the cached dataset) before the model is in memory, so
+    # num_proc workers do not fork a process holding the full model.
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+
+    def format_examples(examples: Dict[str, List[Any]]) -> Dict[str, List[Any]]:
+        rows = [dict(zip(examples.keys(), values)) for values in zip(*examples.values())]
+        texts = []
+        for example in rows:
+            messages = build_messages(example)
+            if not messages:
+                raise ValueError("Example has no messages or prompt/response fields")
+            texts.append(tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=False))
+        # The chat template already inserts the model's special tokens.
+        tokenized = tokenizer(texts, truncation=True, max_length=cfg.max_length, add_special_tokens=False)
+        return {"input_ids": tokenized["input_ids"], "length": [len(ids) for ids in tokenized["input_ids"]]}
+
+    dataset = dataset_cache.load_tokenized(
+        "sft",
+        data_files,
+        tokenizer,
+        cfg.max_length,
+        format_examples,
+        cfg.dataset_cache_dir,
+        num_proc=cfg.num_proc,
+        extra={"version": PREPROCESS_VERSION},
+    )
+
+    report = padding_report(dataset["train"]["length"], cfg.batch_size, cfg.max_length, cfg.seed)
+    report["batching"] = cfg.batching
+    print(f"Padding ratio per epoch (batch_size={cfg.batch_size}, max_length={cfg.max_length}):")
+    for mode in BATCHING_MODES:
+        stats = report[mode]
+        marker = " <- selected" if mode == cfg.batching else ""
+        print(f"  {mode:>15}: {stats['padding_ratio']:.1%} padding, {stats['steps']} steps{marker}")
+    os.makedirs(cfg.output_dir, exist_ok=True)
+    with open(os.path.join(cfg.output_dir, "padding_report.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
     # Aggressive memory optimization
     load_in_8bit = cfg.use_8bit and not torch.cuda.is_available()  # 8-bit for CPU if requested
     torch_dtype = torch.float16 if torch.cuda.is_available() else torch.bfloat16 if load_in_8bit else None
@@ -131,14 +308,15 @@ def main():
     
     print(f"Model loaded. Estimated size: {sum(p.numel() for p in model.parameters()) / 1e9:.2f}B params")
 
-    def format_example(example: Dict[str, Any]) -> Dict[str, str]:
-        messages = build_messages(example)
-        if not messages:
-            raise ValueError("Example has no messages or prompt/response fields")
-        text = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=False)
-        return {"text": text}
-
-    dataset = dataset.map(format_example, remove_columns=dataset["train"].column_names)
+    if cfg.batching == "pack":
+        train_dataset = build_packed_dataset(dataset["train"], cfg.max_length)
+        eval_dataset = build_packed_dataset(dataset["validation"], cfg.max_length)
+        data_collator = PackedSequenceCollator(tokenizer.pad_token_id, dtype=model.dtype)
+        print(f"Packed {len(dataset['train'])} training examples into {len(train_dataset)} rows")
+    else:
+        train_dataset = dataset["train"]
+        eval_dataset = dataset["validation"]
+        data_collator = DataCollatorForLanguageModeling(tokenizer, mlm=False)
 
     lora_config = LoraConfig(
         r=cfg.lora_r,
@@ -151,7 +329,7 @@ def main():
     
     print(f"LoRA config: r={cfg.lora_r}, alpha={cfg.lora_alpha}")
 
-    args = TrainingArguments(
+    args = SFTConfig(
         output_dir=cfg.output_dir,
         per_device_train_batch_size=cfg.batch_size,
         per_device_eval_batch_size=cfg.eval_batch_size,
@@ -166,18 +344,22 @@ def main():
         fp16=torch.cuda.is_available(),
         gradient_checkpointing=True,
         report_to=[],
+        group_by_length=cfg.batching == "group_by_length",
+        length_column_name="length",
+        max_seq_length=cfg.max_length,
+        packing=False,
+        # Examples are templated and tokenized above; packing (if any) is ours, not TRL's.
+        dataset_kwargs={"skip_prepare_dataset": True},
     )
 
     trainer = SFTTrainer(
         model=model,
         args=args,
-        train_dataset=dataset["train"],
-        eval_dataset=dataset["validation"],
+        train_dataset=train_dataset,
+        eval_dataset=eval_dataset,
         peft_config=lora_config,
-        dataset_text_field="text",
-        max_seq_length=cfg.max_length,
         tokenizer=tokenizer,
-        packing=False,
+        data_collator=data_collator,
     )
 
     trainer.train()
@@ -188,6 +370,8 @@ def main():
 
     with open(os.path.join(cfg.output_dir, "train_state.json"), "w", encoding="utf-8") as f:
         json.dump(trainer.state.log_history, f, indent=2)
+    # Memoize the content hash now, so the service's first startup does not read the weights to hash them.
+    model_content_hash(cfg.output_dir)
 
 
 if __name__ == "__main__":
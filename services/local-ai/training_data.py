@@ -0,0 +1,288 @@
+"""Canonical columnar format for the fine-tuning datasets.
+
+The JSONL files in data/finetune keep whatever keys their source used
+(prompt/input/question/instruction, query/document, ...). ``convert_jsonl``
+maps every row onto the declared schema of its model, validates it and
+writes an uncompressed Arrow IPC stream to ``arrow/<name>.arrow`` next to the
+JSONL. A bad row fails the conversion with its file and line number instead
+of failing mid-training. ``load_table`` memory-maps those files and callers
+read its columns; ``datasets`` reads the same format zero-copy with
+``Dataset.from_file``.
+
+Schemas (SCHEMA_VERSION 1):
+- classifier: text (string), label (string, one of CLASSIFIER_LABELS)
+- sft: messages (list of {role, content}); needs a user turn and must end with an assistant turn
+- pairs: text_1 (string), text_2 (string), label (float32, 1.0 = related)
+
+An Arrow file records the size and mtime of the JSONL it was built from.
+``resolve`` only substitutes it while it is still current.
+"""
+
+import json
+import os
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import pyarrow as pa
+
+SCHEMA_VERSION = 1
+COLUMNAR_DIR = "arrow"
+COLUMNAR_SUFFIX = ".arrow"
+BATCH_ROWS = 8192
+
+# Must match classifier.LABELS (not imported here to keep this module free of torch).
+CLASSIFIER_LABELS = ("eligible", "conditionally_eligible", "not_eligible", "insufficient_information")
+
+# JSONL file name prefix -> dataset kind.
+KIND_BY_PREFIX = {
+    "model2_classifier": "classifier",
+    "dispute_classifier": "classifier",
+    "custom_classifier": "classifier",
+    "model1_sft": "sft",
+    "credit_ai_llm": "sft",
+    "custom_sft": "sft",
+    "model3_pairs": "pairs",
+    "embedding_pairs": "pairs",
+    "custom_pairs": "pairs",
+}
+
+SFT_SYSTEM_KEYS = ("system", "system_prompt")
+SFT_PROMPT_KEYS = ("prompt", "input", "question", "instruction", "user")
+SFT_RESPONSE_KEYS = ("response", "output", "completion", "answer", "assistant")
+PAIR_FIRST_KEYS = ("text_1", "anchor", "query", "text_a")
+PAIR_SECOND_KEYS = ("text_2", "positive", "document", "text_b")
+
+MESSAGE_TYPE = pa.struct([("role", pa.string()), ("content", pa.string())])
+SCHEMAS = {
+    "classifier": [pa.field("text", pa.string(), nullable=False), pa.field("label", pa.string(), nullable=False)],
+    "sft": [pa.field("messages", pa.list_(MESSAGE_TYPE), nullable=False)],
+    "pairs": [
+        pa.field("text_1", pa.string(), nullable=False),
+        pa.field("text_2", pa.string(), nullable=False),
+        pa.field("label", pa.float32(), nullable=False),
+    ],
+}
+
+
+class SchemaError(ValueError):
+    """A row or file that does not match the declared schema."""
+
+
+def schema(kind: str, metadata: Optional[Dict[str, str]] = None) -> pa.Schema:
+    if kind not in SCHEMAS:
+        raise SchemaError(f"Unknown dataset kind {kind!r}; expected one of {sorted(SCHEMAS)}")
+    return pa.schema(SCHEMAS[kind], metadata={"kind": kind, "schema_version": str(SCHEMA_VERSION), **(metadata or {})})
+
+
+def stringify_value(value: Any) -> str:
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False, indent=2)
+    return str(value)
+
+
+def first_value(row: Dict[str, Any], keys: Tuple[str, ...]) -> Any:
+    for key in keys:
+        if row.get(key):
+            return row[key]
+    return None
+
+
+def canonical_classifier(row: Dict[str, Any]) -> Dict[str, Any]:
+    text = row.get("text")
+    label = row.get("label")
+    if not isinstance(text, str) or not text.strip():
+        raise SchemaError("'text' must be a non-empty string")
+    if label not in CLASSIFIER_LABELS:
+        raise SchemaError(f"unknown label {label!r}")
+    return {"text": text, "label": label}
+
+
+def canonical_sft(row: Dict[str, Any]) -> Dict[str, Any]:
+    if isinstance(row.get("messages"), list):
+        messages = []
+        for message in row["messages"]:
+            if not isinstance(message, dict) or not message.get("role"):
+                raise SchemaError("every message needs a role")
+            messages.append({"role": str(message["role"]), "content": stringify_value(message.get("content") or "")})
+    else:
+        messages = []
+        for role, keys in (("system", SFT_SYSTEM_KEYS), ("user", SFT_PROMPT_KEYS), ("assistant", SFT_RESPONSE_KEYS)):
+            value = first_value(row, keys)
+            if value:
+                messages.append({"role": role, "content": stringify_value(value)})
+    roles = [message["role"] for message in messages]
+    if "user" not in roles or roles[-1] != "assistant":
+        raise SchemaError(f"needs a user turn and a final assistant turn, got roles {roles}")
+    return {"messages": messages}
+
+
+def canonical_pairs(row: Dict[str, Any]) -> Dict[str, Any]:
+    text_1 = first_value(row, PAIR_FIRST_KEYS)
+    text_2 = first_value(row, PAIR_SECOND_KEYS)
+    if not isinstance(text_1, str) or not isinstance(text_2, str):
+        raise SchemaError(f"needs two texts (one of {PAIR_FIRST_KEYS} and one of {PAIR_SECOND_KEYS})")
+    label = row.get("label", row.get("score", 1.0))
+    try:
+        label = float(label)
+    except (TypeError, ValueError):
+        raise SchemaError(f"label {label!r} is not a number") from None
+    return {"text_1": text_1, "text_2": text_2, "label": label}
+
+
+CANONICAL = {
+    "classifier": canonical_classifier,
+    "sft": canonical_sft,
+    "pairs": canonical_pairs,
+}
+
+
+def kind_for(path: str) -> Optional[str]:
+    name = os.path.basename(path)
+    for prefix, kind in KIND_BY_PREFIX.items():
+        if name.startswith(prefix):
+            return kind
+    return None
+
+
+def columnar_path(jsonl_path: str) -> str:
+    directory, name = os.path.split(jsonl_path)
+    return os.path.join(directory, COLUMNAR_DIR, os.path.splitext(name)[0] + COLUMNAR_SUFFIX)
+
+
+def source_stamp(path: str) -> Dict[str, str]:
+    stat = os.stat(path)
+    return {"source_size": str(stat.st_size), "source_mtime_ns": str(stat.st_mtime_ns)}
+
+
+def iter_canonical(jsonl_path: str, kind: str) -> Iterator[Dict[str, Any]]:
+    canonical = CANONICAL[kind]
+    with open(jsonl_path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield canonical(json.loads(line))
+            except ValueError as exc:
+                raise SchemaError(f"{jsonl_path}:{line_no}: {exc}") from None
+
+
+def convert_jsonl(jsonl_path: str, kind: Optional[str] = None, output: Optional[str] = None) -> Tuple[str, int]:
+    """Validate ``jsonl_path`` against its schema and write the Arrow copy; returns (path, rows)."""
+    kind = kind or kind_for(jsonl_path)
+    if kind is None:
+        raise SchemaError(f"{jsonl_path}: cannot tell the dataset kind from the file name; pass kind")
+    output = output or columnar_path(jsonl_path)
+    target = schema(kind, source_stamp(jsonl_path))
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+
+    tmp = f"{output}.tmp-{os.getpid()}"
+    rows = 0
+    try:
+        with pa.OSFile(tmp, "wb") as sink, pa.ipc.new_stream(sink, target) as writer:
+            batch: List[Dict[str, Any]] = []
+            for row in iter_canonical(jsonl_path, kind):
+                batch.append(row)
+                if len(batch) >= BATCH_ROWS:
+                    writer.write_batch(pa.RecordBatch.from_pylist(batch, schema=target))
+                    rows += len(batch)
+                    batch = []
+            if batch:
+                writer.write_batch(pa.RecordBatch.from_pylist(batch, schema=target))
+                rows += len(batch)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    os.replace(tmp, output)
+    return output, rows
+
+
+def read_schema(path: str) -> pa.Schema:
+    with pa.memory_map(path) as source:
+        return pa.ipc.open_stream(source).schema
+
+
+def is_current(jsonl_path: str) -> bool:
+    """Whether the Arrow copy of ``jsonl_path`` exists and was built from its current contents."""
+    path = columnar_path(jsonl_path)
+    if not os.path.exists(path) or not os.path.exists(jsonl_path):
+        return False
+    metadata = read_schema(path).metadata or {}
+    stamp = {key.encode(): value.encode() for key, value in source_stamp(jsonl_path).items()}
+    return all(metadata.get(key) == value for key, value in stamp.items()) and (
+        metadata.get(b"schema_version") == str(SCHEMA_VERSION).encode()
+    )
+
+
+def resolve(paths: List[str]) -> List[str]:
+    """The Arrow copies of ``paths`` if every one is current, otherwise ``paths`` unchanged."""
+    if paths and all(path.endswith(COLUMNAR_SUFFIX) or is_current(path) for path in paths):
+        return [path if path.endswith(COLUMNAR_SUFFIX) else columnar_path(path) for path in paths]
+    return paths
+
+
+def check_schema(path: str, kind: Optional[str] = None) -> pa.Schema:
+    schema_ = read_schema(path)
+    metadata = schema_.metadata or {}
+    if metadata.get(b"schema_version") != str(SCHEMA_VERSION).encode():
+        raise SchemaError(f"{path}: schema version {metadata.get(b'schema_version')!r}, expected {SCHEMA_VERSION}")
+    if kind and metadata.get(b"kind") != kind.encode():
+        raise SchemaError(f"{path}: holds {metadata.get(b'kind')!r} rows, expected {kind!r}")
+    return schema_
+
+
+def read_table(path: str, kind: Optional[str] = None) -> pa.Table:
+    """Memory-mapped table; its buffers point into the file rather than being copied."""
+    check_schema(path, kind)
+    return pa.ipc.open_stream(pa.memory_map(path)).read_all()
+
+
+def load_table(path: str, kind: Optional[str] = None) -> pa.Table:
+    """Canonical columns of a JSONL file, memory-mapped from its Arrow copy when that is current.
+
+    Otherwise the JSONL rows are mapped onto the schema here (the only place
+    source keys are probed), so callers read ``table.column("text_1")`` either
+    way. A missing file is an empty table.
+    """
+    kind = kind or kind_for(path)
+    if kind is None:
+        raise SchemaError(f"{path}: cannot tell the dataset kind from the file name; pass kind")
+    (resolved,) = resolve([path])
+    if resolved.endswith(COLUMNAR_SUFFIX):
+        return read_table(resolved, kind)
+    target = schema(kind)
+    if not os.path.exists(path):
+        return target.empty_table()
+    return pa.Table.from_pylist(list(iter_canonical(path, kind)), schema=target)
+
+
+def load_dataset_dict(data_files: Dict[str, List[str]]):
+    """``datasets.DatasetDict`` of ``data_files``, memory-mapping the Arrow copies.
+
+    All splits must resolve to Arrow for it to be used; otherwise every split
+    is read from JSONL, so the splits always share one set of columns.
+    """
+    from datasets import Dataset, DatasetDict, concatenate_datasets, load_dataset
+
+    resolved = {split: resolve(list(paths)) for split, paths in data_files.items()}
+    if not all(path.endswith(COLUMNAR_SUFFIX) for paths in resolved.values() for path in paths):
+        return load_dataset("json", data_files=data_files)
+    splits = {}
+    for split, paths in resolved.items():
+        for original, path in zip(data_files[split], paths):
+            check_schema(path, kind_for(original))
+        parts = [Dataset.from_file(path) for path in paths]
+        splits[split] = parts[0] if len(parts) == 1 else concatenate_datasets(parts)
+    print(f"Memory-mapping columnar datasets: {', '.join(sorted({p for ps in resolved.values() for p in ps}))}")
+    return DatasetDict(splits)
+
+
+def export_columnar(jsonl_paths: List[str]) -> Dict[str, int]:
+    """Convert each file whose kind is known; returns rows per written Arrow file."""
+    written = {}
+    for path in jsonl_paths:
+        if kind_for(path) and os.path.exists(path):
+            output, rows = convert_jsonl(path)
+            written[output] = rows
+    return written